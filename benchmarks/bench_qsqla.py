@@ -0,0 +1,277 @@
+"""
+Benchmarks for filter parsing and query building.
+
+Run with::
+
+    $ python benchmarks/bench_qsqla.py --rows 2000000 --output results.json
+
+The results are written as JSON, one entry per benchmark with the best and
+mean time per call in seconds. Pass ``--compare`` with the results of a
+previous run to exit with a non-zero status if a benchmark got slower than
+``--threshold`` times its previous best. The times are compared relative to
+the ``reference`` benchmark of the same run, a pure Python workload which
+does not depend on qsqla, so runs on faster or slower machines compare.
+``--report-only`` reports regressions without failing.
+
+CI reports regressions against ``benchmarks/baseline.json``. Regenerate it
+with the arguments used in ``.travis.yml`` after an intended change of
+performance::
+
+    $ python benchmarks/bench_qsqla.py --rows 100000 --min-time 0.05 \
+        --output benchmarks/baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import timeit
+from datetime import datetime, timedelta
+
+import sqlalchemy
+from sqlalchemy import (Column, DateTime, ForeignKey, Integer, MetaData,
+                        String, Table, create_engine)
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import qsqla.query as qsqla  # NOQA
+from qsqla.cache import StatementCache  # NOQA
+
+
+Base = declarative_base()
+
+
+user_pet = Table('user_pet',
+                 Base.metadata,
+                 Column('user_u_id', Integer, ForeignKey('user_table.u_id')),
+                 Column('pet_p_id', Integer, ForeignKey('pet.p_id'))
+                 )
+
+
+class User(Base):
+    __tablename__ = 'user_table'
+    u_id = Column(Integer, primary_key=True)
+    u_name = Column(String(16))
+    u_date = Column(DateTime)
+    pets = relationship("Pet", secondary=user_pet)
+
+
+class Pet(Base):
+    __tablename__ = 'pet'
+    p_id = Column(Integer, primary_key=True)
+    p_name = Column(String(16))
+
+
+def wide_table(columns):
+    types = [Integer, String(32), DateTime]
+    cols = [Column('c{}'.format(i), types[i % 3]) for i in range(columns)]
+    return Table('wide_{}'.format(columns), MetaData(),
+                 Column('id', Integer, primary_key=True), *cols)
+
+
+def delivery_table(metadata):
+    return Table('delivery', metadata,
+                 Column('id', Integer, primary_key=True),
+                 Column('delivery_id', Integer, index=True),
+                 Column('delivery_category', String(32)),
+                 Column('delivery_date', DateTime, index=True),
+                 Column('row_count', Integer))
+
+
+def create_fixture(path, rows):
+    """Create an SQLite database with `rows` deliveries, reused if present."""
+    engine = create_engine("sqlite:///{}".format(path))
+    metadata = MetaData()
+    table = delivery_table(metadata)
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        count = conn.execute(sqlalchemy.select([sqlalchemy.func.count()])
+                             .select_from(table)).scalar()
+        start = datetime(2016, 1, 1)
+        categories = ['Locations', 'Products', 'Sales', 'Stocks']
+        chunk = 50000
+        for offset in range(count, rows, chunk):
+            conn.execute(table.insert(), [
+                {"id": i + 1,
+                 "delivery_id": i // 10,
+                 "delivery_category": categories[i % len(categories)],
+                 "delivery_date": start + timedelta(minutes=i),
+                 "row_count": i % 1000}
+                for i in range(offset, min(offset + chunk, rows))])
+    return engine, table
+
+
+def filters_for(table, count):
+    """Return `count` filters on the columns of a wide table."""
+    filters = []
+    cols = [col for col in table.columns if col.name != 'id']
+    for i in range(count):
+        col = cols[i % len(cols)]
+        if isinstance(col.type, Integer):
+            filters.append({"name": col.name, "op": "gt", "val": str(i)})
+        elif isinstance(col.type, DateTime):
+            filters.append({"name": col.name, "op": "lt",
+                            "val": "2016-01-01T01:00:00"})
+        else:
+            filters.append({"name": col.name, "op": "like", "val": "%a%"})
+    return filters
+
+
+REFERENCE = "reference"
+
+REFERENCE_DATA = [{"name": "c{}".format(i), "op": "gt", "val": str(i)}
+                  for i in range(50)]
+
+
+def reference():
+    """Serialize and sort data, independent of qsqla and the database."""
+    data = json.loads(json.dumps(REFERENCE_DATA))
+    return sorted(data, key=lambda f: (f["val"], f["name"]))
+
+
+def benchmarks(engine, deliveries):
+    """Yield (name, callable) pairs of all benchmarks."""
+    yield REFERENCE, reference
+    yield "split_operator", lambda: qsqla.split_operator("field_name__gte")
+
+    args = dict(("c{}__gt".format(i), str(i)) for i in range(20))
+    args["pets__with__p_name__eq"] = "Hooch"
+    yield "build_filters/20", lambda: qsqla.build_filters(args)
+
+    cache = StatementCache()
+    for columns in (10, 100, 500):
+        table = wide_table(columns)
+        sel = table.select()
+        schema = qsqla.QuerySchema(sel)
+        for count in (1, 10, 50):
+            filters = filters_for(table, count)
+            yield ("core_query/{}cols/{}filters".format(columns, count),
+                   lambda sel=sel, filters=filters: qsqla.core_query(sel, filters))
+            yield ("query/{}cols/{}filters".format(columns, count),
+                   lambda sel=sel, filters=filters: qsqla.query(
+                       sel, filters, order="id", limit=100))
+            yield ("query/schema/{}cols/{}filters".format(columns, count),
+                   lambda schema=schema, filters=filters: qsqla.query(
+                       schema, filters, order="id", limit=100))
+            yield ("cache/{}cols/{}filters".format(columns, count),
+                   lambda sel=sel, filters=filters: cache.query(
+                       sel, filters, order="id", limit=100))
+
+    table = wide_table(10)
+    for size in (10, 1000, 20000):
+        values = ",".join(str(i) for i in range(size))
+        filters = [{"name": "c0", "op": "in", "val": values}]
+        yield ("core_query/in/{}".format(size),
+               lambda filters=filters: qsqla.core_query(table.select(), filters))
+
+    filters = [{"name": "u_name", "op": "eq", "val": "Oli"},
+               {"name": "u_date", "op": "gt", "val": "2016-01-01T01:00:00"}]
+    yield "orm_query/2filters", lambda: qsqla.orm_query(User, filters)
+    with_filters = [{"name": "pets", "op": "with", "val": "p_name__eq=Hooch"},
+                    {"name": "pets", "op": "with", "val": "p_id__gt=3"}]
+    yield "orm_query/with", lambda: qsqla.orm_query(User, with_filters)
+
+    sel = deliveries.select()
+    cases = [
+        ("execute/eq", [{"name": "delivery_id", "op": "eq", "val": "4711"}], {}),
+        ("execute/range_order", [
+            {"name": "delivery_date", "op": "gte", "val": "2016-02-01T00:00:00"},
+            {"name": "delivery_date", "op": "lt", "val": "2016-02-02T00:00:00"}],
+         {"order": "delivery_date"}),
+        ("execute/deep_offset", [], {"order": "id", "offset": 100000,
+                                     "limit": 100}),
+        ("execute/in", [{"name": "delivery_id", "op": "in",
+                         "val": ",".join(str(i) for i in range(0, 5000, 7))}],
+         {}),
+    ]
+    for name, filters, kwargs in cases:
+        def run(filters=filters, kwargs=kwargs):
+            with engine.connect() as conn:
+                return conn.execute(qsqla.query(sel, filters, **kwargs)).fetchall()
+        yield name, run
+
+
+def measure(func, min_time):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    times = [t / number for t in timer.repeat(repeat=5, number=number)]
+    return {"best": min(times), "mean": sum(times) / len(times),
+            "number": number}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000000,
+                        help="number of rows of the SQLite fixture")
+    parser.add_argument("--fixture", default=os.path.join(
+        tempfile.gettempdir(), "qsqla_bench.sqlite"),
+        help="path of the SQLite fixture, reused between runs")
+    parser.add_argument("--min-time", type=float, default=0.2,
+                        help="minimum time in seconds per repetition")
+    parser.add_argument("--filter", default="",
+                        help="only run benchmarks containing this string")
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--compare", help="results of a previous run")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="allowed slowdown compared to --compare")
+    parser.add_argument("--report-only", action="store_true",
+                        help="report regressions without failing")
+    args = parser.parse_args(argv)
+
+    engine, deliveries = create_fixture(args.fixture, args.rows)
+    results = {}
+    for name, func in benchmarks(engine, deliveries):
+        if args.filter not in name and name != REFERENCE:
+            continue
+        results[name] = measure(func, args.min_time)
+        sys.stderr.write("{:<45} {:>12.1f} us\n".format(
+            name, results[name]["best"] * 1e6))
+
+    output = {"python": platform.python_version(),
+              "sqlalchemy": sqlalchemy.__version__,
+              "rows": args.rows,
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    else:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)["results"]
+        regressions = compare(results, previous, args.threshold)
+        for name, before, after in regressions:
+            sys.stderr.write(
+                "regression: {} {:.2f}x -> {:.2f}x of {}\n".format(
+                    name, before, after, REFERENCE))
+        return 1 if regressions and not args.report_only else 0
+    return 0
+
+
+def compare(results, previous, threshold):
+    """Return the benchmarks slower than threshold times their previous best.
+
+    :return: a list of tuples of the name and the previous and current best
+        time relative to the reference benchmark of their run.
+    """
+    if REFERENCE not in previous:
+        raise ValueError("previous results lack the {} benchmark".format(
+            REFERENCE))
+    regressions = []
+    for name in sorted(results):
+        if name == REFERENCE or name not in previous:
+            continue
+        before = previous[name]["best"] / previous[REFERENCE]["best"]
+        after = results[name]["best"] / results[REFERENCE]["best"]
+        if after > before * threshold:
+            regressions.append((name, before, after))
+    return regressions
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+from qsqla.execution import stream  # NOQA
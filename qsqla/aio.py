@@ -0,0 +1,107 @@
+"""
+Asyncio Execution
+=================
+
+Helpers executing queries with SQLAlchemy's asyncio extension. The queries
+are built as 2.0 style ``select()`` statements for both the Core and the
+ORM.
+
+.. code::
+
+    engine = create_async_engine("postgresql+asyncpg://...")
+    deliveries = asyncio.Semaphore(5)
+
+    async for rows in stream(engine, sel, filters, semaphore=deliveries):
+        await write(rows)
+
+A semaphore shared by all calls of an endpoint bounds the number of
+connections the endpoint holds at once, so it cannot exhaust the pool.
+"""
+import contextlib
+
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from qsqla.query import query, selects_entity, uses_core
+
+
+@contextlib.asynccontextmanager
+async def acquire(semaphore):
+    """Hold the semaphore if one is given."""
+    if semaphore is None:
+        yield
+    else:
+        async with semaphore:
+            yield
+
+
+@contextlib.asynccontextmanager
+async def connect(bind):
+    """Provide an AsyncConnection for an AsyncEngine or AsyncConnection."""
+    if isinstance(bind, AsyncConnection):
+        yield bind
+    elif isinstance(bind, AsyncSession):
+        yield await bind.connection()
+    else:
+        async with bind.connect() as conn:
+            yield conn
+
+
+@contextlib.asynccontextmanager
+async def session_scope(bind):
+    """Provide an AsyncSession for an AsyncSession, AsyncEngine or AsyncConnection."""
+    if isinstance(bind, AsyncSession):
+        yield bind
+    else:
+        async with AsyncSession(bind) as session:
+            yield session
+
+
+async def stream(bind, selectable_or_model, filters, batch_size=1000,
+                 semaphore=None, upper_bound_limit=None, **kwargs):
+    """Execute a query asynchronously and yield the rows in batches.
+
+    :param bind: an AsyncEngine, AsyncConnection or AsyncSession.
+    :param selectable_or_model: an SQLAlchemy Core Selectable, ORM Model or
+        a :class:`qsqla.query.QuerySchema` of either
+    :param filters: a list of filters produced by build_filters
+    :param batch_size: int. The number of rows per batch.
+    :param semaphore: an ``asyncio.Semaphore`` held while the query runs.
+    :param upper_bound_limit: int. An absolute upper bound limit to use.
+        Disabled by default.
+    :param kwargs: further arguments of :func:`qsqla.query.query`
+
+    :return: an async generator of lists of rows or ORM objects, if the
+        query selects the ORM Model.
+    """
+    stm = query(selectable_or_model, filters,
+                upper_bound_limit=upper_bound_limit, future=True, **kwargs)
+    async with acquire(semaphore):
+        if uses_core(selectable_or_model):
+            async with connect(bind) as conn:
+                result = await conn.stream(stm)
+                async for rows in result.partitions(batch_size):
+                    yield rows
+        else:
+            async with session_scope(bind) as session:
+                result = await session.stream(stm)
+                if selects_entity(stm):
+                    result = result.scalars()
+                async for rows in result.partitions(batch_size):
+                    yield rows
+
+
+async def execute(bind, selectable_or_model, filters, semaphore=None,
+                  **kwargs):
+    """Execute a query asynchronously and return all rows.
+
+    Takes the arguments of :func:`stream`, the upper bound limit applies as
+    in :func:`qsqla.query.query`.
+
+    :return: a list of rows or ORM objects.
+    """
+    kwargs.setdefault("upper_bound_limit", 10000)
+    rows = []
+    async for batch in stream(bind, selectable_or_model, filters,
+                              semaphore=semaphore, **kwargs):
+        rows.extend(batch)
+    return rows
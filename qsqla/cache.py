@@ -0,0 +1,227 @@
+"""
+Statement Cache
+===============
+
+Building a statement with :func:`qsqla.query.query` aliases the selectable,
+resolves every column and constructs a new ``select()`` for each request.
+Most applications only ever see a small number of different filter shapes,
+i.e. the same fields and operators with different values.
+
+:class:`StatementCache` builds the statement once per shape with bound
+parameters in place of the filter values and keeps it in a bounded LRU
+cache. Subsequent requests with the same shape only convert their values.
+Requests with ``in`` or ``not_in`` lists longer than the large IN threshold
+are not cached, their values are rendered into the statement, see
+:func:`qsqla.query.in_values`.
+
+.. code::
+
+    cache = StatementCache(maxsize=256)
+    stm, params = cache.query(sel, build_filters(request.args), limit=10)
+    rows = connection.execute(stm, params)
+
+    # ORM models
+    q, params = cache.query(User, filters)
+    users = q.params(params).with_session(session).all()
+
+"""
+import collections
+import threading
+
+import sqlalchemy
+
+from qsqla.instrumentation import filter_shape
+from qsqla.query import (LARGE_IN_THRESHOLD, OPERATORS, UNARY_OPERATORS,
+                         check_mapped_attribute, convert_values, get_converter,
+                         get_limit, get_subquery, get_value_conversion,
+                         keep_value, paginate, relationship_exists, resolve,
+                         select_from, select_model)
+
+
+CacheInfo = collections.namedtuple(
+    "CacheInfo", ["hits", "misses", "evictions", "maxsize", "currsize"])
+
+
+class LRUCache(object):
+    """A thread-safe, bounded mapping evicting the least recently used entry.
+
+    :param maxsize: int. The maximum number of entries.
+    """
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def cache_info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.evictions,
+                             self.maxsize, len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        """Return the entry of the key or None and count a hit or miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            return self._entries.pop(key, None)
+
+
+class StatementCache(LRUCache):
+    """A bounded LRU cache of statements keyed by filter shape.
+
+    The cache key consists of the selectable or model, the normalized
+    name/operator pairs of the filters, the order field and direction and
+    whether a limit or offset is applied. Values of the filters, the limit
+    and the offset are bound as parameters on execution. ``search`` filters
+    use the search configurations of a :class:`qsqla.query.QuerySchema`.
+
+    :param maxsize: int. The maximum number of cached statements.
+    """
+
+    def query(self, selectable_or_model, filters, limit=None, offset=None,
+              order=None, asc=True, upper_bound_limit=10000,
+              large_in_threshold=None):
+        """Cached equivalent of :func:`qsqla.query.query`.
+
+        :param large_in_threshold: int. The number of values of ``in`` and
+            ``not_in`` filters above which the statement is built uncached
+            with a VALUES construct, defaults to the threshold of a
+            :class:`qsqla.query.QuerySchema` or
+            :data:`qsqla.query.LARGE_IN_THRESHOLD`.
+
+        :raises KeyError: if key is not available in query
+        :raises ValueError: if value cannot be converted to Column Type
+        :raises TypeError: if filter is not available for SQLAlchemy Column Type
+
+        :return: a tuple of the statement and a dict with the parameters
+            to execute it with.
+        """
+        filters = sorted(filters, key=filter_shape)
+        limit = get_limit(limit, upper_bound_limit)
+        offset = offset or None
+        if large_in_threshold is None:
+            large_in_threshold = getattr(selectable_or_model,
+                                         "large_in_threshold",
+                                         LARGE_IN_THRESHOLD)
+        large = set(i for i, f in enumerate(filters)
+                    if f["op"] in ("in", "not_in") and
+                    len(convert_values(keep_value, f["val"])) >
+                    large_in_threshold)
+        if large:
+            # the values of large lists are part of the statement
+            entry = self._build(selectable_or_model, filters, order, asc,
+                                limit is not None, offset is not None,
+                                large, large_in_threshold)
+            return self.bind(entry, filters, limit, offset)
+
+        key = (selectable_or_model,
+               tuple(filter_shape(f) for f in filters),
+               order.lower() if order else None,
+               bool(asc),
+               limit is not None,
+               offset is not None)
+
+        entry = self.get(key)
+        if entry is None:
+            entry = self._build(selectable_or_model, filters, order, asc,
+                                limit is not None, offset is not None)
+            self.put(key, entry)
+        return self.bind(entry, filters, limit, offset)
+
+    def bind(self, entry, filters, limit, offset):
+        """Return the statement of an entry and the parameters of the filters."""
+        statement, binders = entry
+        params = {}
+        for (name, convert, converter), f in zip(binders, filters):
+            if name is not None:
+                value = f["val"]
+                if f["op"] == "with":
+                    value = value.rsplit("=", 1)[1]
+                params[name] = convert(converter, value)
+        if limit is not None:
+            params["_limit"] = limit
+        if offset is not None:
+            params["_offset"] = int(offset)
+        return statement, params
+
+    def _build(self, selectable_or_model, filters, order, asc, has_limit,
+               has_offset, large=(), large_in_threshold=None):
+        use_core, target, lookup = resolve(selectable_or_model)
+        search = getattr(selectable_or_model, "search", {})
+
+        restrictions = []
+        relationships = {}
+        binders = []
+        for i, f in enumerate(filters):
+            name = "p{}".format(i)
+            col = lookup(f["name"])
+            if f["op"] in UNARY_OPERATORS:
+                restrictions.append(OPERATORS[f["op"]](col))
+                binders.append((None, None, None))
+            elif i in large:
+                restrictions.append(OPERATORS[f["op"]](
+                    col, f["val"], threshold=large_in_threshold))
+                binders.append((None, None, None))
+            elif f["op"] == "with":
+                check_mapped_attribute(col)
+                inner_col, inner_op_val = get_subquery(col, f["val"])
+                inner_op = inner_op_val[0]
+                value = sqlalchemy.bindparam(
+                    name, expanding=inner_op in ("in", "not_in"))
+                relationships.setdefault(f["name"].lower(), (col, []))[1] \
+                    .append(OPERATORS[inner_op](inner_col, value))
+                binders.append((name, get_value_conversion(inner_op),
+                                get_converter(inner_col.type)))
+            elif f["op"] == "search":
+                value = sqlalchemy.bindparam(name)
+                restrictions.append(OPERATORS[f["op"]](
+                    col, value, config=search.get(f["name"].lower())))
+                binders.append((name, get_value_conversion(f["op"]),
+                                get_converter(col.type)))
+            else:
+                value = sqlalchemy.bindparam(
+                    name, expanding=f["op"] in ("in", "not_in"))
+                restrictions.append(OPERATORS[f["op"]](col, value))
+                binders.append((name, get_value_conversion(f["op"]),
+                                get_converter(col.type)))
+        restrictions.extend(relationship_exists(col, inner)
+                            for col, inner in relationships.values())
+
+        if use_core:
+            filtered = select_from(target, restrictions)
+        else:
+            filtered = select_model(target, restrictions)
+        order_cols = [lookup(order)] if order else []
+
+        statement = paginate(
+            filtered, order_cols, asc,
+            sqlalchemy.bindparam("_limit") if has_limit else None,
+            sqlalchemy.bindparam("_offset") if has_offset else None)
+        return statement, binders
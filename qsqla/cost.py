@@ -0,0 +1,219 @@
+"""
+Cost Guard
+==========
+
+:class:`CostGuard` asks the database for the plan of a statement before it
+is executed and raises a :class:`QueryCostError` if the estimated number of
+rows or the estimated cost exceeds the budget of the endpoint.
+
+.. code::
+
+    guard = CostGuard(max_rows=1000000)
+    rows = guard.execute(connection, query(sel, filters))
+
+The estimate is produced by an estimator registered for the dialect of the
+connection in :data:`ESTIMATORS`, or passed to the guard. An estimator is a
+callable taking a connection, the compiled statement and its parameters
+and returning an :class:`Estimate`, whose fields are None if unknown.
+Estimates are cached per cache key of the statement, i.e. per filter shape
+and not per value, so a cached estimate does not compile the statement.
+
+Statements of :class:`qsqla.cache.StatementCache` are checked with the
+parameters they are executed with:
+
+.. code::
+
+    statement, params = statements.query(sel, filters)
+    rows = guard.execute(connection, statement, params)
+"""
+import collections
+import json
+import re
+
+from sqlalchemy import Table
+from sqlalchemy.sql.elements import _truncated_label
+from sqlalchemy.sql.selectable import AliasedReturnsRows
+from sqlalchemy.sql.visitors import iterate
+
+from qsqla.cache import LRUCache
+
+
+Estimate = collections.namedtuple("Estimate", ["rows", "cost"])
+
+
+class QueryCostError(ValueError):
+    """Raised if the estimated cost of a query exceeds the budget."""
+
+    def __init__(self, message, estimate):
+        super(QueryCostError, self).__init__(message)
+        self.estimate = estimate
+
+
+def explain_params(compiled):
+    params = compiled.params
+    if compiled.positional:
+        return tuple(params[name] for name in compiled.positiontup)
+    return params
+
+
+def postgresql_estimator(conn, compiled, params):
+    """Estimate with ``EXPLAIN (FORMAT JSON)``."""
+    result = conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + str(compiled),
+                                  params).scalar()
+    if isinstance(result, str):
+        result = json.loads(result)
+    plan = result[0]["Plan"]
+    return Estimate(plan["Plan Rows"], plan["Total Cost"])
+
+
+SQLITE_STEP = re.compile(r'^(SCAN|SEARCH) (?:TABLE )?(\S+)(.*)$')
+
+
+def from_names(compiled):
+    """Map the rendered names of the aliases of a statement to their tables.
+
+    Aliases of a table map to its name, subqueries and CTEs to None as their
+    rows are read by their own steps of the plan.
+    """
+    names = {}
+    for element in iterate(compiled.statement):
+        if isinstance(element, AliasedReturnsRows):
+            name = element.name
+            if isinstance(name, _truncated_label):
+                name = compiled._truncated_identifier("alias", name)
+            if isinstance(element.element, Table):
+                names[name] = element.element.name
+            else:
+                names[name] = None
+    return names
+
+
+def sqlite_table_rows(conn, table):
+    """Estimate the rows of an SQLite table, None if it is no table."""
+    exists = conn.exec_driver_sql(
+        "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (table,)).scalar()
+    if not exists:
+        return None
+    rows = conn.exec_driver_sql(
+        'SELECT max(rowid) FROM "{}"'.format(table.replace('"', '""'))).scalar()
+    return rows or 0
+
+
+def sqlite_estimator(conn, compiled, params):
+    """Estimate with ``EXPLAIN QUERY PLAN``.
+
+    SQLite does not report estimates, so the rows are derived from the
+    plan: a SCAN reads the whole table, a SEARCH with a range a quarter of
+    it and a SEARCH for equality a single row. The cost is the number of
+    rows read. The plan names aliased tables by their alias, which is mapped
+    back to the table. If a step reads from a table which cannot be found,
+    the estimate is unknown.
+    """
+    plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled),
+                                params).fetchall()
+    names = from_names(compiled)
+    rows = 0
+    for step in plan:
+        match = SQLITE_STEP.match(step[-1])
+        if match is None or step[-1] == "SCAN CONSTANT ROW":
+            continue
+        operation, table, detail = match.groups()
+        table = names.get(table, table)
+        if table is None:
+            continue
+        table_rows = sqlite_table_rows(conn, table)
+        if table_rows is None:
+            return Estimate(None, None)
+        if operation == "SCAN":
+            rows += table_rows
+        elif ">" in detail or "<" in detail:
+            rows += table_rows // 4
+        else:
+            rows += min(table_rows, 1)
+    return Estimate(rows, rows)
+
+
+ESTIMATORS = {
+    "postgresql": postgresql_estimator,
+    "sqlite": sqlite_estimator,
+}
+
+
+class CostGuard(object):
+    """Reject statements whose estimated rows or cost exceed a budget.
+
+    :param max_rows: The maximum estimated number of rows or None.
+    :param max_cost: The maximum estimated cost or None. The unit depends on
+        the estimator.
+    :param estimator: An estimator used instead of :data:`ESTIMATORS`.
+    :param maxsize: int. The maximum number of cached estimates.
+    """
+
+    def __init__(self, max_rows=None, max_cost=None, estimator=None,
+                 maxsize=512):
+        self.max_rows = max_rows
+        self.max_cost = max_cost
+        self.estimator = estimator
+        self.estimates = LRUCache(maxsize)
+
+    def estimate(self, conn, statement, params=None):
+        """Return the cached or new estimate of a statement.
+
+        :param params: a dict of the parameters the statement is executed
+            with, which are not bound to the statement.
+
+        :return: an :class:`Estimate` or None if no estimator is available
+            for the dialect of the connection.
+        """
+        statement = getattr(statement, "statement", statement)
+        estimator = self.estimator or ESTIMATORS.get(conn.dialect.name)
+        if estimator is None:
+            return None
+        cache_key = statement._generate_cache_key()
+        if cache_key is not None:
+            key = (conn.dialect.name, cache_key.key)
+        else:
+            key = (conn.dialect.name,
+                   str(statement.compile(dialect=conn.dialect)))
+        estimate = self.estimates.get(key)
+        if estimate is None:
+            if params:
+                statement = statement.params(params)
+            compiled = statement.compile(
+                dialect=conn.dialect,
+                compile_kwargs={"render_postcompile": True})
+            estimate = estimator(conn, compiled, explain_params(compiled))
+            self.estimates.put(key, estimate)
+        return estimate
+
+    def check(self, conn, statement, params=None):
+        """Check the estimate of a statement against the budget.
+
+        :param params: a dict of the parameters the statement is executed
+            with.
+
+        :raises QueryCostError: if the estimate exceeds the budget or is
+            unknown
+        """
+        estimate = self.estimate(conn, statement, params)
+        if estimate is None:
+            return None
+        if (self.max_rows is not None and estimate.rows is None) or \
+                (self.max_cost is not None and estimate.cost is None):
+            raise QueryCostError("query cannot be estimated", estimate)
+        if self.max_rows is not None and estimate.rows > self.max_rows:
+            raise QueryCostError(
+                "query is estimated to return {} rows, the limit is {}".format(
+                    estimate.rows, self.max_rows), estimate)
+        if self.max_cost is not None and estimate.cost > self.max_cost:
+            raise QueryCostError(
+                "query is estimated to cost {}, the limit is {}".format(
+                    estimate.cost, self.max_cost), estimate)
+        return estimate
+
+    def execute(self, conn, statement, *args, **kwargs):
+        """Check a Core statement and execute it on the connection."""
+        params = args[0] if args and isinstance(args[0], dict) else kwargs
+        self.check(conn, statement, params or None)
+        return conn.execute(statement, *args, **kwargs)
@@ -0,0 +1,446 @@
+"""
+Execution
+=========
+
+Helpers executing the statements built by :func:`qsqla.query.query`.
+
+:func:`stream` runs a query with a server-side cursor and yields the rows in
+batches, so the memory used does not depend on the number of rows returned.
+
+.. code::
+
+    for rows in stream(engine, sel, build_filters(request.args), batch_size=500):
+        write(rows)
+
+:func:`execute_many` runs several filtered queries of one selectable in a
+single round trip or concurrently and returns the rows of each query.
+
+.. code::
+
+    by_state, by_category = execute_many(engine, sel, [
+        build_filters({"state": 2}),
+        build_filters({"delivery_category": "Locations"})], limit=10)
+
+:func:`execute_partitioned` splits a query into ranges of an Integer, Date
+or DateTime field and executes them concurrently, merging the rows.
+
+.. code::
+
+    for row in execute_partitioned(engine, sel, filters, "delivery_date",
+                                   partitions=8, order="delivery_date"):
+        write(row)
+
+"""
+import collections
+import concurrent.futures
+import contextlib
+import heapq
+import itertools
+import queue
+import threading
+
+import sqlalchemy.orm
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql.elements import Label
+
+from qsqla.query import (core_query, get_converter, get_limit, nulls_first,
+                         query, selects_entity, uses_core)
+
+
+@contextlib.contextmanager
+def connect(bind):
+    """Provide a connection for an Engine or Connection."""
+    if isinstance(bind, Connection):
+        yield bind
+    else:
+        with bind.connect() as conn:
+            yield conn
+
+
+@contextlib.contextmanager
+def session_scope(bind):
+    """Provide an ORM Session for a Session, Engine or Connection."""
+    if isinstance(bind, sqlalchemy.orm.Session):
+        yield bind
+    else:
+        session = sqlalchemy.orm.Session(bind=bind)
+        try:
+            yield session
+        finally:
+            session.close()
+
+
+def stream(bind, selectable_or_model, filters, batch_size=1000,
+           upper_bound_limit=None, **kwargs):
+    """Execute a query and yield the rows in batches.
+
+    Core queries are executed with ``stream_results``, ORM queries with
+    ``yield_per``, legacy ORM Queries as well as 2.0 style ``select()``
+    statements built with ``future=True``. Thus only ``batch_size`` rows are held in memory at once
+    if the database driver supports server-side cursors.
+
+    :param bind: an Engine or Connection. ORM queries accept a Session too.
+    :param selectable_or_model: an SQLAlchemy Core Selectable, ORM Model or
+        a :class:`qsqla.query.QuerySchema` of either
+    :param filters: a list of filters produced by build_filters
+    :param batch_size: int. The number of rows per batch.
+    :param upper_bound_limit: int. An absolute upper bound limit to use.
+        Disabled by default.
+    :param kwargs: further arguments of :func:`qsqla.query.query`
+
+    :return: a generator of lists of rows or ORM objects.
+    """
+    stm = query(selectable_or_model, filters,
+                upper_bound_limit=upper_bound_limit, **kwargs)
+    if uses_core(selectable_or_model):
+        with connect(bind) as conn:
+            result = conn.execution_options(stream_results=True).execute(stm)
+            try:
+                while True:
+                    rows = result.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                result.close()
+    else:
+        with session_scope(bind) as session:
+            if isinstance(stm, sqlalchemy.orm.Query):
+                objects = stm.with_session(session).yield_per(batch_size)
+            else:
+                objects = session.execute(
+                    stm, execution_options={"yield_per": batch_size})
+                if selects_entity(stm):
+                    objects = objects.scalars()
+            batch = []
+            for obj in objects:
+                batch.append(obj)
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+
+def execute_many(bind, selectable, filters_list, strategy="union",
+                 max_workers=None, **kwargs):
+    """Execute several filtered queries of one Core selectable.
+
+    The ``union`` strategy combines the queries into a single ``UNION ALL``
+    statement, tagging each row with the index of its query in an
+    additional ``_query`` column, and splits the rows afterwards. The
+    ``concurrent`` strategy executes the queries in a thread pool, each on
+    its own connection of the pool of the engine.
+
+    :param bind: an Engine. The ``union`` strategy accepts a Connection too.
+    :param selectable: an SQLAlchemy Core Selectable or a
+        :class:`qsqla.query.QuerySchema` of it
+    :param filters_list: a list of lists of filters produced by build_filters
+    :param strategy: ``"union"`` or ``"concurrent"``
+    :param max_workers: int. The number of threads of the ``concurrent``
+        strategy.
+    :param kwargs: further arguments of :func:`qsqla.query.query` applied to
+        every query
+
+    :raises TypeError: if an ORM Model is passed
+
+    :return: a list with a list of rows per list of filters.
+    """
+    if not uses_core(selectable):
+        raise TypeError("execute_many requires a Core selectable")
+    statements = [query(selectable, filters, **kwargs)
+                  for filters in filters_list]
+    if not statements:
+        return []
+
+    if strategy == "concurrent":
+        if isinstance(bind, Connection):
+            raise ValueError("the concurrent strategy requires an Engine")
+
+        def run(statement):
+            with bind.connect() as conn:
+                return conn.execute(statement).fetchall()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            return list(executor.map(run, statements))
+
+    if strategy != "union":
+        raise ValueError("unknown strategy {}".format(strategy))
+
+    union = sqlalchemy.union_all(*[
+        sqlalchemy.select(sqlalchemy.literal(i).label("_query"),
+                          statement.subquery())
+        for i, statement in enumerate(statements)])
+    columns = dict((col.name.lower(), col) for col in union.selected_columns)
+    order_by = [columns["_query"]]
+    if kwargs.get("order"):
+        order_col = columns[kwargs["order"].lower()]
+        order_by.append(order_col if kwargs.get("asc", True)
+                        else order_col.desc())
+    union = union.order_by(*order_by)
+
+    results = collections.defaultdict(list)
+    with connect(bind) as conn:
+        for row in conn.execute(union):
+            results[row._query].append(row)
+    return [results[i] for i in range(len(statements))]
+
+
+PARTITION_TYPES = (sqlalchemy.types.Integer, sqlalchemy.types.Date,
+                   sqlalchemy.types.DateTime)
+
+
+def selected_column(statement, name):
+    for col in statement.selected_columns:
+        if col.name.lower() == name.lower():
+            return col
+    raise KeyError("column {} not found".format(name))
+
+
+def split_range(low, high, partitions):
+    """Return the points splitting a range into equally sized partitions."""
+    points = []
+    for i in range(1, partitions):
+        if isinstance(low, int):
+            point = low + (high - low) * i // partitions
+        else:
+            point = low + (high - low) * i / partitions
+        if point > low and (not points or point > points[-1]):
+            points.append(point)
+    return points
+
+
+def partition_restrictions(col, points):
+    """Return the restrictions of the partitions split at the points.
+
+    The rows with NULL values are in none of the partitions.
+    """
+    if not points:
+        return [col.isnot(None)]
+    restrictions = [col < points[0]]
+    for lower, upper in zip(points, points[1:]):
+        restrictions.append(sqlalchemy.and_(col >= lower, col < upper))
+    restrictions.append(col >= points[-1])
+    return restrictions
+
+
+class Partition(threading.Thread):
+    """Execute a statement and put batches of its rows on a queue.
+
+    Every partition puts a tuple of itself and a list of rows, an exception
+    or :attr:`done` on the queue.
+    """
+
+    done = object()
+
+    def __init__(self, engine, statement, batch_size, stopped, results):
+        super(Partition, self).__init__(daemon=True)
+        self.engine = engine
+        self.statement = statement
+        self.batch_size = batch_size
+        self.stopped = stopped
+        self.results = results
+
+    def put(self, item):
+        """Put an item on the queue unless the consumer stopped."""
+        while not self.stopped.is_set():
+            try:
+                self.results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(self):
+        try:
+            with self.engine.connect() as conn:
+                result = conn.execution_options(stream_results=True) \
+                    .execute(self.statement)
+                try:
+                    while True:
+                        rows = result.fetchmany(self.batch_size)
+                        if not rows or not self.put((self, rows)):
+                            break
+                finally:
+                    result.close()
+        except Exception as e:
+            self.put((self, e))
+        self.put((self, self.done))
+
+
+def partition_rows(results):
+    """Yield the rows of a single partition."""
+    while True:
+        _, rows = results.get()
+        if rows is Partition.done:
+            return
+        if isinstance(rows, Exception):
+            raise rows
+        for row in rows:
+            yield row
+
+
+def merge_partitions(start, statements, key, asc):
+    """Merge the rows of ordered partitions executed all at once."""
+    return heapq.merge(*[partition_rows(start(statement, queue.Queue(2)))
+                         for statement in statements],
+                       key=lambda row: row._mapping[key], reverse=not asc)
+
+
+def chain_partitions(start, statements, max_workers):
+    """Yield the rows of the partitions one after the other.
+
+    Up to ``max_workers`` partitions are executed ahead.
+    """
+    pending = collections.deque(statements)
+    started = collections.deque()
+    while pending or started:
+        while pending and len(started) < max_workers:
+            started.append(start(pending.popleft(), queue.Queue(2)))
+        for row in partition_rows(started.popleft()):
+            yield row
+
+
+def interleave_partitions(start, statements, max_workers):
+    """Yield the rows of the partitions as they arrive."""
+    results = queue.Queue(max_workers * 2)
+    pending = collections.deque(statements)
+    running = 0
+    while pending or running:
+        while pending and running < max_workers:
+            start(pending.popleft(), results)
+            running += 1
+        _, rows = results.get()
+        if rows is Partition.done:
+            running -= 1
+        elif isinstance(rows, Exception):
+            raise rows
+        else:
+            for row in rows:
+                yield row
+
+
+def execute_partitioned(engine, selectable, filters, partition, partitions=4,
+                        boundaries=None, ordered=True, batch_size=1000,
+                        max_workers=None, limit=None, offset=None, order=None,
+                        asc=True, upper_bound_limit=None, **kwargs):
+    """Execute a query in partitions of a field concurrently.
+
+    The range of the partition field is split into ``partitions`` ranges of
+    equal size between the minimum and maximum of the filtered rows or at
+    the given boundaries. Each partition is executed in a thread on its own
+    connection of the pool of the engine with a server-side cursor.
+
+    Rows with NULL values of the partition field form a partition of their
+    own. Rows of queries ordered by the partition field are yielded partition
+    by partition, the NULL values where the database sorts them. Rows of
+    queries ordered by another field are merged, all partitions are executed
+    at once and the order field must not contain NULL values. Rows of
+    unordered queries are yielded as they arrive.
+
+    :param engine: an Engine.
+    :param selectable: an SQLAlchemy Core Selectable or a
+        :class:`qsqla.query.QuerySchema` of it
+    :param filters: a list of filters produced by build_filters
+    :param partition: string. The name of an Integer, Date or DateTime field.
+    :param partitions: int. The number of partitions.
+    :param boundaries: a sorted list of values splitting the partitions,
+        e.g. the first day of every month. ``partitions`` is ignored.
+    :param ordered: bool. Merge the rows in the order of the order field.
+    :param batch_size: int. The number of rows fetched at once.
+    :param max_workers: int. The maximum number of partitions executed at
+        the same time, defaults to all partitions.
+    :param limit: int. The limit of the merged rows.
+    :param offset: int. The offset of the merged rows.
+    :param order: string. The name of the field to order by.
+    :param asc: bool. Ascending (default) or descending order.
+    :param upper_bound_limit: int. An absolute upper bound limit to use.
+        Disabled by default.
+    :param kwargs: further arguments of :func:`qsqla.query.query`
+
+    :raises TypeError: if an ORM Model is passed or the partition field is
+        no Integer, Date or DateTime field
+    :raises ValueError: if a Connection is passed or a boundary cannot be
+        converted
+
+    The arguments are checked on the call, the partitions are executed
+    once the rows are iterated.
+
+    :return: a generator of rows.
+    """
+    if not uses_core(selectable):
+        raise TypeError("execute_partitioned requires a Core selectable")
+    if isinstance(engine, Connection):
+        raise ValueError("execute_partitioned requires an Engine")
+
+    limit = get_limit(limit, upper_bound_limit)
+    offset = int(offset or 0)
+    statement = query(selectable, filters, order=order, asc=asc,
+                      limit=limit + offset if limit is not None else None,
+                      upper_bound_limit=None, **kwargs)
+    col = selected_column(statement, partition)
+    if isinstance(col, Label):
+        col = col.element
+    if not isinstance(getattr(col.type, 'impl', col.type), PARTITION_TYPES):
+        raise TypeError("Cannot partition by field {}".format(partition))
+
+    if boundaries is not None:
+        converter = get_converter(col.type)
+        boundaries = [converter(b) if isinstance(b, str) else b
+                      for b in boundaries]
+
+    def partitioned_rows():
+        if boundaries is not None:
+            points = boundaries
+        else:
+            bounds = core_query(selectable, filters,
+                                push_down=kwargs.get("push_down", False),
+                                agg=["min:" + partition, "max:" + partition])
+            with engine.connect() as conn:
+                low, high = conn.execute(bounds).one()
+            points = split_range(low, high, partitions) \
+                if low is not None else None
+
+        statements = [statement.where(r)
+                      for r in partition_restrictions(col, points)] \
+            if points is not None else []
+        nulls = statement.where(col.is_(None))
+        workers = []
+        stopped = threading.Event()
+
+        def start(statement, results):
+            worker = Partition(engine, statement, batch_size, stopped,
+                               results)
+            worker.start()
+            workers.append(worker)
+            return results
+
+        if order and order.lower() == partition.lower():
+            if not asc:
+                statements.reverse()
+            if nulls_first(engine.dialect, asc):
+                statements.insert(0, nulls)
+            else:
+                statements.append(nulls)
+            rows = chain_partitions(start, statements,
+                                    max_workers or len(statements))
+        elif order and ordered:
+            statements.append(nulls)
+            rows = merge_partitions(start, statements,
+                                    selected_column(statement, order).name,
+                                    asc)
+        else:
+            statements.append(nulls)
+            rows = interleave_partitions(start, statements,
+                                         max_workers or len(statements))
+
+        try:
+            for row in itertools.islice(rows, offset, offset + limit
+                                        if limit is not None else None):
+                yield row
+        finally:
+            stopped.set()
+            for worker in workers:
+                worker.join()
+
+    return partitioned_rows()
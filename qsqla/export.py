@@ -0,0 +1,222 @@
+"""
+Export
+======
+
+Helpers writing the results of a query to Arrow, Parquet or CSV files. The
+rows are fetched with a server-side cursor in batches and each batch is
+written before the next one is fetched, so exports of any size use a
+bounded amount of memory.
+
+.. code::
+
+    with open("deliveries.parquet", "wb") as f:
+        write_parquet(f, engine, sel, build_filters(request.args))
+
+Arrow record batches are filled column by column from the fetched rows and
+typed from the column types of the selectable, see :func:`arrow_type`.
+ORM Models are exported with the columns of their table.
+
+The Arrow and Parquet writers require ``pyarrow``, which is installed with
+the ``arrow`` extra: ``pip install qsqla[arrow]``.
+"""
+import contextlib
+import csv
+
+import sqlalchemy
+
+from qsqla.execution import connect
+from qsqla.query import query
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+
+def require_pyarrow():
+    if pyarrow is None:
+        raise ImportError("pyarrow is required for Arrow and Parquet exports, "
+                          "install qsqla[arrow]")
+
+
+def arrow_type(type_):
+    """Return the Arrow type of an SQLAlchemy type.
+
+    :raises TypeError: if the type cannot be exported
+    """
+    require_pyarrow()
+    type_ = getattr(type_, 'impl', type_)
+    if isinstance(type_, sqlalchemy.types.Boolean):
+        return pyarrow.bool_()
+    elif isinstance(type_, sqlalchemy.types.SmallInteger):
+        return pyarrow.int16()
+    elif isinstance(type_, sqlalchemy.types.Integer):
+        return pyarrow.int64()
+    elif isinstance(type_, sqlalchemy.types.Float) or \
+            isinstance(type_, sqlalchemy.types.Numeric) and not type_.asdecimal:
+        return pyarrow.float64()
+    elif isinstance(type_, sqlalchemy.types.Numeric):
+        if type_.precision is not None and type_.scale is not None:
+            return pyarrow.decimal128(type_.precision, type_.scale)
+        return pyarrow.decimal128(38, 18)
+    elif isinstance(type_, sqlalchemy.types.String):
+        return pyarrow.string()
+    elif isinstance(type_, sqlalchemy.types.DateTime):
+        return pyarrow.timestamp('us', tz='UTC' if type_.timezone else None)
+    elif isinstance(type_, sqlalchemy.types.Date):
+        return pyarrow.date32()
+    elif isinstance(type_, sqlalchemy.types.LargeBinary):
+        return pyarrow.binary()
+    raise TypeError("Cannot export type {}".format(type_))
+
+
+def arrow_schema(columns):
+    """Return the Arrow schema of a list of tuples of name and type."""
+    return pyarrow.schema([pyarrow.field(name, arrow_type(type_))
+                           for name, type_ in columns])
+
+
+@contextlib.contextmanager
+def execute(bind, selectable_or_model, filters, upper_bound_limit=None,
+            **kwargs):
+    """Execute a query with a server-side cursor.
+
+    :return: a context manager providing a tuple of the list of names and
+        types of the result columns and the Result.
+    """
+    stm = query(selectable_or_model, filters,
+                upper_bound_limit=upper_bound_limit, future=True, **kwargs)
+    types = dict((col.name, col.type) for col in stm.selected_columns)
+    with connect(bind) as conn:
+        result = conn.execution_options(stream_results=True).execute(stm)
+        try:
+            yield ([(name, types.get(name, sqlalchemy.types.NULLTYPE))
+                    for name in result.keys()], result)
+        finally:
+            result.close()
+
+
+def fetch_batches(result, batch_size):
+    while True:
+        rows = result.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+def to_record_batches(schema, result, batch_size):
+    for rows in fetch_batches(result, batch_size):
+        yield pyarrow.RecordBatch.from_arrays(
+            [pyarrow.array(values, type=field.type)
+             for values, field in zip(zip(*rows), schema)],
+            schema=schema)
+
+
+def record_batches(bind, selectable_or_model, filters, batch_size=10000,
+                   **kwargs):
+    """Execute a query and yield the rows as Arrow record batches.
+
+    :param bind: an Engine or Connection.
+    :param selectable_or_model: an SQLAlchemy Core Selectable, ORM Model or
+        a :class:`qsqla.query.QuerySchema` of either
+    :param filters: a list of filters produced by build_filters
+    :param batch_size: int. The number of rows per batch.
+    :param kwargs: further arguments of :func:`qsqla.query.query`, the upper
+        bound limit is disabled by default.
+
+    :raises TypeError: if a column type cannot be exported
+
+    :return: a generator of ``pyarrow.RecordBatch``.
+    """
+    require_pyarrow()
+    with execute(bind, selectable_or_model, filters, **kwargs) as \
+            (columns, result):
+        schema = arrow_schema(columns)
+        for batch in to_record_batches(schema, result, batch_size):
+            yield batch
+
+
+def write_arrow(sink, bind, selectable_or_model, filters, batch_size=10000,
+                **kwargs):
+    """Write the rows of a query in the Arrow IPC stream format.
+
+    Takes the arguments of :func:`record_batches`.
+
+    :param sink: a path or writable binary file.
+
+    :return: the number of rows written.
+    """
+    require_pyarrow()
+    rows = 0
+    with execute(bind, selectable_or_model, filters, **kwargs) as \
+            (columns, result):
+        schema = arrow_schema(columns)
+        with pyarrow.ipc.new_stream(sink, schema) as writer:
+            for batch in to_record_batches(schema, result, batch_size):
+                writer.write_batch(batch)
+                rows += batch.num_rows
+    return rows
+
+
+def write_parquet(where, bind, selectable_or_model, filters, batch_size=10000,
+                  compression='snappy', **kwargs):
+    """Write the rows of a query to a Parquet file.
+
+    Takes the arguments of :func:`record_batches`. Every batch is written as
+    a row group.
+
+    :param where: a path or writable binary file.
+    :param compression: the compression codec of the Parquet file.
+
+    :return: the number of rows written.
+    """
+    require_pyarrow()
+    rows = 0
+    with execute(bind, selectable_or_model, filters, **kwargs) as \
+            (columns, result):
+        schema = arrow_schema(columns)
+        with pyarrow.parquet.ParquetWriter(where, schema,
+                                           compression=compression) as writer:
+            for batch in to_record_batches(schema, result, batch_size):
+                writer.write_batch(batch)
+                rows += batch.num_rows
+    return rows
+
+
+def isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def write_csv(f, bind, selectable_or_model, filters, batch_size=10000,
+              header=True, **kwargs):
+    """Write the rows of a query as CSV.
+
+    Takes the arguments of :func:`record_batches`. Dates and datetimes are
+    written in ISO-8601 format. ``pyarrow`` is not required.
+
+    :param f: a writable text file opened with ``newline=''``.
+    :param header: bool. Write the field names as first line.
+
+    :return: the number of rows written.
+    """
+    writer = csv.writer(f)
+    rows = 0
+    with execute(bind, selectable_or_model, filters, **kwargs) as \
+            (columns, result):
+        if header:
+            writer.writerow([name for name, type_ in columns])
+        formatted = [i for i, (name, type_) in enumerate(columns)
+                     if isinstance(getattr(type_, 'impl', type_),
+                                   (sqlalchemy.types.Date,
+                                    sqlalchemy.types.DateTime))]
+        for batch in fetch_batches(result, batch_size):
+            if formatted:
+                batch = [list(row) for row in batch]
+                for row in batch:
+                    for i in formatted:
+                        row[i] = isoformat(row[i])
+            writer.writerows(batch)
+            rows += len(batch)
+    return rows
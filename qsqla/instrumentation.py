@@ -0,0 +1,213 @@
+"""
+Instrumentation
+===============
+
+Listeners registered with :func:`add_listener` are called with an
+:class:`Event` for every phase of a request:
+
+- ``build_filters`` parsing the query string with :func:`qsqla.query.build_filters`
+- ``construction`` building the statement with :func:`qsqla.query.query`,
+  :func:`qsqla.query.core_query` or :func:`qsqla.query.orm_query`
+- ``compilation`` compiling the statement to SQL
+- ``execution`` executing the SQL on the database
+
+Compilation and execution are reported for engines passed to
+:func:`install`. The fingerprint of an event identifies the query without
+the filter values, i.e. the selectable with the names and operators of the
+filters or the SQL text, so timings of the same kind of query can be
+aggregated.
+
+.. code::
+
+    install(engine)
+    add_listener(SlowQueryLog(threshold=0.5, thresholds={"execution": 2.0}))
+
+    with listening(events.append):
+        rows = engine.execute(query(sel, build_filters(request.args)))
+
+As long as no listener is registered the phases are not timed at all.
+"""
+import collections
+import contextlib
+import functools
+import hashlib
+import logging
+import time
+
+from sqlalchemy import event
+from sqlalchemy.sql.selectable import Selectable
+
+
+log = logging.getLogger(__name__)
+
+
+Event = collections.namedtuple(
+    "Event", ["phase", "duration", "fingerprint", "detail"])
+
+PHASES = ('build_filters', 'construction', 'compilation', 'execution')
+
+listeners = []
+
+
+def add_listener(listener):
+    """Register a callable called with an :class:`Event` per phase."""
+    listeners.append(listener)
+
+
+def remove_listener(listener):
+    listeners.remove(listener)
+
+
+@contextlib.contextmanager
+def listening(listener):
+    """Register a listener for the duration of the block."""
+    add_listener(listener)
+    try:
+        yield listener
+    finally:
+        remove_listener(listener)
+
+
+def notify(phase, duration, fingerprint, detail=None):
+    e = Event(phase, duration, fingerprint, detail)
+    for listener in list(listeners):
+        try:
+            listener(e)
+        except Exception:
+            log.exception("instrumentation listener %r failed", listener)
+
+
+def digest(value):
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()[:16]
+
+
+@functools.lru_cache(maxsize=256)
+def selectable_fingerprint(selectable_or_model):
+    """Return a string identifying a selectable or model across processes.
+
+    Selectables are identified by their SQL and the values of their bound
+    parameters, which the SQL only shows as placeholders.
+    """
+    # QuerySchema
+    selectable_or_model = getattr(selectable_or_model, "selectable_or_model",
+                                  selectable_or_model)
+    if isinstance(selectable_or_model, Selectable):
+        compiled = selectable_or_model.compile()
+        return "{} {!r}".format(compiled, sorted(compiled.params.items()))
+    return "{}.{}".format(selectable_or_model.__module__,
+                          selectable_or_model.__qualname__)
+
+
+def filter_shape(f):
+    """Return the part of a filter that determines the statement.
+
+    Field names are looked up case-insensitively and thus lowercased.
+    """
+    if f["op"] == "with":
+        inner = f["val"].rsplit("=", 1)[0]
+        return (f["name"].lower(), f["op"], inner)
+    return (f["name"].lower(), f["op"])
+
+
+def query_fingerprint(selectable_or_model, filters, *args, **kwargs):
+    """Return the fingerprint of a query without the filter values."""
+    shapes = sorted(filter_shape(f) for f in filters)
+    return digest(repr((selectable_fingerprint(selectable_or_model), shapes)))
+
+
+def parameters_fingerprint(query, *args, **kwargs):
+    """Return the fingerprint of the parameter names of a query string."""
+    return digest(repr(sorted(query)))
+
+
+def instrumented(phase, fingerprint):
+    """Report the duration of the decorated function as the phase.
+
+    :param fingerprint: a function taking the arguments of the decorated
+        function and returning the fingerprint. It is only called if a
+        listener is registered.
+    """
+    def dec(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not listeners:
+                return f(*args, **kwargs)
+            start = time.perf_counter()
+            result = f(*args, **kwargs)
+            notify(phase, time.perf_counter() - start,
+                   fingerprint(*args, **kwargs), f.__name__)
+            return result
+        return wrapper
+    return dec
+
+
+def before_execute(conn, *args):
+    if listeners:
+        conn.info.setdefault("qsqla_started", []).append(time.perf_counter())
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    started = conn.info.get("qsqla_started")
+    if not listeners or not started:
+        return
+    now = time.perf_counter()
+    fingerprint = digest(statement)
+    notify("compilation", now - started[-1], fingerprint, statement)
+    started[-1] = now
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    started = conn.info.get("qsqla_started")
+    if not started:
+        return
+    start = started.pop()
+    if listeners:
+        notify("execution", time.perf_counter() - start, digest(statement),
+               statement)
+
+
+def handle_error(context):
+    started = context.connection.info.get("qsqla_started") \
+        if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+ENGINE_EVENTS = (
+    ("before_execute", before_execute),
+    ("before_cursor_execute", before_cursor_execute),
+    ("after_cursor_execute", after_cursor_execute),
+    ("handle_error", handle_error),
+)
+
+
+def install(engine):
+    """Report compilation and execution of the statements of an engine."""
+    for name, listener in ENGINE_EVENTS:
+        event.listen(engine, name, listener)
+
+
+def uninstall(engine):
+    for name, listener in ENGINE_EVENTS:
+        event.remove(engine, name, listener)
+
+
+class SlowQueryLog(object):
+    """A listener logging phases exceeding a threshold.
+
+    :param threshold: The default threshold in seconds.
+    :param thresholds: a dict of thresholds per phase overriding the default.
+    :param logger: the logger to write warnings to.
+    """
+
+    def __init__(self, threshold=1.0, thresholds=None, logger=None):
+        self.threshold = threshold
+        self.thresholds = dict(thresholds or {})
+        self.logger = logger or log
+
+    def __call__(self, e):
+        if e.duration >= self.thresholds.get(e.phase, self.threshold):
+            self.logger.warning("slow %s of %s took %.3fs: %s", e.phase,
+                                e.fingerprint, e.duration, e.detail)
@@ -0,0 +1,226 @@
+"""
+Filter Optimizer
+================
+
+:func:`optimize_filters` normalizes the filters produced by
+:func:`qsqla.query.build_filters` before the statement is built. Redundant
+filters are removed, ranges are merged, ``in`` lists are intersected and
+filters which cannot match any row are detected, so the database does not
+have to be asked at all.
+
+.. code::
+
+    filters = optimize_filters(sel, build_filters(request.args))
+    if filters is None:
+        return []
+    rows = connection.execute(query(sel, filters))
+
+The optimized filters are sorted in a canonical order, thus equivalent
+requests produce equal filter lists and share cache entries.
+"""
+from qsqla.query import (OPERATORS, QuerySchema, get_converter, no_value,
+                         resolve)
+
+
+LOWER_BOUNDS = ('gt', 'gte')
+UPPER_BOUNDS = ('lt', 'lte')
+VALUE_OPERATORS = frozenset(('eq', 'ne', 'in', 'not_in') + LOWER_BOUNDS +
+                            UPPER_BOUNDS)
+
+
+class Empty(Exception):
+    """Raised internally if the filters of a field cannot match any row."""
+
+
+def split_values(value):
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(",")]
+    return list(value)
+
+
+def sort_key(f):
+    return (f["name"].lower(), f["op"], str(f.get("val")))
+
+
+def in_range(value, lower, upper):
+    if lower is not None:
+        if value < lower[0] or (value == lower[0] and lower[1] == 'gt'):
+            return False
+    if upper is not None:
+        if value > upper[0] or (value == upper[0] and upper[1] == 'lt'):
+            return False
+    return True
+
+
+def check_unary(filters):
+    """Check the unary operators of the filters of a single field.
+
+    :raises Empty: if the filters cannot match any row
+    """
+    ops = set(f["op"] for f in filters)
+    # every other operator is false for NULL
+    if 'is_null' in ops and len(ops) > 1:
+        raise Empty()
+    if 'is_true' in ops and 'is_false' in ops:
+        raise Empty()
+
+
+def check_operators(selectable_or_model, col, filters):
+    """Check that the operators of the filters can be applied to the column.
+
+    :raises TypeError: if an operator is not allowed on the type of the
+        column
+    """
+    if isinstance(selectable_or_model, QuerySchema):
+        allowed = selectable_or_model.operators[filters[0]["name"].lower()]
+    for f in filters:
+        if isinstance(selectable_or_model, QuerySchema):
+            if f["op"] not in allowed:
+                raise TypeError("Cannot apply filter to field {}".format(
+                    f["name"]))
+            continue
+        types = getattr(OPERATORS[f["op"]], 'types', None)
+        basetype = getattr(col.type, 'impl', col.type)
+        if types is not None and not isinstance(basetype, types):
+            raise TypeError("Cannot apply filter to field {}".format(
+                f["name"]))
+
+
+def optimize_field(name, filters, converter):
+    """Optimize the filters of a single field.
+
+    :raises Empty: if the filters cannot match any row
+    """
+    others = []
+    eq = None
+    in_values = None
+    excluded = set()  # values of ne and not_in filters
+    lower = upper = None
+    for f in filters:
+        op = f["op"]
+        if op not in VALUE_OPERATORS:
+            others.append(f)
+            continue
+        if op in ('in', 'not_in'):
+            values = [(converter(v), v) for v in split_values(f["val"])]
+        else:
+            values = [(converter(f["val"]), f["val"])]
+        if op == 'eq':
+            if eq is not None and eq[0] != values[0][0]:
+                raise Empty()
+            eq = values[0]
+        elif op == 'in':
+            if in_values is None:
+                in_values = dict(values)
+            else:
+                in_values = dict((v, raw) for v, raw in values
+                                 if v in in_values)
+        elif op in ('ne', 'not_in'):
+            excluded.update(v for v, raw in values)
+        elif op in LOWER_BOUNDS:
+            value = values[0][0]
+            if lower is None or value > lower[0] or \
+                    (value == lower[0] and op == 'gt'):
+                lower = (value, op, values[0][1])
+        else:
+            value = values[0][0]
+            if upper is None or value < upper[0] or \
+                    (value == upper[0] and op == 'lt'):
+                upper = (value, op, values[0][1])
+
+    if eq is not None:
+        if in_values is not None and eq[0] not in in_values:
+            raise Empty()
+        in_values = {eq[0]: eq[1]}
+
+    if in_values is not None:
+        in_values = [(v, raw) for v, raw in in_values.items()
+                     if v not in excluded and in_range(v, lower, upper)]
+        if not in_values:
+            raise Empty()
+        if len(in_values) == 1:
+            result = [{"name": name, "op": "eq", "val": in_values[0][1]}]
+        else:
+            result = [{"name": name, "op": "in",
+                       "val": [raw for v, raw in in_values]}]
+        others = [f for f in others if f["op"] != 'is_not_null']
+        return result + others
+
+    if lower is not None and upper is not None:
+        if lower[0] > upper[0] or (lower[0] == upper[0] and
+                                   (lower[1] == 'gt' or upper[1] == 'lt')):
+            raise Empty()
+    result = []
+    if lower is not None:
+        result.append({"name": name, "op": lower[1], "val": lower[2]})
+    if upper is not None:
+        result.append({"name": name, "op": upper[1], "val": upper[2]})
+    # values outside of the range are excluded anyway
+    raws = []
+    seen = set()
+    for f in filters:
+        if f["op"] not in ('ne', 'not_in'):
+            continue
+        for raw in split_values(f["val"]):
+            value = converter(raw)
+            if value not in seen and in_range(value, lower, upper):
+                seen.add(value)
+                raws.append(raw)
+    if raws:
+        if len(raws) == 1:
+            result.append({"name": name, "op": "ne", "val": raws[0]})
+        else:
+            result.append({"name": name, "op": "not_in", "val": raws})
+    return result + others
+
+
+def optimize_filters(selectable_or_model, filters):
+    """Return optimized filters or None if they cannot match any row.
+
+    Only filters on fields of the selectable or model with the operators
+    ``eq``, ``ne``, ``gt``, ``gte``, ``lt``, ``lte``, ``in``, ``not_in`` and
+    the unary operators are combined, all other filters are kept as they
+    are apart from duplicates. Fields whose values cannot be converted or
+    compared and filters whose operator is not allowed on the type of the
+    field are left untouched, so the error is raised when the statement is
+    built.
+
+    :param selectable_or_model: an SQLAlchemy Core Selectable, ORM Model or
+        a :class:`qsqla.query.QuerySchema` of either
+    :param filters: a list of filters produced by build_filters
+
+    :return: a list of filters in canonical order or None.
+    """
+    lookup = resolve(selectable_or_model)[2]
+    by_field = {}
+    untouched = []
+    seen = set()
+    for f in filters:
+        key = (f["name"].lower(), f["op"], str(f.get("val")))
+        if key in seen:
+            continue
+        seen.add(key)
+        if f["op"] == 'with':
+            untouched.append(f)
+        else:
+            by_field.setdefault(f["name"].lower(), []).append(f)
+
+    optimized = []
+    for name, field_filters in by_field.items():
+        try:
+            col = lookup(field_filters[0]["name"])
+            check_operators(selectable_or_model, col, field_filters)
+            check_unary(field_filters)
+            if isinstance(selectable_or_model, QuerySchema):
+                converter = selectable_or_model.converters[name]
+            else:
+                converter = get_converter(col.type)
+            if converter is no_value:
+                raise TypeError("values of {} are not compared".format(name))
+            optimized.extend(optimize_field(field_filters[0]["name"],
+                                            field_filters, converter))
+        except Empty:
+            return None
+        except (AttributeError, KeyError, TypeError, ValueError):
+            optimized.extend(field_filters)
+    return sorted(optimized + untouched, key=sort_key)
@@ -0,0 +1,269 @@
+"""
+Index Policy
+============
+
+Filtering or ordering a huge table on a column without an index makes the
+database scan the whole table. :class:`IndexPolicy` checks the filters and
+the order field of a request against the indexes and primary keys of the
+underlying tables and warns about or rejects the ones which cannot use an
+index.
+
+.. code::
+
+    policy = IndexPolicy(deliveries.select(), mode="reject",
+                         allow=["delivery_category", "state__eq"])
+    stm = query(sel, filters, order=order, policy=policy)
+
+A filter can use an index if its field is the leading column of an index,
+unique constraint or primary key and the operator is one of ``eq``, ``gt``,
+``gte``, ``lt``, ``lte``, ``in``, the unary operators or ``like`` with a
+prefix pattern. ``ieq`` and prefix ``ilike`` filters need an index on
+``lower()`` of the field. ``search`` filters can always use an index, the
+operator is only applied to fields configured with their full-text index,
+see :func:`qsqla.query.search_config`. The allow list overrides the check
+either for a field, e.g. ``"state"``, or for an operator on a field, e.g.
+``"state__ne"``.
+The order field is checked as the operator ``order``.
+
+With ``rewrite_prefix=True`` the policy rewrites ``like`` and ``ilike``
+filters with a prefix pattern like ``abc%`` into the range
+``col >= 'abc' AND col < 'abd'`` if the field has an index, respectively
+``lower(col) >= 'abc' AND lower(col) < 'abd'`` if it has an index on
+``lower()`` of the field. Ranges can use a B-tree index on every backend,
+while patterns can only on some. The range compares case-sensitively and
+assumes a binary collation of the field. Thus ``like`` is rendered as the
+range on PostgreSQL only, where it compares case-sensitively too, and keeps
+the pattern on databases like SQLite and MySQL, where it ignores the case.
+``ieq`` filters are compared on ``lower()`` already.
+"""
+import logging
+import sys
+
+import sqlalchemy
+from sqlalchemy import Table
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.elements import ColumnElement
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.sql.schema import UniqueConstraint
+from sqlalchemy.sql.visitors import InternalTraversal
+
+from qsqla.query import (UNARY_OPERATORS, base_columns, get_subquery,
+                         resolve)
+
+
+log = logging.getLogger(__name__)
+
+
+INDEX_OPERATORS = frozenset(['eq', 'gt', 'gte', 'lt', 'lte', 'in', 'order'] +
+                            UNARY_OPERATORS)
+PREFIX_OPERATORS = frozenset(['like'])
+LOWER_OPERATORS = frozenset(['ieq'])
+LOWER_PREFIX_OPERATORS = frozenset(['ilike'])
+
+MODES = ('allow', 'warn', 'reject')
+
+
+class IndexPolicyError(ValueError):
+    """Raised if a filter or order field cannot use an index."""
+
+
+def is_prefix_pattern(pattern):
+    """Return whether a LIKE pattern is anchored at the start."""
+    return bool(pattern) and pattern[0] not in '%_'
+
+
+def like_prefix(pattern):
+    """Return the prefix of a pattern ``prefix%`` without other wildcards or None."""
+    if not isinstance(pattern, str) or not pattern.endswith('%'):
+        return None
+    prefix = pattern[:-1]
+    if not prefix or any(c in prefix for c in '%_\\'):
+        return None
+    return prefix
+
+
+def next_prefix(prefix):
+    """Return the smallest string greater than all strings with the prefix or None."""
+    while prefix:
+        last = ord(prefix[-1])
+        if last < sys.maxunicode:
+            # skip the surrogates, which cannot be encoded
+            return prefix[:-1] + chr(last + 1 if last != 0xD7FF else 0xE000)
+        prefix = prefix[:-1]
+    return None
+
+
+def prefix_range(expression, prefix):
+    """Restrict an expression to the strings starting with the prefix."""
+    upper = next_prefix(prefix)
+    if upper is None:
+        return expression >= prefix
+    return sqlalchemy.and_(expression >= prefix, expression < upper)
+
+
+class PrefixLike(ColumnElement):
+    """A prefix LIKE comparison rendered as a range where LIKE is case-sensitive."""
+
+    _traverse_internals = [
+        ("like", InternalTraversal.dp_clauseelement),
+        ("range", InternalTraversal.dp_clauseelement)]
+
+    inherit_cache = True
+
+    def __init__(self, expression, prefix):
+        self.like = expression.like(prefix + '%')
+        self.range = prefix_range(expression, prefix).self_group()
+
+
+@compiles(PrefixLike)
+def compile_prefix_like(element, compiler, **kw):
+    return compiler.process(element.like, **kw)
+
+
+@compiles(PrefixLike, 'postgresql')
+def compile_prefix_range(element, compiler, **kw):
+    return compiler.process(element.range, **kw)
+
+
+def lower_argument(expression):
+    """Return the column of a ``lower(column)`` index expression or None."""
+    if isinstance(expression, FunctionElement) and \
+            expression.name.lower() == 'lower':
+        args = list(expression.clauses)
+        if len(args) == 1:
+            return args[0]
+    return None
+
+
+def leading_columns(table):
+    """Return the leading columns of the indexes of a table.
+
+    :return: a tuple of the set of plain leading columns and the set of
+        columns with a leading ``lower()`` index.
+    """
+    plain = set()
+    lower = set()
+    if table.primary_key.columns:
+        plain.add(list(table.primary_key.columns)[0])
+    for constraint in table.constraints:
+        if isinstance(constraint, UniqueConstraint) and constraint.columns:
+            plain.add(list(constraint.columns)[0])
+    for index in table.indexes:
+        expression = index.expressions[0]
+        col = lower_argument(expression)
+        if col is not None:
+            lower.add(col)
+        else:
+            plain.add(expression)
+    return plain, lower
+
+
+class IndexPolicy(object):
+    """Check that filters and the order field of a query can use an index.
+
+    :param selectable_or_model: an SQLAlchemy Core Selectable, ORM Model or
+        a :class:`qsqla.query.QuerySchema` of either
+    :param mode: ``"allow"``, ``"warn"`` to log a warning or ``"reject"`` to
+        raise an :class:`IndexPolicyError` for filters which cannot use an
+        index.
+    :param allow: a list of fields or ``field__operator`` pairs which are
+        always allowed.
+    :param rewrite_prefix: bool. Rewrite prefix ``like`` and ``ilike``
+        filters on indexed fields into ranges, see :meth:`rewrite`.
+    """
+
+    def __init__(self, selectable_or_model, mode='reject', allow=(),
+                 rewrite_prefix=False):
+        if mode not in MODES:
+            raise ValueError("mode must be one of {}".format(", ".join(MODES)))
+        self.mode = mode
+        self.rewrite_prefix = rewrite_prefix
+        self.allow = frozenset(name.lower() for name in allow)
+        self.lookup = resolve(selectable_or_model)[2]
+        self._indexes = {}
+
+    def indexes(self, table):
+        if table not in self._indexes:
+            if isinstance(table, Table):
+                self._indexes[table] = leading_columns(table)
+            else:
+                self._indexes[table] = (set(), set())
+        return self._indexes[table]
+
+    def can_use_index(self, col, op, value=None):
+        """Return whether a filter with the operator can use an index."""
+        if op == 'search':
+            # searchable fields are configured with their full-text index
+            return True
+        for base in base_columns(col):
+            table = getattr(base, 'table', None)
+            if table is None:
+                # computed columns like aggregates have no index
+                continue
+            plain, lower = self.indexes(table)
+            if base in plain:
+                if op in INDEX_OPERATORS:
+                    return True
+                if op in PREFIX_OPERATORS and is_prefix_pattern(value):
+                    return True
+            if base in lower:
+                if op in LOWER_OPERATORS:
+                    return True
+                if op in LOWER_PREFIX_OPERATORS and is_prefix_pattern(value):
+                    return True
+        return False
+
+    def rewrite(self, col, f):
+        """Return a range restriction for a prefix like or ilike filter.
+
+        :return: the restriction or None if the filter is not rewritten.
+        """
+        if not self.rewrite_prefix or f["op"] not in ('like', 'ilike'):
+            return None
+        prefix = like_prefix(f.get("val"))
+        type_ = getattr(col, 'type', None)
+        if prefix is None or not isinstance(getattr(type_, 'impl', type_),
+                                            sqlalchemy.types.String):
+            return None
+        for base in base_columns(col):
+            table = getattr(base, 'table', None)
+            if table is None:
+                continue
+            plain, lower = self.indexes(table)
+            if f["op"] == 'like' and base in plain:
+                return PrefixLike(col, prefix)
+            # python and the database only agree on lower() of ASCII
+            if f["op"] == 'ilike' and base in lower and prefix.isascii():
+                return prefix_range(sqlalchemy.func.lower(col),
+                                    prefix.lower())
+        return None
+
+    def is_allowed(self, name, op, value=None):
+        if self.mode == 'allow':
+            return True
+        name = name.lower()
+        if name in self.allow or "{}__{}".format(name, op) in self.allow:
+            return True
+        col = self.lookup(name)
+        if op == 'with':
+            inner_col, inner_op_val = get_subquery(col, value)
+            return self.can_use_index(inner_col, *inner_op_val)
+        return self.can_use_index(col, op, value)
+
+    def check(self, filters, order=None):
+        """Check filters and the order field against the policy.
+
+        :raises KeyError: if key is not available in query
+        :raises IndexPolicyError: if the policy rejects a filter
+        """
+        for f in filters:
+            if not self.is_allowed(f["name"], f["op"], f.get("val")):
+                self.violation("filter {}__{} cannot use an index".format(
+                    f["name"], f["op"]))
+        if order and not self.is_allowed(order, 'order'):
+            self.violation("order {} cannot use an index".format(order))
+
+    def violation(self, message):
+        if self.mode == 'reject':
+            raise IndexPolicyError(message)
+        log.warning(message)
@@ -51,6 +51,8 @@ Binary operators:
 - ``not_ilike`` always case-insensitive not like for String fields
 - ``in`` for Integer, String fields. The values are provided as a comma separated list.
 - ``not_in`` for Integer, String fields. The values are provided as a comma separated list.
+- ``search`` full-text search for String fields configured with the ``search`` argument of ``query`` or
+  ``QuerySchema``. All words of the value have to occur in the field.
 - ``with`` for relationships. Combine any other binary operator with an additional `__` on any relationship. Can only be used on ORM queries.
 
 Supported Types:
@@ -67,49 +69,123 @@ In addition to the filters one can provide
 - ``_offset`` Add an offset to the query.
 - ``_order``  The order field.
 - ``_desc`` If provided sort in descending order, else in ascending.
+- ``_after`` Keyset pagination token. Continues after the last row of the previous page, which is
+  cheaper than ``_offset`` for deep pages. An empty value starts with the first page.
+- ``_fields`` A comma separated list of the fields to return. All fields are returned by default.
+- ``_group_by`` A comma separated list of fields to group the filtered records by.
+- ``_agg`` A comma separated list of aggregates computed per group, e.g. ``count,sum:row_count,max:update_date``.
+  ``count`` counts the records, ``count``, ``sum``, ``avg``, ``min`` and ``max`` take a field after a colon.
+  The aggregates are returned as ``count``, ``sum_row_count`` and ``max_update_date`` and can be used as order
+  field.
+- ``_expand`` A comma separated list of relationships loaded together with the records. Can only be used on ORM
+  queries.
+- ``_sample`` Select a random sample of about the given percentage of the records, e.g. ``_sample=1.5``.
+  Uses ``TABLESAMPLE`` on PostgreSQL and a hash of the primary key on other databases.
+- ``_seed`` An integer seed for ``_sample``, the same seed returns the same sample.
+- ``_since`` Watermark token of a change feed. Only records changed after the watermark are returned, ordered
+  by a monotonic field like an update date. An empty value starts with the oldest record. The token for the
+  next poll is returned by ``watermark_token``.
 
 """
+import base64
+import collections
+import datetime
+import decimal
 import functools
+import inspect
+import json
 
 import dateutil.parser
 import sqlalchemy
-from sqlalchemy.sql.selectable import Selectable
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.elements import (BindParameter, ColumnClause,
+                                     ColumnElement, Label)
+from sqlalchemy.sql.selectable import Select, Selectable, TableSample
+from sqlalchemy.sql.util import ClauseAdapter
+from sqlalchemy.sql.visitors import InternalTraversal
+
+from qsqla.instrumentation import (instrumented, parameters_fingerprint,
+                                   query_fingerprint)
 
 
 def requires_types(*types):
     def dec(f):
         @functools.wraps(f)
-        def wrapper(arg1, arg2=None):
+        def wrapper(arg1, arg2=None, **kwargs):
             arg_basetype = getattr(arg1.type, 'impl', arg1.type)
             if not any([isinstance(arg_basetype, t) for t in types]):
                 raise TypeError("Cannot apply filter to field {}".format(arg1.name))
-            return f(arg1, arg2)
+            return f(arg1, arg2, **kwargs)
+        wrapper.types = types
         return wrapper
     return dec
 
 
+def check_mapped_attribute(arg):
+    try:
+        getattr(arg.property, 'mapper')
+    except:
+        raise TypeError("{} is not a mapped attribute".format(arg))
+
+
 def requires_mapped_attribute(f):
     @functools.wraps(f)
     def wrapper(arg1, arg2=None):
-        try:
-            getattr(arg1.property, 'mapper')
-        except:
-            raise TypeError("{} is not a mapped attribute".format(arg1))
+        check_mapped_attribute(arg1)
         return f(arg1, arg2)
     return wrapper
 
 
-def convert_type(type_, value):
+def keep_value(value):
+    return value
+
+
+def no_value(value):
+    return None
+
+
+def get_converter(type_):
+    """Return the function converting filter values for the given type."""
     cls = type_.__class__
     basetype = getattr(cls, 'impl', cls)
     if issubclass(basetype, sqlalchemy.types.Integer):
-        return int(value)
+        return int
     elif issubclass(basetype, sqlalchemy.types.String):
-        return value
+        return keep_value
     elif issubclass(basetype, sqlalchemy.types.DateTime):
+        return parse_datetime
+    elif issubclass(basetype, sqlalchemy.types.Date):
+        return parse_date
+    return no_value
+
+
+# only ISO-8601 strings are memoized, dateutil fills in missing parts of
+# other formats from the current date
+parse_iso_datetime = functools.lru_cache(maxsize=1024)(
+    datetime.datetime.fromisoformat)
+parse_iso_date = functools.lru_cache(maxsize=1024)(datetime.date.fromisoformat)
+
+
+def parse_datetime(value):
+    """Parse a datetime, ISO-8601 strings are parsed without dateutil."""
+    try:
+        return parse_iso_datetime(value)
+    except ValueError:
         return dateutil.parser.parse(value)
 
 
+def parse_date(value):
+    """Parse a date, ISO-8601 strings are parsed without dateutil."""
+    try:
+        return parse_iso_date(value)
+    except ValueError:
+        return dateutil.parser.parse(value).date()
+
+
+def convert_type(type_, value):
+    return get_converter(type_)(value)
+
+
 def get_subquery(arg1, arg2):
     if "=" not in arg2:
         raise KeyError("`any` expects a second operator added with `__`")
@@ -119,17 +195,43 @@ def get_subquery(arg1, arg2):
     return subquery_column, subquery_op_val
 
 
+def convert_value(converter, value):
+    return converter(value)
+
+
+def convert_values(converter, value):
+    """Convert a comma separated string or a list of values, dropping duplicates."""
+    if isinstance(value, str):
+        value = [v.strip() for v in value.split(",")]
+    return list(dict.fromkeys(map(converter, value)))
+
+
 def convert_generic(f):
+    """Convert the filter value to the python type of the column.
+
+    Bound parameters are passed through unchanged, their value is converted
+    with the ``convert`` attribute of the operator when it is bound.
+    """
     @functools.wraps(f)
-    def wrapper(arg1, arg2=None):
-        return f(arg1, convert_type(arg1.type, arg2))
+    def wrapper(arg1, arg2=None, **kwargs):
+        if not isinstance(arg2, BindParameter):
+            arg2 = convert_value(get_converter(arg1.type), arg2)
+        return f(arg1, arg2, **kwargs)
+    wrapper.convert = convert_value
     return wrapper
 
+
 def convert_list(f):
+    """Convert a comma separated filter value to a list of python values.
+
+    Bound parameters are passed through unchanged, see :func:`convert_generic`.
+    """
     @functools.wraps(f)
-    def wrapper(arg1, arg2=None):
-        vals = [convert_type(arg1.type, arg.strip()) for arg in arg2.split(",")]
-        return f(arg1, vals)
+    def wrapper(arg1, arg2=None, **kwargs):
+        if not isinstance(arg2, BindParameter):
+            arg2 = convert_values(get_converter(arg1.type), arg2)
+        return f(arg1, arg2, **kwargs)
+    wrapper.convert = convert_values
     return wrapper
 
 
@@ -152,14 +254,14 @@ def is_false(arg1, arg2=None):
 
 
 @requires_types(sqlalchemy.types.Integer, sqlalchemy.types.String,
-                sqlalchemy.types.DateTime)
+                sqlalchemy.types.Date, sqlalchemy.types.DateTime)
 @convert_generic
 def equals(arg1, arg2):
     return arg1 == arg2
 
 
 @requires_types(sqlalchemy.types.Integer, sqlalchemy.types.String,
-                sqlalchemy.types.DateTime)
+                sqlalchemy.types.Date, sqlalchemy.types.DateTime)
 @convert_generic
 def not_equals(arg1, arg2):
     return arg1 != arg2
@@ -168,28 +270,32 @@ def not_equals(arg1, arg2):
 @requires_types(sqlalchemy.types.String)
 @convert_generic
 def ignore_case_equals(arg1, arg2):
-    return sqlalchemy.func.lower(arg1) == arg2.lower()
+    return sqlalchemy.func.lower(arg1) == sqlalchemy.func.lower(arg2)
 
 
-@requires_types(sqlalchemy.types.Integer, sqlalchemy.types.DateTime)
+@requires_types(sqlalchemy.types.Integer, sqlalchemy.types.Date,
+                sqlalchemy.types.DateTime)
 @convert_generic
 def greater_than(arg1, arg2):
     return arg1 > arg2
 
 
-@requires_types(sqlalchemy.types.Integer, sqlalchemy.types.DateTime)
+@requires_types(sqlalchemy.types.Integer, sqlalchemy.types.Date,
+                sqlalchemy.types.DateTime)
 @convert_generic
 def greater_than_equals(arg1, arg2):
     return arg1 >= arg2
 
 
-@requires_types(sqlalchemy.types.Integer, sqlalchemy.types.DateTime)
+@requires_types(sqlalchemy.types.Integer, sqlalchemy.types.Date,
+                sqlalchemy.types.DateTime)
 @convert_generic
 def less_than(arg1, arg2):
     return arg1 < arg2
 
 
-@requires_types(sqlalchemy.types.Integer, sqlalchemy.types.DateTime)
+@requires_types(sqlalchemy.types.Integer, sqlalchemy.types.Date,
+                sqlalchemy.types.DateTime)
 @convert_generic
 def less_than_equals(arg1, arg2):
     return arg1 <= arg2
@@ -219,26 +325,260 @@ def not_ilike(arg1, arg2):
     return ~arg1.ilike(arg2)
 
 
+# Lists with more values are selected from a VALUES construct instead of
+# being bound as one parameter per value, see the large_in_threshold
+# argument of query and QuerySchema.
+LARGE_IN_THRESHOLD = 1000
+
+
+def in_values(col, values, threshold=None, negate=False):
+    """Return the IN comparison of a column with a list of values.
+
+    Lists up to ``threshold`` values are bound with a single expanding
+    parameter, so the statement is the same for every list length. Larger
+    lists are rendered inline as a VALUES construct on PostgreSQL and SQLite,
+    which does not run into the parameter limits of the database drivers.
+    Other databases bind them as well.
+
+    :param threshold: int. Defaults to :data:`LARGE_IN_THRESHOLD`.
+    :param negate: bool. Return the NOT IN comparison.
+    """
+    if threshold is None:
+        threshold = LARGE_IN_THRESHOLD
+    if isinstance(values, BindParameter):
+        return col.not_in(values) if negate else col.in_(values)
+    if len(values) > threshold:
+        return LargeIn(col, values, negate)
+    values = sqlalchemy.bindparam(None, values, expanding=True)
+    return col.not_in(values) if negate else col.in_(values)
+
+
+class LargeIn(ColumnElement):
+    """The IN comparison of a column with a long list of literal values."""
+
+    inherit_cache = False
+
+    def __init__(self, column, values, negate=False):
+        self.column = column
+        self.values = values
+        self.negate = negate
+
+
+@compiles(LargeIn)
+def compile_large_in(element, compiler, **kw):
+    values = sqlalchemy.bindparam(None, element.values, expanding=True)
+    comparison = element.column.not_in(values) if element.negate \
+        else element.column.in_(values)
+    return compiler.process(comparison, **kw)
+
+
+@compiles(LargeIn, 'postgresql')
+@compiles(LargeIn, 'sqlite')
+def compile_large_in_values(element, compiler, **kw):
+    return "{} {} (VALUES {})".format(
+        compiler.process(element.column, **kw),
+        "NOT IN" if element.negate else "IN",
+        ", ".join("({})".format(compiler.render_literal_value(
+            value, element.column.type)) for value in element.values))
+
+
 @requires_types(sqlalchemy.types.Integer, sqlalchemy.types.String)
 @convert_list
-def in_(arg1, arg2):
-    return arg1.in_(arg2)
+def in_(arg1, arg2, threshold=None):
+    return in_values(arg1, arg2, threshold)
 
 
 @requires_types(sqlalchemy.types.Integer, sqlalchemy.types.String)
 @convert_list
-def not_in(arg1, arg2):
-    return ~arg1.in_(arg2)
+def not_in(arg1, arg2, threshold=None):
+    return in_values(arg1, arg2, threshold, negate=True)
 
 
 @requires_mapped_attribute
 def with_(arg1, arg2):
-    subquery_column, subquery_op_val = get_subquery(arg1, arg2)
-    if arg1.property.uselist:
-        restriction = arg1.any(OPERATORS[subquery_op_val[0]](subquery_column, subquery_op_val[1]))
+    return relationship_exists(arg1, [relationship_restriction(arg1, arg2)])
+
+
+def relationship_restriction(relationship, value):
+    """Build the restriction on the related column of a `with` filter value."""
+    check_mapped_attribute(relationship)
+    column, (operator, value) = get_subquery(relationship, value)
+    return OPERATORS[operator](column, value)
+
+
+def relationship_exists(relationship, restrictions):
+    """Restrict to rows with one related row matching all restrictions."""
+    restriction = sqlalchemy.and_(*restrictions)
+    if relationship.property.uselist:
+        return relationship.any(restriction)
+    return relationship.has(restriction)
+
+
+RELATIONSHIP_STRATEGIES = ('exists', 'join')
+
+
+def relationship_restrictions(lookup, filters, strategy='exists'):
+    """Combine the `with` filters on the same relationship.
+
+    The ``exists`` strategy restricts each relationship with a single
+    EXISTS subquery matching all of its filters. The ``join`` strategy
+    returns the restrictions of the related columns and the relationships
+    to join, the query has to select DISTINCT rows.
+
+    :raises ValueError: if the strategy is unknown
+
+    :return: a tuple of the list of restrictions and the list of
+        relationships to join.
+    """
+    if strategy not in RELATIONSHIP_STRATEGIES:
+        raise ValueError("relationships must be one of {}".format(
+            ", ".join(RELATIONSHIP_STRATEGIES)))
+    groups = {}
+    for f in filters:
+        relationship = lookup(f["name"])
+        restrictions = groups.setdefault(f["name"].lower(),
+                                         (relationship, []))[1]
+        restrictions.append(relationship_restriction(relationship, f["val"]))
+    if strategy == 'join':
+        return ([r for _, restrictions in groups.values()
+                 for r in restrictions],
+                [relationship for relationship, _ in groups.values()])
+    return ([relationship_exists(relationship, restrictions)
+             for relationship, restrictions in groups.values()], [])
+
+
+SearchConfig = collections.namedtuple(
+    "SearchConfig", ["fts_table", "fts_column", "key", "config"])
+
+
+def base_columns(col):
+    """Return the table columns a Core column or ORM attribute is based on."""
+    prop = getattr(col, 'property', None)
+    if prop is not None:
+        cols = getattr(prop, 'columns', [])
     else:
-        restriction = arg1.has(OPERATORS[subquery_op_val[0]](subquery_column, subquery_op_val[1]))
-    return restriction
+        cols = [col]
+    return [base for c in cols for base in c.base_columns]
+
+
+def search_config(col, fts_table=None, fts_column=None, key=None,
+                  config='english'):
+    """Return the configuration of the search operator on a field.
+
+    PostgreSQL searches ``to_tsvector(config, field)``, which should be
+    backed by an expression index. SQLite searches an FTS5 table whose rowid
+    is the key of the table, e.g. an external content table created with
+    ``CREATE VIRTUAL TABLE delivery_fts USING fts5(error_info,
+    content='delivery', content_rowid='id')``.
+
+    :param col: the column or ORM attribute of a String field.
+    :param fts_table: string. The name of the FTS5 table on SQLite.
+    :param fts_column: string. The column of the FTS5 table, defaults to the
+        name of the table column.
+    :param key: the column of the table matching the rowid of the FTS5
+        table, defaults to the primary key of the table.
+    :param config: string. The text search configuration on PostgreSQL.
+
+    :raises TypeError: if the field is no String field
+    """
+    if not isinstance(getattr(col.type, 'impl', col.type),
+                      sqlalchemy.types.String):
+        raise TypeError("Cannot search field {}".format(col.key))
+    base = base_columns(col)[0]
+    if key is None and len(base.table.primary_key.columns) == 1:
+        key = list(base.table.primary_key.columns)[0]
+    return SearchConfig(fts_table, fts_column or base.name, key, config)
+
+
+def search_configs(lookup, search):
+    """Return the search configurations of fields by lowercase name.
+
+    :param search: a dict mapping field names to dicts of the arguments of
+        :func:`search_config` or None for the defaults.
+
+    :raises KeyError: if key is not available in query
+    :raises TypeError: if a field is no String field
+    """
+    return dict((name.lower(), search_config(lookup(name), **(options or {})))
+                for name, options in (search or {}).items())
+
+
+class FTSQuery(sqlalchemy.types.TypeDecorator):
+    """Convert search words into an FTS5 query on a column when bound."""
+
+    impl = sqlalchemy.types.String
+    cache_ok = True
+
+    def __init__(self, fts_column):
+        super(FTSQuery, self).__init__()
+        self.fts_column = fts_column
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        words = ['"{}"'.format(word.replace('"', '""'))
+                 for word in value.split()]
+        # an empty phrase matches nothing
+        return '"{}" : ({})'.format(self.fts_column.replace('"', '""'),
+                                    " ".join(words) or '""')
+
+
+class SearchMatch(ColumnElement):
+    """Full-text search of the words of a value in a column."""
+
+    inherit_cache = False
+
+    def __init__(self, column, value, config, key=None):
+        self.column = column
+        self.value = value
+        self.config = config
+        self.key = key
+
+
+@compiles(SearchMatch)
+def compile_search_match(element, compiler, **kw):
+    return compiler.process(element.column.match(element.value), **kw)
+
+
+@compiles(SearchMatch, 'postgresql')
+def compile_search_match_postgresql(element, compiler, **kw):
+    config = sqlalchemy.literal_column("'{}'::regconfig".format(
+        element.config.config.replace("'", "''")))
+    return compiler.process(
+        sqlalchemy.func.to_tsvector(config, element.column).op('@@')(
+            sqlalchemy.func.plainto_tsquery(config, element.value)), **kw)
+
+
+@compiles(SearchMatch, 'sqlite')
+def compile_search_match_sqlite(element, compiler, **kw):
+    config = element.config
+    if config.fts_table is None or element.key is None:
+        raise sqlalchemy.exc.CompileError(
+            "search on SQLite requires an FTS5 table and a key")
+    fts_table = sqlalchemy.table(config.fts_table)
+    value = sqlalchemy.type_coerce(element.value,
+                                   FTSQuery(config.fts_column))
+    matches = sqlalchemy.select(sqlalchemy.literal_column("rowid")) \
+        .select_from(fts_table) \
+        .where(sqlalchemy.literal_column(compiler.preparer.quote(
+            config.fts_table)).op('MATCH')(value))
+    return compiler.process(element.key.in_(matches), **kw)
+
+
+@requires_types(sqlalchemy.types.String)
+@convert_generic
+def search(arg1, arg2, config=None):
+    if config is None:
+        raise TypeError("Cannot apply filter search to field {}, it is not "
+                        "configured".format(arg1.key))
+    key = config.key
+    if key is not None and isinstance(arg1, ColumnClause) and \
+            arg1.table is not None:
+        key = arg1.table.corresponding_column(key)
+        if key is None:
+            raise TypeError("Cannot search field {}, the key {} is not "
+                            "selected".format(arg1.name, config.key.name))
+    return SearchMatch(arg1, arg2, config, key)
 
 
 UNARY_OPERATORS = ['is_null', 'is_not_null', 'is_true', 'is_false']
@@ -264,6 +604,7 @@ OPERATORS = {
     'not_ilike': not_ilike,
     'in': in_,
     'not_in': not_in,
+    'search': search,
     'with': with_
 }
 
@@ -281,6 +622,7 @@ def split_operator(param):
     return (name, operator)
 
 
+@instrumented('build_filters', parameters_fingerprint)
 def build_filters(query):
     """ build filter dictionary from a query dict"""
     filters = []
@@ -303,59 +645,922 @@ def get_column(s, name):
     raise KeyError("column {} not found".format(name))
 
 
+class QuerySchema(object):
+    """Precomputed filter information for a selectable or ORM model.
+
+    Build the schema once, e.g. at application startup, and pass it to
+    :func:`query`, :func:`core_query` or :func:`orm_query` in place of the
+    selectable or model. It holds a case-insensitive lookup of the columns,
+    the converter of each column and the operators allowed on it, so no
+    type checks are repeated per filter.
+
+    :param selectable_or_model: an SQLAlchemy Core Selectable or ORM Model
+    :param push_down: bool. Add the filters to the WHERE clause of a plain
+        Core Select instead of wrapping it in an alias.
+    :param watermark: string. The monotonic field of the ``since`` change
+        feed, see :func:`query`.
+    :param search: a dict mapping the fields the ``search`` operator can be
+        applied to to dicts of the arguments of :func:`search_config`.
+    :param large_in_threshold: int. The number of values of ``in`` and
+        ``not_in`` filters above which a VALUES construct is used, see
+        :func:`in_values`.
+
+    :raises KeyError: if the watermark or a search field is not available
+        in query
+    :raises TypeError: if a search field is no String field
+    """
+
+    def __init__(self, selectable_or_model, push_down=False, watermark=None,
+                 search=None, large_in_threshold=LARGE_IN_THRESHOLD):
+        self.selectable_or_model = selectable_or_model
+        self.watermark = watermark
+        self.large_in_threshold = large_in_threshold
+        self.use_core = isinstance(selectable_or_model, Selectable)
+        self.columns = {}
+        self.converters = {}
+        self.operators = {}
+
+        column_operators = frozenset(
+            op for op, f in OPERATORS.items() if op != 'with')
+        relationship_operators = frozenset(
+            op for op, f in OPERATORS.items() if not hasattr(f, 'types'))
+
+        columns = None
+        if self.use_core and push_down:
+            columns = push_down_columns(selectable_or_model)
+
+        if columns is not None:
+            self.target = selectable_or_model
+            attributes = [(name, col, col.type) for name, col in columns]
+        elif self.use_core:
+            self.target = selectable_or_model.alias("query")
+            attributes = [(col.name, col, col.type)
+                          for col in self.target.columns]
+        else:
+            self.target = selectable_or_model
+            mapper = sqlalchemy.inspect(selectable_or_model)
+            attributes = [(attr.key, getattr(selectable_or_model, attr.key),
+                           attr.columns[0].type)
+                          for attr in mapper.column_attrs]
+            attributes.extend((rel.key, getattr(selectable_or_model, rel.key),
+                               None)
+                              for rel in mapper.relationships)
+
+        for name, col, type_ in attributes:
+            key = name.lower()
+            if key in self.columns:
+                continue
+            self.columns[key] = col
+            if type_ is None:
+                self.converters[key] = keep_value
+                self.operators[key] = relationship_operators
+            else:
+                basetype = getattr(type_, 'impl', type_)
+                self.converters[key] = get_converter(type_)
+                self.operators[key] = frozenset(
+                    op for op in column_operators
+                    if isinstance(basetype, getattr(OPERATORS[op], 'types', object)))
+
+        if watermark is not None:
+            self.get_column(watermark)
+        self.search = search_configs(self.get_column, search)
+
+    def get_column(self, name):
+        try:
+            return self.columns[name.lower()]
+        except KeyError:
+            raise KeyError("column {} not found".format(name))
+
+    def restriction(self, f, search=None, large_in_threshold=None):
+        """Build the restriction of a filter without repeating type checks.
+
+        :param search: a :class:`SearchConfig` overriding the configuration
+            of the schema for a ``search`` filter.
+        :param large_in_threshold: int. Overrides the threshold of the
+            schema for ``in`` and ``not_in`` filters.
+
+        :raises KeyError: if key is not available in query
+        :raises ValueError: if value cannot be converted to Column Type
+        :raises TypeError: if filter is not available for SQLAlchemy Column Type
+        """
+        col = self.get_column(f["name"])
+        key = f["name"].lower()
+        op = f["op"]
+        func = OPERATORS[op]
+        if op not in self.operators[key]:
+            raise TypeError("Cannot apply filter to field {}".format(f["name"]))
+        if not (hasattr(func, 'types') or hasattr(func, 'convert')):
+            return apply_filter(col, f)
+        func = inspect.unwrap(func)
+        if op in UNARY_OPERATORS:
+            return func(col)
+        value = get_value_conversion(op)(self.converters[key], f["val"])
+        if op == 'search':
+            return func(col, value, config=search or self.search.get(key))
+        if op in ('in', 'not_in'):
+            if large_in_threshold is None:
+                large_in_threshold = self.large_in_threshold
+            return func(col, value, threshold=large_in_threshold)
+        return func(col, value)
+
+    def restrictions(self, filters):
+        return [self.restriction(f) for f in filters]
+
+
+def get_value_conversion(op):
+    """Return the value conversion of an operator."""
+    return getattr(OPERATORS[op], 'convert', convert_passthrough)
+
+
+def convert_passthrough(converter, value):
+    return value
+
+
+def apply_filter(col, f, search=None, large_in_threshold=None):
+    """Build the restriction of a single filter on the given column.
+
+    :param search: the :class:`SearchConfig` of the column for ``search``
+        filters.
+    :param large_in_threshold: int. The number of values of ``in`` and
+        ``not_in`` filters above which a VALUES construct is used, see
+        :func:`in_values`.
+    """
+    if f["op"] in UNARY_OPERATORS:
+        return OPERATORS[f["op"]](col)
+    if f["op"] == 'search':
+        return OPERATORS[f["op"]](col, f["val"], config=search)
+    if f["op"] in ('in', 'not_in'):
+        return OPERATORS[f["op"]](col, f["val"], threshold=large_in_threshold)
+    return OPERATORS[f["op"]](col, f["val"])
+
+
+def get_limit(limit, upper_bound_limit):
+    """Return the effective limit or None if the query is unlimited."""
+    if limit or upper_bound_limit:
+        if limit is None:
+            return upper_bound_limit
+        if upper_bound_limit:
+            return min(int(limit), upper_bound_limit)
+        return int(limit)
+    return None
+
+
+def paginate(filtered, order_cols=(), asc=True, limit=None, offset=None):
+    """Apply ordering, limit and offset to a Core Select or ORM Query."""
+    if order_cols:
+        if not asc:
+            order_cols = [col.desc() for col in order_cols]
+        filtered = filtered.order_by(None).order_by(*order_cols)
+
+    if limit is not None:
+        filtered = filtered.limit(limit)
+
+    if offset is not None:
+        filtered = filtered.offset(offset)
+
+    return filtered
+
+
+def uses_core(selectable_or_model):
+    """Return whether the query is built with the Core or the ORM."""
+    if isinstance(selectable_or_model, QuerySchema):
+        return selectable_or_model.use_core
+    return isinstance(selectable_or_model, Selectable)
+
+
+def selects_entity(statement):
+    """Return whether a 2.0 style ``select()`` selects a single ORM entity.
+
+    Only then are the rows of its result narrowed to the ORM objects with
+    ``scalars()``, other statements like aggregates yield their rows.
+    """
+    descriptions = statement.column_descriptions
+    return len(descriptions) == 1 and isinstance(
+        sqlalchemy.inspect(descriptions[0]["expr"], raiseerr=False),
+        (sqlalchemy.orm.Mapper, sqlalchemy.orm.util.AliasedInsp))
+
+
+def push_down_columns(selectable):
+    """Return the columns to filter a Select on directly.
+
+    Filters can be added to the WHERE clause of a plain Select whose columns
+    are all plain columns of its FROM clauses. Selects with GROUP BY,
+    HAVING, DISTINCT, LIMIT or OFFSET as well as compound selects like
+    UNIONs have to be wrapped in an alias instead.
+
+    :return: a list of tuples of the exported name and the underlying
+        column or None if the filters cannot be pushed down.
+    """
+    if not isinstance(selectable, Select):
+        return None
+    if (selectable._group_by_clauses or selectable._having_criteria or
+            selectable._distinct or selectable._limit_clause is not None or
+            selectable._offset_clause is not None or
+            selectable._fetch_clause is not None):
+        return None
+    columns = []
+    exported = selectable.subquery().columns
+    for name, col in zip([c.name for c in exported],
+                         selectable.selected_columns):
+        if isinstance(col, Label):
+            col = col.element
+        if not isinstance(col, ColumnClause):
+            return None
+        columns.append((name, col))
+    return columns
+
+
+def get_pushed_down_column(columns, name):
+    for exported, col in columns:
+        if exported.lower() == name.lower():
+            return col
+    raise KeyError("column {} not found".format(name))
+
+
+def resolve(selectable_or_model, push_down=False):
+    """Resolve the target of a query.
+
+    :param push_down: bool. Filter a Select directly instead of an alias of
+        it if possible, see :func:`push_down_columns`.
+
+    :return: a tuple of a bool whether the Core is used, the alias, select or
+        model to select from and a function looking up columns by name.
+    """
+    if isinstance(selectable_or_model, QuerySchema):
+        return (selectable_or_model.use_core, selectable_or_model.target,
+                selectable_or_model.get_column)
+    if isinstance(selectable_or_model, Selectable):
+        columns = push_down_columns(selectable_or_model) if push_down else None
+        if columns is not None:
+            return (True, selectable_or_model,
+                    functools.partial(get_pushed_down_column, columns))
+        alias = selectable_or_model.alias("query")
+        return True, alias, functools.partial(get_column, alias)
+    return (False, selectable_or_model,
+            functools.partial(getattr, selectable_or_model))
+
+
+def get_primary_key(use_core, target, lookup, primary_key=None):
+    """Return the primary key columns used as tie-breaker for keyset pagination.
+
+    :param primary_key: a list of field names overriding the primary key.
+    """
+    if primary_key:
+        return [lookup(name) for name in primary_key]
+    if isinstance(target, Select):
+        cols = [lookup(col.name) for col in target.subquery().primary_key]
+    elif use_core:
+        cols = list(target.primary_key)
+    else:
+        mapper = sqlalchemy.inspect(target)
+        cols = [getattr(target, mapper.get_property_by_column(col).key)
+                for col in mapper.primary_key]
+    if not cols:
+        raise KeyError("no primary key found, provide `primary_key`")
+    return cols
+
+
+def token_converter(type_):
+    """Return the function converting values of a type read from a token.
+
+    :raises ValueError: if values of the type cannot be stored in a token
+    """
+    basetype = getattr(type_, 'impl', type_)
+    if isinstance(basetype, sqlalchemy.types.Boolean):
+        return bool
+    elif isinstance(basetype, sqlalchemy.types.Float):
+        return float
+    elif isinstance(basetype, sqlalchemy.types.Numeric):
+        return decimal.Decimal if basetype.asdecimal else float
+    converter = get_converter(type_)
+    if converter is no_value:
+        raise ValueError("Cannot paginate by keyset on type {}".format(type_))
+    return converter
+
+
+def encode_after(values):
+    """Encode the key values of a row into an opaque `_after` token."""
+    def default(value):
+        if isinstance(value, decimal.Decimal):
+            return str(value)
+        return value.isoformat()
+    data = json.dumps(values, default=default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def decode_after(token, cols):
+    """Decode an `_after` token into the python values of the key columns.
+
+    :raises ValueError: if the token is invalid
+    """
+    try:
+        data = base64.urlsafe_b64decode(token.encode('ascii'))
+        values = json.loads(data.decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError("invalid `_after` token {}".format(token))
+    if not isinstance(values, list) or len(values) != len(cols):
+        raise ValueError("invalid `_after` token {}".format(token))
+    try:
+        return [None if value is None else token_converter(col.type)(value)
+                for col, value in zip(cols, values)]
+    except decimal.InvalidOperation:
+        raise ValueError("invalid `_after` token {}".format(token))
+
+
+# dialects sorting NULL values before all other values in ascending order
+NULLS_FIRST_DIALECTS = frozenset(['sqlite', 'mysql', 'mssql'])
+
+
+def nulls_first(dialect, asc=True):
+    """Return whether the dialect sorts NULL values first in the order."""
+    return (dialect.name in NULLS_FIRST_DIALECTS) == asc
+
+
+def key_after(cols, values, asc=True):
+    key = sqlalchemy.tuple_(*cols)
+    values = sqlalchemy.tuple_(*values)
+    return key > values if asc else key < values
+
+
+class KeysetAfter(ColumnElement):
+    """The restriction to the rows after a key of a keyset pagination.
+
+    Rows with NULL values of the order column come before or after all other
+    rows, where the database sorts them.
+    """
+
+    _traverse_internals = [
+        ("nulls_before", InternalTraversal.dp_clauseelement),
+        ("nulls_after", InternalTraversal.dp_clauseelement),
+        ("asc", InternalTraversal.dp_boolean)]
+
+    inherit_cache = True
+
+    def __init__(self, cols, values, asc=True):
+        order_col = cols[0]
+        self.asc = asc
+        if values[0] is None:
+            after = sqlalchemy.and_(order_col.is_(None),
+                                    key_after(cols[1:], values[1:], asc))
+            self.nulls_before = sqlalchemy.or_(after, order_col.isnot(None))
+            self.nulls_after = after
+        else:
+            # the comparison of a tuple with NULL values is never true
+            after = key_after(cols, values, asc)
+            self.nulls_before = after
+            self.nulls_after = sqlalchemy.or_(after, order_col.is_(None))
+
+
+@compiles(KeysetAfter)
+def compile_keyset_after(element, compiler, **kw):
+    restriction = element.nulls_before \
+        if nulls_first(compiler.dialect, element.asc) else element.nulls_after
+    return compiler.process(restriction.self_group(), **kw)
+
+
+def split_fields(fields):
+    if isinstance(fields, str):
+        fields = [name.strip() for name in fields.split(",")]
+    return [name for name in fields if name]
+
+
+def projection(use_core, target, lookup, fields):
+    """Return the columns or ORM attributes of the requested fields.
+
+    The columns of a Select resolved for push down keep their labels.
+
+    :param fields: a list of field names or a comma separated string.
+
+    :raises KeyError: if a field is not available in query
+    """
+    fields = split_fields(fields)
+    if use_core and isinstance(target, Select):
+        exported = [col.name for col in target.subquery().columns]
+        selected = dict((name.lower(), col) for name, col in
+                        reversed(list(zip(exported, target.selected_columns))))
+        cols = []
+        for name in fields:
+            if name.lower() not in selected:
+                raise KeyError("column {} not found".format(name))
+            cols.append(selected[name.lower()])
+        return cols
+    return [lookup(name) for name in fields]
+
+
+AGGREGATES = {
+    'count': sqlalchemy.func.count,
+    'sum': sqlalchemy.func.sum,
+    'avg': sqlalchemy.func.avg,
+    'min': sqlalchemy.func.min,
+    'max': sqlalchemy.func.max,
+}
+
+NUMERIC_AGGREGATES = ('sum', 'avg')
+
+
+def parse_aggregates(agg):
+    """Parse `_agg` into tuples of the aggregate and the field or None.
+
+    :param agg: a list of aggregates or a comma separated string.
+    """
+    aggregates = []
+    for item in split_fields(agg):
+        name, _, field = item.partition(':')
+        aggregates.append((name.strip().lower(), field.strip() or None))
+    return aggregates
+
+
+def aggregate_columns(lookup, agg):
+    """Return the labeled aggregate columns of `_agg`.
+
+    :raises KeyError: if key is not available in query
+    :raises ValueError: if an aggregate is unknown or lacks its field
+    :raises TypeError: if an aggregate is not available for the Column Type
+    """
+    cols = []
+    for name, field in parse_aggregates(agg):
+        if name not in AGGREGATES:
+            raise ValueError("unknown aggregate {}".format(name))
+        if field is None:
+            if name != 'count':
+                raise ValueError("aggregate {} requires a field".format(name))
+            cols.append(sqlalchemy.func.count().label(name))
+            continue
+        col = lookup(field)
+        basetype = getattr(col.type, 'impl', col.type)
+        if name in NUMERIC_AGGREGATES and not isinstance(
+                basetype, (sqlalchemy.types.Integer, sqlalchemy.types.Numeric)):
+            raise TypeError("Cannot apply aggregate {} to field {}".format(
+                name, field))
+        cols.append(AGGREGATES[name](col).label(
+            "{}_{}".format(name, field.lower())))
+    return cols
+
+
+def select_aggregates(use_core, target, lookup, restrictions, group_by=None,
+                      agg=None, future=False):
+    """Select the aggregates of the restricted target per group.
+
+    :param group_by: a list of field names or a comma separated string.
+    :param agg: a list of aggregates or a comma separated string, see
+        :func:`parse_aggregates`.
+
+    :return: a tuple of the statement and the aggregate columns.
+    """
+    group_cols = projection(use_core, target, lookup, group_by or [])
+    agg_cols = aggregate_columns(lookup, agg or [])
+    columns = group_cols + agg_cols
+    if use_core:
+        selected = select_from(target, restrictions, columns)
+    elif future:
+        selected = sqlalchemy.select(*columns).select_from(target) \
+            .where(*restrictions)
+    else:
+        selected = sqlalchemy.orm.Query(columns).select_from(target) \
+            .filter(*restrictions)
+    if group_cols:
+        selected = selected.group_by(*[
+            col.element if isinstance(col, Label) else col
+            for col in group_cols])
+    return selected, agg_cols
+
+
+def eager_loads(lookup, expand):
+    """Return the loader options eager loading the relationships.
+
+    Collections are loaded with ``selectinload``, so the rows of a page are
+    not multiplied, and many-to-one relationships with ``joinedload``.
+
+    :param expand: a list of relationship names or a comma separated string.
+
+    :raises TypeError: if a field is not a mapped relationship
+    """
+    options = []
+    for name in split_fields(expand):
+        relationship = lookup(name)
+        check_mapped_attribute(relationship)
+        if relationship.property.uselist:
+            options.append(sqlalchemy.orm.selectinload(relationship))
+        else:
+            options.append(sqlalchemy.orm.joinedload(relationship))
+    return options
+
+
+SAMPLE_METHODS = ('system', 'bernoulli')
+
+# Knuth's multiplicative hash spreads consecutive keys evenly over 32 bits
+SAMPLE_MULTIPLIER = 2654435761
+SAMPLE_MODULUS = 2 ** 32
+
+
+class Sample(TableSample):
+    """A random sample of the rows of a table.
+
+    Compiled to ``TABLESAMPLE`` on PostgreSQL. Other databases select the
+    rows whose hashed integer key falls below the percentage from a
+    subquery named like the sample.
+    """
+
+    _traverse_internals = TableSample._traverse_internals + [
+        ("key", InternalTraversal.dp_clauseelement)]
+
+    inherit_cache = True
+
+    @classmethod
+    def _construct(cls, table, percent, method='system', seed=None,
+                   key=None, name=None):
+        sampling = getattr(sqlalchemy.func, method)(percent)
+        sample = super(Sample, cls)._construct(
+            table, sampling, name=name,
+            seed=sqlalchemy.literal(seed) if seed is not None else None)
+        sample.key = key
+        return sample
+
+
+def sample_restriction(key, percent, seed=0):
+    """Return a restriction selecting about percent of the rows by key."""
+    hashed = ((key + seed * 40503) * SAMPLE_MULTIPLIER) % SAMPLE_MODULUS
+    return hashed < percent * (SAMPLE_MODULUS / 100)
+
+
+@compiles(Sample)
+def compile_sample(element, compiler, **kw):
+    table = element.element
+    key = element.key
+    if key is None or not isinstance(key.type, sqlalchemy.types.Integer):
+        raise sqlalchemy.exc.CompileError(
+            "sampling {} on {} requires an Integer key".format(
+                table.name, compiler.dialect.name))
+    # reuse the parameters of the sample so cached statements stay valid
+    percent = element.sampling.clauses.clauses[0]
+    seed = element.seed if element.seed is not None else 0
+    sampled = sqlalchemy.select(table).where(
+        sample_restriction(key, percent, seed))
+    from_linter = kw.pop('from_linter', None)
+    if from_linter is not None and kw.get('asfrom'):
+        # joins refer to the sample, not to the subquery replacing it
+        from_linter.froms[element] = element.name
+    return compiler.process(sampled.subquery(element.name), **kw)
+
+
+@compiles(Sample, 'postgresql')
+def compile_sample_postgresql(element, compiler, **kw):
+    return compiler.visit_tablesample(element, **kw)
+
+
+def sample_statement(statement, sampled, use_core):
+    """Select from the sample instead of its table in a Core statement.
+
+    ORM queries select from an alias of the model on the sample instead.
+    """
+    if sampled is None or not use_core:
+        return statement
+    return ClauseAdapter(sampled).traverse(statement)
+
+
+def parse_sample(sample, seed=None, method='system'):
+    """Return the percentage and seed of a sample.
+
+    :raises ValueError: if the percentage is not in (0, 100], the seed is
+        no integer or the method is unknown
+    """
+    if method not in SAMPLE_METHODS:
+        raise ValueError("unknown sample method {}".format(method))
+    try:
+        percent = float(sample)
+        seed = int(seed) if seed is not None and seed != '' else None
+    except (TypeError, ValueError):
+        raise ValueError("invalid `_sample` {} or `_seed` {}".format(sample,
+                                                                    seed))
+    if not 0 < percent <= 100:
+        raise ValueError("`_sample` has to be a percentage in (0, 100]")
+    return percent, seed
+
+
+def sample_table(use_core, target, lookup, sample, seed=None,
+                 method='system', primary_key=None):
+    """Return a :class:`Sample` of the table the query is sampled by.
+
+    Core queries sample the table of the first primary key column, which
+    can be chosen with ``primary_key``. ORM queries sample the table of the
+    model.
+
+    :raises TypeError: if the model is not mapped to a single table
+    """
+    percent, seed = parse_sample(sample, seed, method)
+    if use_core:
+        key = base_columns(get_primary_key(use_core, target, lookup,
+                                           primary_key)[0])[0]
+        table = key.table
+    else:
+        table = sqlalchemy.inspect(target).persist_selectable
+        if not isinstance(table, sqlalchemy.Table):
+            raise TypeError("Cannot sample {}, it is not mapped to a single "
+                            "table".format(target.__name__))
+        keys = list(table.primary_key.columns)
+        key = keys[0] if len(keys) == 1 else None
+    return Sample._construct(table, percent, method, seed, key,
+                             name="{}_sample".format(table.name))
+
+
+def get_order_column(lookup, order, agg_cols=()):
+    for col in agg_cols:
+        if col.name == order.lower():
+            return col
+    return lookup(order)
+
+
+def keyset_columns(use_core, target, lookup, order=None, primary_key=None):
+    """Return the columns of a keyset pagination.
+
+    :raises ValueError: if the values of a column cannot be stored in a token
+    """
+    order_cols = [lookup(order)] if order else []
+    cols = order_cols + get_primary_key(use_core, target, lookup, primary_key)
+    for col in cols:
+        token_converter(col.type)
+    return cols
+
+
+def row_keys(target, cols):
+    """Return the keys of columns in the rows of a query.
+
+    Filters pushed down to a Select look up the underlying columns, which
+    the rows expose by the names the Select exports them with.
+    """
+    columns = push_down_columns(target) if isinstance(target, Select) \
+        else None
+    if columns is None:
+        return [col.key for col in cols]
+    keys = []
+    for col in cols:
+        for name, selected in columns:
+            if selected is col:
+                keys.append(name)
+                break
+        else:
+            keys.append(col.key)
+    return keys
+
+
+def after_token(selectable_or_model, row, order=None, primary_key=None):
+    """Return the `_after` token continuing a keyset pagination after the row.
+
+    :param selectable_or_model: the selectable, model or :class:`QuerySchema`
+        passed to :func:`query`.
+    :param row: the last row or ORM object of the current page.
+    :param order: string. The order field passed to :func:`query`.
+    :param primary_key: the primary key fields passed to :func:`query`.
+    """
+    use_core, target, lookup = resolve(selectable_or_model)
+    cols = keyset_columns(use_core, target, lookup, order=order,
+                          primary_key=primary_key)
+    return encode_after([getattr(row, key) for key in row_keys(target, cols)])
+
+
+def get_watermark(selectable_or_model, watermark=None):
+    """Return the watermark field of a change feed.
+
+    :raises ValueError: if no watermark is configured
+    """
+    watermark = watermark or getattr(selectable_or_model, 'watermark', None)
+    if not watermark:
+        raise ValueError("`since` requires a watermark field")
+    return watermark
+
+
+def watermark_token(selectable_or_model, rows, since, watermark=None,
+                    primary_key=None):
+    """Return the `_since` token of the next poll of a change feed.
+
+    The watermark only moves forward, the token of a poll without changes
+    is the token it was made with.
+
+    :param selectable_or_model: the selectable, model or :class:`QuerySchema`
+        passed to :func:`query`.
+    :param rows: the list of rows or ORM objects of the current poll.
+    :param since: string. The token passed to :func:`query`.
+    :param watermark: string. The watermark field passed to :func:`query`.
+    :param primary_key: the primary key fields passed to :func:`query`.
+    """
+    if not rows:
+        return since
+    return after_token(selectable_or_model, rows[-1],
+                       order=get_watermark(selectable_or_model, watermark),
+                       primary_key=primary_key)
+
+
+@instrumented('construction', query_fingerprint)
 def query(selectable_or_model, filters, limit=None, offset=None, order=None,
-          asc=True, upper_bound_limit=10000):
+          asc=True, upper_bound_limit=10000, after=None, primary_key=None,
+          push_down=False, policy=None, future=False, fields=None,
+          group_by=None, agg=None, relationships='exists', expand=None,
+          sample=None, seed=None, sample_method='system', since=None,
+          watermark=None, search=None, large_in_threshold=None):
     """
     Main entry point for applying filters and pagination controls.
 
-    :param selectable_or_model: an SQLAlchemy Core Selectable or ORM Model
+    Keyset pagination is enabled by providing ``after``. The query is
+    ordered by the order field and the primary key and starts after the
+    row encoded in the token, an empty token starts with the first page.
+    The token for the next page is returned by :func:`after_token`. Rows
+    with a NULL value in the order field are paged before or after all
+    other rows, where the database sorts them.
+
+    All ``with`` filters on the same relationship have to match the same
+    related row, e.g. ``pets__with__p_name__eq=x&pets__with__p_id__gt=3``
+    selects the users with a pet named x whose id is greater than 3.
+
+    :param selectable_or_model: an SQLAlchemy Core Selectable, ORM Model or
+        a :class:`QuerySchema` of either
     :param filters: a list of filters produced by build_filters
     :param limit: int. the limit.
     :param offset: int. the offset.
     :param order: string. The name of the field to order by.
     :param asc: bool. Ascending (default) or descending order.
     :param upper_bound_limit: int. An absolute upper bound limit to use. Disabled if set to None.
+    :param after: string. An `_after` token produced by :func:`after_token`.
+    :param primary_key: a list of field names used as tie-breaker for
+        keyset pagination. Defaults to the primary key.
+    :param push_down: bool. Add the filters to the WHERE clause of a plain
+        Core Select instead of wrapping it in an alias.
+    :param policy: a :class:`qsqla.policy.IndexPolicy` the filters and the
+        order field are checked against. It may rewrite prefix ``like`` and
+        ``ilike`` filters into ranges.
+    :param future: bool. Return a 2.0 style ``select()`` of the ORM Model
+        instead of a legacy ORM Query.
+    :param fields: a list of field names or a comma separated string. Only
+        these columns are selected, ORM queries load only these attributes
+        and the primary key of the entities. Keyset pagination and change
+        feeds add the order field and the primary key.
+    :param group_by: a list of field names or a comma separated string. The
+        filtered records are grouped by these fields.
+    :param agg: a list of aggregates or a comma separated string, e.g.
+        ``"count,sum:row_count"``, selected per group. Core and ORM queries
+        return rows of the group fields and the aggregates.
+    :param relationships: ``"exists"`` (default) to match the ``with``
+        filters of a relationship in a single EXISTS subquery or ``"join"``
+        to join the relationships and select DISTINCT entities.
+    :param expand: a list of relationship names or a comma separated string.
+        The relationships are loaded eagerly with the entities of an ORM
+        query, see :func:`eager_loads`.
+    :param sample: float. Select a random sample of about this percentage
+        of the rows, see :func:`sample_table`.
+    :param seed: int. Repeat the sample of a previous query with the seed.
+    :param sample_method: ``"system"`` (default) sampling pages or
+        ``"bernoulli"`` sampling rows with ``TABLESAMPLE``. Other databases
+        always sample rows.
+    :param since: string. A watermark token produced by
+        :func:`watermark_token`. Only rows with a watermark field greater
+        than the token are selected, ordered by the watermark field and the
+        primary key. An empty token starts with the oldest row. Rows with a
+        NULL watermark are never selected.
+    :param watermark: string. The monotonic field of the change feed,
+        defaults to the watermark of a :class:`QuerySchema`.
+    :param search: a dict mapping the fields the ``search`` operator can be
+        applied to to dicts of the arguments of :func:`search_config`. It
+        extends the configurations of a :class:`QuerySchema`.
+    :param large_in_threshold: int. The number of values of ``in`` and
+        ``not_in`` filters above which a VALUES construct is used, defaults
+        to the threshold of a :class:`QuerySchema` or
+        :data:`LARGE_IN_THRESHOLD`, see :func:`in_values`.
 
     :raises KeyError: if key is not available in query
-    :raises ValueError: if value cannot be converted to Column Type
+    :raises ValueError: if value cannot be converted to Column Type, the
+        policy rejects a filter, an aggregate or the sample is invalid
     :raises TypeError: if filter is not available for SQLAlchemy Column Type
 
     :return: an SQLAlchemy Core Selectable or ORM Query object.
     """
-    use_core = isinstance(selectable_or_model, Selectable)
-    func = core_query if use_core else orm_query
-    filtered = func(selectable_or_model, filters)
-
-    if order:
-        if use_core:
-            order_col = get_column(selectable_or_model, order)
-        else:
-            order_col = getattr(selectable_or_model, order)
-        if not asc:
-            order_col = order_col.desc()
-        filtered = filtered.order_by(order_col)
-
-    if limit or upper_bound_limit:
-        if limit is None:
-            limit = upper_bound_limit
-        else:
-            if upper_bound_limit:
-                limit = min(int(limit), upper_bound_limit)
+    if since is not None:
+        if after is not None or order:
+            raise ValueError("`since` cannot be combined with `after` or "
+                             "`order`")
+        order, asc, after = get_watermark(selectable_or_model,
+                                          watermark), True, since
+    if policy is not None:
+        policy.check(filters, order)
+    use_core, target, lookup = resolve(selectable_or_model, push_down)
+    search = search_configs(lookup, search)
+    if isinstance(selectable_or_model, QuerySchema):
+        search = dict(selectable_or_model.search, **search)
+    sampled = sample_table(use_core, target, lookup, sample, seed,
+                           sample_method, primary_key) \
+        if sample is not None else None
+    if sampled is not None and not use_core:
+        target = sqlalchemy.orm.aliased(target, sampled)
+        lookup = functools.partial(getattr, target)
+        selectable_or_model = target
+    restrictions, joins = build_restrictions(
+        selectable_or_model, lookup, filters, relationships,
+        policy.rewrite if policy is not None else None, search,
+        large_in_threshold)
+
+    if expand and use_core:
+        raise TypeError("`expand` can only be used on ORM queries")
+
+    if group_by or agg:
+        if after is not None or fields or joins or expand:
+            raise ValueError("`after`, `fields`, `expand` and joined "
+                             "relationships cannot be combined with "
+                             "aggregates")
+        filtered, agg_cols = select_aggregates(use_core, target, lookup,
+                                               restrictions, group_by, agg,
+                                               future)
+        order_cols = [get_order_column(lookup, order, agg_cols)] \
+            if order else []
+        return sample_statement(
+            paginate(filtered, order_cols, asc,
+                     get_limit(limit, upper_bound_limit), offset or None),
+            sampled, use_core)
+
+    order_cols = [lookup(order)] if order else []
+    if after is not None:
+        order_cols = keyset_columns(use_core, target, lookup, order,
+                                    primary_key)
+        if after:
+            values = decode_after(after, order_cols)
+            if order:
+                restrictions.append(KeysetAfter(order_cols, values, asc))
             else:
-                limit = int(limit)
-        filtered = filtered.limit(limit)
-
-    if offset:
-        filtered = filtered.offset(offset)
-
-    return filtered
+                restrictions.append(key_after(order_cols, values, asc))
+
+    columns = None
+    if fields:
+        fields = split_fields(fields)
+        if after is not None:
+            # the token of the next page is read from the keyset columns
+            requested = set(name.lower() for name in fields)
+            fields += [key for key in row_keys(target, order_cols)
+                       if key.lower() not in requested]
+        columns = projection(use_core, target, lookup, fields)
+    if use_core:
+        filtered = select_from(target, restrictions, columns)
+    else:
+        filtered = select_model(target, restrictions, future, columns, joins)
+        if expand:
+            filtered = filtered.options(*eager_loads(lookup, expand))
+
+    return sample_statement(
+        paginate(filtered, order_cols, asc,
+                 get_limit(limit, upper_bound_limit), offset or None),
+        sampled, use_core)
+
+
+def build_restrictions(selectable_or_model, lookup, filters,
+                       relationships='exists', rewrite=None, search=None,
+                       large_in_threshold=None):
+    """Build the restrictions of the filters.
+
+    :param rewrite: a function taking a column and a filter and returning
+        an equivalent restriction or None to build the restriction of the
+        operator, e.g. :meth:`qsqla.policy.IndexPolicy.rewrite`.
+    :param search: a dict of :class:`SearchConfig` by lowercase field name,
+        see :func:`search_configs`. A :class:`QuerySchema` falls back to its
+        own configurations.
+    :param large_in_threshold: int. The threshold of ``in`` and ``not_in``
+        filters, a :class:`QuerySchema` falls back to its own threshold.
+
+    :return: a tuple of the list of restrictions and the list of
+        relationships to join, see :func:`relationship_restrictions`.
+    """
+    with_filters = [f for f in filters if f["op"] == 'with']
+    filters = [f for f in filters if f["op"] != 'with']
+    search = search or {}
+    if isinstance(selectable_or_model, QuerySchema):
+        def restriction(f):
+            return selectable_or_model.restriction(
+                f, search.get(f["name"].lower()), large_in_threshold)
+    else:
+        def restriction(f):
+            return apply_filter(lookup(f["name"]), f,
+                                search.get(f["name"].lower()),
+                                large_in_threshold)
+    restrictions = []
+    for f in filters:
+        rewritten = rewrite(lookup(f["name"]), f) if rewrite else None
+        restrictions.append(rewritten if rewritten is not None
+                            else restriction(f))
+    with_restrictions, joins = relationship_restrictions(lookup, with_filters,
+                                                         relationships)
+    return restrictions + with_restrictions, joins
 
 
-def core_query(selectable, filters):
+@instrumented('construction', query_fingerprint)
+def core_query(selectable, filters, push_down=False, group_by=None,
+               agg=None, search=None):
     """Add filters to an sqlalchemy selectable
 
-    :param selectable: the select statements
+    :param selectable: the select statements or a :class:`QuerySchema` of it
     :param filters: a list of filters produced by build_filters
+    :param push_down: bool. Add the filters to the WHERE clause of the
+        selectable if it is a plain Select, instead of wrapping it in an alias.
+    :param group_by: a list of field names or a comma separated string to
+        group the filtered rows by.
+    :param agg: a list of aggregates or a comma separated string selected
+        per group.
+    :param search: a dict of the fields the ``search`` operator can be
+        applied to, see :func:`query`.
 
     :raises KeyError: if key is not available in query
     :raises ValueError: if value cannot be converted to Column Type
@@ -363,38 +1568,92 @@ def core_query(selectable, filters):
 
     :return: a selectable with the filters applied
     """
-    restrictions = []
+    _, target, lookup = resolve(selectable, push_down)
+    restrictions = build_restrictions(selectable, lookup, filters,
+                                      search=search_configs(lookup,
+                                                            search))[0]
+    if group_by or agg:
+        return select_aggregates(True, target, lookup, restrictions,
+                                 group_by, agg)[0]
+    return select_from(target, restrictions)
 
-    alias = selectable.alias("query")
 
-    for f in filters:
-        col = get_column(alias, f["name"])
-        if f["op"] in UNARY_OPERATORS:
-            restrictions.append(OPERATORS[f["op"]](col))
-        else:
-            restrictions.append(OPERATORS[f["op"]](col, f["val"]))
+def select_from(alias, restrictions, columns=None):
+    """Select all columns of the alias restricted by the restrictions.
 
-    if restrictions:
-        sel = sqlalchemy.select([alias], whereclause=sqlalchemy.and_(*restrictions))
+    A Select resolved for push down is restricted directly.
+
+    :param columns: a list of columns to select instead of all columns.
+    """
+    if isinstance(alias, Select):
+        if columns:
+            alias = alias.with_only_columns(*columns)
     else:
-        sel = sqlalchemy.select([alias])
-    return sel
+        alias = sqlalchemy.select(*columns) if columns else \
+            sqlalchemy.select(alias)
+    if restrictions:
+        return alias.where(*restrictions)
+    return alias
+
 
+def select_model(model, restrictions, future=False, columns=None, joins=()):
+    """Select the model restricted by the restrictions.
 
-def orm_query(model, filters):
+    :param future: bool. Return a 2.0 style ``select()`` instead of a legacy
+        ORM Query.
+    :param columns: a list of attributes of the model to load instead of all
+        attributes.
+    :param joins: a list of relationships to join, DISTINCT entities are
+        selected.
+    """
+    if future:
+        selected = sqlalchemy.select(model)
+    else:
+        selected = sqlalchemy.orm.Query(model)
+    for relationship in joins:
+        selected = selected.join(relationship)
+    if joins:
+        selected = selected.distinct()
+    selected = selected.filter(*restrictions)
+    if columns:
+        selected = selected.options(sqlalchemy.orm.load_only(*columns))
+    return selected
+
+
+@instrumented('construction', query_fingerprint)
+def orm_query(model, filters, future=False, group_by=None, agg=None,
+              relationships='exists', expand=None, search=None):
     """ Add filters to an sqlalchemy ORM query
-    :param model: an SQLAlchemy Model
+    :param model: an SQLAlchemy Model or a :class:`QuerySchema` of it
     :param filters: a list of filters produced by build_filters
+    :param future: bool. Return a 2.0 style ``select()`` instead of a legacy
+        ORM Query.
+    :param group_by: a list of attribute names or a comma separated string
+        to group the filtered entities by.
+    :param agg: a list of aggregates or a comma separated string selected
+        per group.
+    :param relationships: ``"exists"`` or ``"join"``, see :func:`query`.
+    :param expand: a list of relationship names or a comma separated string
+        to load eagerly, see :func:`eager_loads`.
+    :param search: a dict of the fields the ``search`` operator can be
+        applied to, see :func:`query`.
 
     :return: a SQLAlchemy ORM Query with the filters applied
     """
-    query = sqlalchemy.orm.Query(model)
-    restrictions = []
-    for f in filters:
-        col = getattr(model, f['name'])
-        if f["op"] in UNARY_OPERATORS:
-            restrictions.append(OPERATORS[f["op"]](col))
-        else:
-            restrictions.append(OPERATORS[f["op"]](col, f["val"]))
-    query = query.filter(*restrictions)
-    return query
+    if isinstance(model, QuerySchema):
+        target, lookup = model.target, model.get_column
+    else:
+        target, lookup = model, functools.partial(getattr, model)
+    restrictions, joins = build_restrictions(
+        model, lookup, filters, relationships,
+        search=search_configs(lookup, search))
+    if group_by or agg:
+        if joins or expand:
+            raise ValueError("`expand` and joined relationships cannot be "
+                             "combined with aggregates")
+        return select_aggregates(False, target, lookup, restrictions,
+                                 group_by, agg, future)[0]
+    selected = select_model(target, restrictions, future, joins=joins)
+    if expand:
+        selected = selected.options(*eager_loads(lookup, expand))
+    return selected
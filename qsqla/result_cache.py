@@ -0,0 +1,261 @@
+"""
+Result Cache
+============
+
+:class:`ResultCache` executes queries and caches their rows for a time to
+live. The cache key is a fingerprint of the database of the connection, the
+selectable, the filters and the pagination controls, so equal requests share
+an entry regardless of the order of their filters, but never across
+databases.
+
+.. code::
+
+    cache = ResultCache(SQLiteBackend("/tmp/qsqla_cache.sqlite"), ttl=60)
+    rows = cache.execute(connection, sel, build_filters(request.args), limit=10)
+
+    # writers purge the entries of the tables they changed
+    cache.invalidate("delivery")
+
+Every entry records a version of each table its statement reads from.
+:meth:`ResultCache.invalidate` bumps the version of a table, which turns all
+entries reading from it stale, either in all databases or in the database
+of a ``bind``. :meth:`ResultCache.install_hooks` does so automatically for
+inserts, updates and deletes executed with an engine.
+
+Backends store pickled entries. :class:`MemoryBackend` keeps them in an LRU
+bounded mapping of the process, :class:`SQLiteBackend` in an SQLite file
+shared by all processes on the host.
+"""
+import hashlib
+import json
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+
+import sqlalchemy
+from sqlalchemy.sql.util import find_tables
+
+from qsqla.cache import LRUCache
+from qsqla.instrumentation import selectable_fingerprint
+from qsqla.query import query
+
+
+class MemoryBackend(object):
+    """Store entries in the memory of the process.
+
+    :param maxsize: int. The maximum number of entries.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.entries = LRUCache(maxsize)
+        self.versions = {}
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires is not None and expires < time.time():
+            self.entries.pop(key)
+            return None
+        return pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl is not None else None
+        self.entries.put(key, (expires, pickle.dumps(value)))
+
+    def get_versions(self, tables):
+        return dict((table, self.versions.get(table)) for table in tables)
+
+    def bump_versions(self, tables):
+        for table in tables:
+            self.versions[table] = uuid.uuid4().hex
+
+    def clear(self):
+        self.entries.clear()
+
+
+class SQLiteBackend(object):
+    """Store entries in an SQLite file shared by processes of the host.
+
+    :param path: the path of the database file.
+    :param maxsize: int. The maximum number of entries.
+    """
+
+    def __init__(self, path, maxsize=10000):
+        self.path = path
+        self.maxsize = maxsize
+        self.local = threading.local()
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS entries ("
+                         "key TEXT PRIMARY KEY, value BLOB, expires REAL, "
+                         "accessed REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_entries_accessed "
+                         "ON entries (accessed)")
+            conn.execute("CREATE TABLE IF NOT EXISTS versions ("
+                         "name TEXT PRIMARY KEY, version TEXT)")
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT value, expires FROM entries WHERE key = ?",
+                (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires = row
+            if expires is not None and expires < time.time():
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE entries SET accessed = ? WHERE key = ?",
+                         (time.time(), key))
+        return pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        expires = now + ttl if ttl is not None else None
+        with self.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                         (key, pickle.dumps(value), expires, now))
+            conn.execute("DELETE FROM entries WHERE key IN ("
+                         "SELECT key FROM entries ORDER BY accessed DESC "
+                         "LIMIT -1 OFFSET ?)", (self.maxsize,))
+
+    def get_versions(self, tables):
+        versions = dict((table, None) for table in tables)
+        with self.connection() as conn:
+            for table in tables:
+                row = conn.execute(
+                    "SELECT version FROM versions WHERE name = ?",
+                    (table,)).fetchone()
+                if row is not None:
+                    versions[table] = row[0]
+        return versions
+
+    def bump_versions(self, tables):
+        with self.connection() as conn:
+            conn.executemany("INSERT OR REPLACE INTO versions VALUES (?, ?)",
+                             [(table, uuid.uuid4().hex) for table in tables])
+
+    def clear(self):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM entries")
+
+
+def bind_identity(bind):
+    """Return the identity of the database of an Engine or Connection.
+
+    The identity consists of the dialect and the URL without the password.
+    In-memory SQLite databases exist once per engine and add its id.
+    """
+    engine = bind.engine
+    url = engine.url
+    identity = "{} {}".format(engine.dialect.name,
+                              url.render_as_string(hide_password=True))
+    if url.database in (None, "", ":memory:"):
+        identity = "{} {}".format(identity, id(engine))
+    return identity
+
+
+def scoped_name(table, identity):
+    """Return the name of the version of a table in a database."""
+    return "{} {}".format(table, identity)
+
+
+def fingerprint(selectable_or_model, filters, bind=None, **kwargs):
+    """Return the normalized fingerprint of a query.
+
+    :param bind: the identity of the database, see :func:`bind_identity`.
+    """
+    normalized = sorted((f["name"].lower(), f["op"], str(f.get("val")))
+                        for f in filters)
+    data = json.dumps([bind, selectable_fingerprint(selectable_or_model),
+                       normalized, sorted(kwargs.items())],
+                      default=str, sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def table_names(statement):
+    statement = getattr(statement, "statement", statement)
+    return sorted(set(table.fullname for table in
+                      find_tables(statement, include_aliases=True,
+                                  include_crud=True)
+                      if isinstance(table, sqlalchemy.Table)))
+
+
+class ResultCache(object):
+    """Cache the rows of executed queries.
+
+    :param backend: the backend storing the entries, a
+        :class:`MemoryBackend` by default.
+    :param ttl: The time to live of the entries in seconds or None.
+    """
+
+    def __init__(self, backend=None, ttl=60):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+
+    def execute(self, conn, selectable_or_model, filters, ttl=None, **kwargs):
+        """Execute a query or return its cached rows.
+
+        :param conn: an Engine or Connection.
+        :param selectable_or_model: an SQLAlchemy Core Selectable, ORM Model
+            or a :class:`qsqla.query.QuerySchema` of either
+        :param filters: a list of filters produced by build_filters
+        :param ttl: The time to live of a new entry, defaults to the ttl of
+            the cache.
+        :param kwargs: further arguments of :func:`qsqla.query.query`
+
+        :return: a list of dicts, one per row. ORM queries return the
+            columns of the entities.
+        """
+        identity = bind_identity(conn)
+        key = fingerprint(selectable_or_model, filters, bind=identity,
+                          **kwargs)
+        entry = self.backend.get(key)
+        if entry is not None:
+            versions, rows = entry
+            if self.backend.get_versions(list(versions)) == versions:
+                return rows
+
+        stm = query(selectable_or_model, filters, **kwargs)
+        stm = getattr(stm, "statement", stm)
+        tables = table_names(stm)
+        versions = self.backend.get_versions(
+            tables + [scoped_name(table, identity) for table in tables])
+        rows = [dict(row._mapping) for row in conn.execute(stm)]
+        self.backend.set(key, (versions, rows),
+                         self.ttl if ttl is None else ttl)
+        return rows
+
+    def invalidate(self, *tables, bind=None):
+        """Turn the entries reading from the tables stale.
+
+        :param tables: Table objects or full names of tables.
+        :param bind: an Engine or Connection to only turn the entries of its
+            database stale, all databases by default.
+        """
+        names = [getattr(table, "fullname", table) for table in tables]
+        if bind is not None:
+            identity = bind_identity(bind)
+            names = [scoped_name(name, identity) for name in names]
+        self.backend.bump_versions(names)
+
+    def install_hooks(self, engine):
+        """Invalidate tables on inserts, updates and deletes of the engine."""
+        @sqlalchemy.event.listens_for(engine, "after_execute")
+        def after_execute(conn, clauseelement, *args):
+            if getattr(clauseelement, "is_dml", False):
+                self.invalidate(clauseelement.table, bind=conn)
+        return after_execute
+
+    def clear(self):
+        self.backend.clear()
@@ -11,7 +11,7 @@ with open(path.join(here, 'README.md'), encoding='utf-8') as f:
 
 
 install_requires = [
-    'sqlalchemy',
+    'sqlalchemy>=1.4',
     'python-dateutil'
 ]
 
@@ -29,7 +29,9 @@ setup(
       'Development Status :: 3 - Alpha',
       'Intended Audience :: Developers',
       'Programming Language :: Python :: 3',
+      'Programming Language :: Python :: 3 :: Only',
     ],
+    python_requires='>=3.8',
     keywords='',
     use_scm_version=True,
     packages=find_packages(exclude=['docs', 'tests*']),
@@ -37,5 +39,6 @@ setup(
     setup_requires=['setuptools_scm'] + sphinx,
     author='Peter Hoffmann',
     install_requires=install_requires,
+    extras_require={'arrow': ['pyarrow']},
     author_email='peter.hoffmann@blue-yonder.com'
 )
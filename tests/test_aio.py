@@ -0,0 +1,66 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from qsqla.aio import execute, stream
+
+from tests.test_qsqla import Base, Location, User
+
+
+class TestAsyncio(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.engine = create_async_engine("sqlite+aiosqlite:///{}".format(
+            os.path.join(self.tmpdir, "test.sqlite")))
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with AsyncSession(self.engine) as session:
+            location = Location(l_name='Karlsruhe')
+            session.add_all([User(u_name=name, location=location)
+                             for name in ('Micha', 'Oli', 'Tom')])
+            await session.commit()
+        self.user = User.__table__
+
+    async def asyncTearDown(self):
+        await self.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    async def test_core_stream(self):
+        batches = [[row.u_name for row in rows] async for rows in stream(
+            self.engine, self.user.select(), [], batch_size=2, order="u_id")]
+        self.assertEqual(batches, [['Micha', 'Oli'], ['Tom']])
+
+    async def test_orm_stream(self):
+        async with AsyncSession(self.engine) as session:
+            batches = [[user.u_name for user in users] async for users in stream(
+                session, User, [{"name": "u_id", "op": "gt", "val": "1"}],
+                batch_size=1, order="u_id")]
+        self.assertEqual(batches, [['Oli'], ['Tom']])
+
+    async def test_orm_with_relation(self):
+        rows = await execute(self.engine, User, [
+            {"name": "location", "op": "with", "val": "l_name__eq=Karlsruhe"}],
+            order="u_id", limit=2)
+        self.assertEqual([user.u_name for user in rows], ['Micha', 'Oli'])
+
+    async def test_orm_aggregate(self):
+        rows = await execute(self.engine, User, [], group_by="u_l_id",
+                             agg="count")
+        self.assertEqual([tuple(row) for row in rows], [(1, 3)])
+
+    async def test_semaphore(self):
+        semaphore = asyncio.Semaphore(1)
+        running = []
+
+        async def run():
+            async for rows in stream(self.engine, self.user.select(), [],
+                                     semaphore=semaphore):
+                running.append(semaphore.locked())
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(run(), run(), run())
+        self.assertEqual(running, [True, True, True])
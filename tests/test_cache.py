@@ -0,0 +1,127 @@
+from qsqla.cache import StatementCache
+from qsqla.query import QuerySchema
+
+from tests.test_qsqla import DBTestCase, User
+
+
+class TestStatementCache(DBTestCase):
+    def setUp(self):
+        super(TestStatementCache, self).setUp()
+        self.cache = StatementCache(maxsize=2)
+
+    def execute_core(self, filters, **kwargs):
+        stm, params = self.cache.query(self.joined_select, filters, **kwargs)
+        return [row.u_name for row in self.db.execute(stm, params)]
+
+    def execute_orm(self, filters, **kwargs):
+        q, params = self.cache.query(User, filters, **kwargs)
+        return [row.u_name for row in q.params(params).with_session(self.session)]
+
+    def test_hit_binds_new_values(self):
+        self.assertEqual(
+            self.execute_core([{"name": "u_name", "op": "eq", "val": "Oli"}]),
+            ['Oli'])
+        self.assertEqual(
+            self.execute_core([{"name": "u_name", "op": "eq", "val": "Tom"}]),
+            ['Tom'])
+        info = self.cache.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 1, 1))
+
+    def test_filter_order_is_normalized(self):
+        f1 = {"name": "u_id", "op": "gt", "val": "1"}
+        f2 = {"name": "l_id", "op": "eq", "val": "1"}
+        self.assertEqual(self.execute_core([f1, f2]), ['Oli'])
+        self.assertEqual(self.execute_core([f2, f1]), ['Oli'])
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_names_are_case_insensitive(self):
+        self.assertEqual(
+            self.execute_core([{"name": "u_name", "op": "ne", "val": "Oli"}],
+                              order="u_id"),
+            ['Micha', 'Tom'])
+        self.assertEqual(
+            self.execute_core([{"name": "U_NAME", "op": "ne", "val": "Tom"}],
+                              order="U_ID"),
+            ['Micha', 'Oli'])
+        info = self.cache.cache_info()
+        self.assertEqual((info.hits, info.currsize), (1, 1))
+
+    def test_in_lists_of_different_length(self):
+        self.assertEqual(
+            self.execute_core([{"name": "u_id", "op": "in", "val": "1,3"}],
+                              order="u_id"),
+            ['Micha', 'Tom'])
+        self.assertEqual(
+            self.execute_core([{"name": "u_id", "op": "in", "val": "1,2,3"}],
+                              order="u_id"),
+            ['Micha', 'Oli', 'Tom'])
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_large_in_lists_are_not_cached(self):
+        values = ",".join(str(i) for i in range(1, 3001))
+        for op, names in (("in", ['Micha', 'Oli', 'Tom']), ("not_in", [])):
+            filters = [{"name": "u_id", "op": op, "val": values},
+                       {"name": "u_name", "op": "ne", "val": "x"}]
+            stm, params = self.cache.query(self.joined_select, filters,
+                                           order="u_id", limit=5)
+            self.assertIn("(VALUES (1), (2)", str(stm.compile(self.db)))
+            self.assertEqual(sorted(params), ["_limit", "p1"])
+            self.assertEqual([row.u_name for row in
+                              self.db.execute(stm, params)], names)
+        self.assertEqual(len(self.cache), 0)
+        stm, params = self.cache.query(
+            self.joined_select, [{"name": "u_id", "op": "in", "val": "1,2,3"}],
+            large_in_threshold=2)
+        self.assertIn("VALUES", str(stm.compile(self.db)))
+        self.assertEqual(params, {"_limit": 10000})
+        stm, params = self.cache.query(
+            QuerySchema(self.joined_select, large_in_threshold=2),
+            [{"name": "u_id", "op": "not_in", "val": "1,2,3"}])
+        self.assertIn("VALUES", str(stm.compile(self.db)))
+
+    def test_limit_and_offset_are_bound(self):
+        self.assertEqual(
+            self.execute_core([], order="u_id", limit=1, offset=1), ['Oli'])
+        self.assertEqual(
+            self.execute_core([], order="u_id", limit=2, offset=1),
+            ['Oli', 'Tom'])
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_eviction(self):
+        self.execute_core([{"name": "u_id", "op": "eq", "val": "1"}])
+        self.execute_core([{"name": "u_id", "op": "ne", "val": "1"}])
+        self.execute_core([{"name": "u_id", "op": "gt", "val": "1"}])
+        info = self.cache.cache_info()
+        self.assertEqual((info.evictions, info.currsize), (1, 2))
+
+    def test_orm_with_relation(self):
+        self.assertEqual(
+            self.execute_orm([{"name": "pets", "op": "with",
+                               "val": "p_name__eq=Hooch"}], order="u_id"),
+            ['Micha', 'Oli'])
+        self.assertEqual(
+            self.execute_orm([{"name": "pets", "op": "with",
+                               "val": "p_name__eq=Sissy"}], order="u_id"),
+            ['Tom'])
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_orm_with_filters_match_the_same_row(self):
+        self.assertEqual(
+            self.execute_orm([{"name": "pets", "op": "with",
+                               "val": "p_name__eq=Beethoven"},
+                              {"name": "pets", "op": "with",
+                               "val": "p_id__gt=1"}]),
+            [])
+
+    def test_orm_ieq(self):
+        self.assertEqual(
+            self.execute_orm([{"name": "u_name", "op": "ieq", "val": "oli"}]),
+            ['Oli'])
+
+    def test_schema(self):
+        schema = QuerySchema(self.joined_select)
+        stm, params = self.cache.query(
+            schema, [{"name": "U_NAME", "op": "in", "val": "Oli,Tom"}],
+            order="u_id")
+        self.assertEqual([row.u_name for row in self.db.execute(stm, params)],
+                         ['Oli', 'Tom'])
@@ -0,0 +1,102 @@
+import unittest
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine
+
+import qsqla.query as qsqla
+from qsqla.cache import StatementCache
+from qsqla.cost import CostGuard, Estimate, QueryCostError
+
+
+metadata = MetaData()
+
+delivery = Table('delivery', metadata,
+                 Column('id', Integer, primary_key=True),
+                 Column('delivery_id', Integer, index=True),
+                 Column('category', String(32)))
+
+
+class TestCostGuard(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite:///:memory:")
+        self.db = self.engine.connect()
+        metadata.create_all(self.db)
+        self.db.execute(delivery.insert(), [
+            {"id": i, "delivery_id": i // 10, "category": "c{}".format(i % 3)}
+            for i in range(1, 201)])
+        self.guard = CostGuard(max_rows=100)
+
+    def tearDown(self):
+        metadata.drop_all(self.db)
+        self.db.close()
+
+    def query(self, *filters):
+        return qsqla.query(delivery.select(), list(filters))
+
+    def test_full_scan_is_rejected(self):
+        with self.assertRaises(QueryCostError) as ctx:
+            self.guard.check(self.db, self.query(
+                {"name": "category", "op": "eq", "val": "c1"}))
+        self.assertEqual(ctx.exception.estimate.rows, 200)
+
+    def test_index_search_is_accepted(self):
+        rows = self.guard.execute(self.db, self.query(
+            {"name": "delivery_id", "op": "in", "val": "1,2"}))
+        self.assertEqual(len(rows.fetchall()), 20)
+
+    def test_range_search(self):
+        estimate = self.guard.check(self.db, self.query(
+            {"name": "delivery_id", "op": "gt", "val": "3"}))
+        self.assertEqual(estimate.rows, 50)
+
+    def test_aliased_table(self):
+        for alias in (delivery.alias("d"), delivery.alias()):
+            with self.assertRaises(QueryCostError) as ctx:
+                self.guard.check(self.db, qsqla.query(
+                    alias.select(),
+                    [{"name": "category", "op": "eq", "val": "c1"}]))
+            self.assertEqual(ctx.exception.estimate.rows, 200)
+
+    def test_grouped_subquery(self):
+        grouped = delivery.select().with_only_columns(
+            [delivery.c.category]).group_by(delivery.c.category)
+        with self.assertRaises(QueryCostError) as ctx:
+            self.guard.check(self.db, qsqla.query(grouped, [],
+                                                  order="category"))
+        self.assertEqual(ctx.exception.estimate.rows, 200)
+
+    def test_unknown_table_is_rejected(self):
+        temporary = Table('temporary_delivery', MetaData(),
+                          Column('id', Integer, primary_key=True),
+                          prefixes=['TEMPORARY'])
+        temporary.create(self.db)
+        with self.assertRaises(QueryCostError) as ctx:
+            self.guard.check(self.db, qsqla.query(temporary.select(), []))
+        self.assertEqual(ctx.exception.estimate, Estimate(None, None))
+
+    def test_estimates_are_cached_per_shape(self):
+        for val in ("1", "2", "3"):
+            self.guard.check(self.db, self.query(
+                {"name": "delivery_id", "op": "eq", "val": val}))
+        info = self.guard.estimates.cache_info()
+        self.assertEqual((info.hits, info.misses), (2, 1))
+
+    def test_custom_estimator(self):
+        guard = CostGuard(max_cost=10,
+                          estimator=lambda conn, compiled, params: Estimate(1, 11))
+        with self.assertRaises(QueryCostError):
+            guard.check(self.db, self.query())
+
+    def test_statement_cache_parameters(self):
+        statements = StatementCache(maxsize=8)
+        for val in ("1,2", "3"):
+            statement, params = statements.query(
+                delivery.select(),
+                [{"name": "delivery_id", "op": "in", "val": val}])
+            rows = self.guard.execute(self.db, statement, params)
+            self.assertEqual(len(rows.fetchall()), 10 * len(val.split(",")))
+        info = self.guard.estimates.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 1))
+        statement, params = statements.query(
+            delivery.select(), [{"name": "category", "op": "eq", "val": "c1"}])
+        with self.assertRaises(QueryCostError):
+            self.guard.check(self.db, statement, params)
@@ -0,0 +1,191 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.pool import StaticPool
+
+import qsqla.query as qsqla
+from qsqla.execution import execute_many, execute_partitioned, stream
+
+from tests.test_qsqla import Base, DBTestCase, User
+
+
+class TestStream(DBTestCase):
+    def test_core_batches(self):
+        batches = list(stream(self.db, self.user.select(), [], batch_size=2,
+                              order="u_id"))
+        self.assertEqual([[row.u_name for row in rows] for rows in batches],
+                         [['Micha', 'Oli'], ['Tom']])
+
+    def test_core_filters(self):
+        batches = list(stream(self.db, self.joined_select,
+                              [{"name": "l_id", "op": "eq", "val": "1"}],
+                              order="u_id"))
+        self.assertEqual([[row.u_name for row in rows] for rows in batches],
+                         [['Micha', 'Oli']])
+
+    def test_core_upper_bound_limit(self):
+        batches = list(stream(self.db, self.user.select(), [], batch_size=2,
+                              upper_bound_limit=1))
+        self.assertEqual([len(rows) for rows in batches], [1])
+
+    def test_orm_batches(self):
+        batches = list(stream(self.session, User, [], batch_size=2,
+                              order="u_id"))
+        self.assertEqual([[row.u_name for row in rows] for rows in batches],
+                         [['Micha', 'Oli'], ['Tom']])
+
+    def test_orm_future(self):
+        batches = list(stream(self.db, User, [], batch_size=2, order="u_id",
+                              future=True))
+        self.assertEqual([[row.u_name for row in rows] for rows in batches],
+                         [['Micha', 'Oli'], ['Tom']])
+
+    def test_orm_future_aggregate(self):
+        batches = list(stream(self.session, User, [], group_by="u_l_id",
+                              agg="count", future=True))
+        self.assertEqual([[tuple(row) for row in rows] for rows in batches],
+                         [[(1, 2), (2, 1)]])
+
+    def test_orm_with_connection(self):
+        batches = list(stream(self.db, User,
+                              [{"name": "u_name", "op": "ne", "val": "Oli"}],
+                              batch_size=5, order="u_id"))
+        self.assertEqual([[row.u_name for row in rows] for rows in batches],
+                         [['Micha', 'Tom']])
+
+
+class TestExecuteMany(DBTestCase):
+    filters_list = [[{"name": "l_id", "op": "eq", "val": "1"}],
+                    [{"name": "u_name", "op": "eq", "val": "Tom"}],
+                    [{"name": "u_name", "op": "eq", "val": "Hannes"}],
+                    []]
+
+    def names(self, results):
+        return [[row.u_name for row in rows] for rows in results]
+
+    def test_union(self):
+        results = execute_many(self.db, self.joined_select, self.filters_list,
+                               order="u_id", asc=False)
+        self.assertEqual(self.names(results),
+                         [['Oli', 'Micha'], ['Tom'], [], ['Tom', 'Oli', 'Micha']])
+        self.assertEqual(results[1][0]._query, 1)
+
+    def test_union_limit(self):
+        results = execute_many(self.db, self.joined_select, self.filters_list,
+                               order="u_id", limit=1)
+        self.assertEqual(self.names(results), [['Micha'], ['Tom'], [], ['Micha']])
+
+    def test_concurrent(self):
+        engine = create_engine("sqlite://", poolclass=StaticPool,
+                               connect_args={"check_same_thread": False})
+        Base.metadata.create_all(engine)
+        engine.execute(self.user.insert(), [{"u_name": "Micha", "u_l_id": 1},
+                                            {"u_name": "Oli", "u_l_id": 1},
+                                            {"u_name": "Tom", "u_l_id": 2}])
+        results = execute_many(engine, self.user.select(),
+                               [[{"name": "u_l_id", "op": "eq", "val": "1"}],
+                                [{"name": "u_l_id", "op": "eq", "val": "2"}]],
+                               strategy="concurrent", order="u_id")
+        self.assertEqual(self.names(results), [['Micha', 'Oli'], ['Tom']])
+
+    def test_orm_model(self):
+        with self.assertRaises(TypeError):
+            execute_many(self.db, User, self.filters_list)
+
+
+class TestExecutePartitioned(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.engine = create_engine(
+            "sqlite:///" + os.path.join(self.tmp.name, "test.sqlite"))
+        Base.metadata.create_all(self.engine)
+        self.user = User.__table__
+        self.start = datetime(2016, 1, 1)
+        with self.engine.begin() as conn:
+            conn.execute(self.user.insert(), [
+                {"u_id": i, "u_name": "user{}".format(i),
+                 "u_l_id": i % 2, "u_date": self.start + timedelta(days=i)}
+                for i in range(1, 21)])
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.tmp.cleanup()
+
+    def ids(self, *args, **kwargs):
+        return [row.u_id for row in execute_partitioned(
+            self.engine, self.user.select(), *args, batch_size=3, **kwargs)]
+
+    def test_ordered_by_partition(self):
+        self.assertEqual(self.ids([], "u_id", order="u_id"),
+                         list(range(1, 21)))
+        self.assertEqual(self.ids([], "u_id", order="u_id", asc=False,
+                                  max_workers=2),
+                         list(range(20, 0, -1)))
+
+    def test_merged_order(self):
+        ids = self.ids([{"name": "u_id", "op": "gt", "val": "4"}], "u_date",
+                       partitions=3, order="u_name")
+        self.assertEqual(ids, sorted(range(5, 21), key="user{}".format))
+
+    def test_unordered(self):
+        self.assertEqual(sorted(self.ids([], "u_date", partitions=7)),
+                         list(range(1, 21)))
+
+    def test_limit_and_offset(self):
+        self.assertEqual(self.ids([], "u_id", order="u_name", limit=3,
+                                  offset=9),
+                         [18, 19, 2])
+        self.assertEqual(len(self.ids([], "u_id", limit=5)), 5)
+
+    def test_boundaries(self):
+        ids = self.ids([{"name": "u_l_id", "op": "eq", "val": "1"}], "u_date",
+                       boundaries=["2016-01-05", "2016-01-10"], order="u_date")
+        self.assertEqual(ids, list(range(1, 21, 2)))
+
+    def test_nulls_are_included(self):
+        with self.engine.begin() as conn:
+            conn.execute(self.user.insert(), [{"u_id": 21, "u_name": "x"}])
+        self.assertEqual(sorted(self.ids([], "u_date")), list(range(1, 22)))
+
+    def test_nulls_are_ordered_like_the_database(self):
+        with self.engine.begin() as conn:
+            conn.execute(self.user.insert(), [{"u_id": 21, "u_name": "x"}])
+        for asc in (True, False):
+            with self.engine.connect() as conn:
+                expected = [row.u_id for row in conn.execute(
+                    qsqla.query(self.user.select(), [], order="u_date",
+                                asc=asc))]
+            self.assertEqual(self.ids([], "u_date", order="u_date", asc=asc),
+                             expected)
+            self.assertEqual(self.ids([], "u_date", order="u_date", asc=asc,
+                                      limit=2),
+                             expected[:2])
+
+    def test_nulls_first(self):
+        self.assertTrue(qsqla.nulls_first(sqlite.dialect()))
+        self.assertFalse(qsqla.nulls_first(sqlite.dialect(), asc=False))
+        self.assertFalse(qsqla.nulls_first(postgresql.dialect()))
+        self.assertTrue(qsqla.nulls_first(postgresql.dialect(), asc=False))
+
+    def test_only_nulls(self):
+        with self.engine.begin() as conn:
+            conn.execute(self.user.update().values(u_date=None))
+        self.assertEqual(sorted(self.ids([], "u_date")), list(range(1, 21)))
+
+    def test_empty(self):
+        self.assertEqual(
+            self.ids([{"name": "u_id", "op": "gt", "val": "100"}], "u_id"), [])
+
+    def test_invalid_partition(self):
+        self.assertRaises(TypeError, self.ids, [], "u_name")
+        self.assertRaises(TypeError, execute_partitioned, self.engine, User,
+                          [], "u_id")
+        self.assertRaises(TypeError, execute_partitioned, self.engine,
+                          self.user.select(), [], "u_name")
+        self.assertRaises(ValueError, execute_partitioned, self.engine,
+                          self.user.select(), [], "u_date",
+                          boundaries=["no date"])
@@ -0,0 +1,84 @@
+import csv
+import io
+import unittest
+
+from qsqla import export
+
+from tests.test_qsqla import DBTestCase, User
+
+
+class TestWriteCsv(DBTestCase):
+    def read(self, *args, **kwargs):
+        f = io.StringIO(newline='')
+        count = export.write_csv(f, self.db, *args, **kwargs)
+        rows = list(csv.reader(io.StringIO(f.getvalue(), newline='')))
+        self.assertEqual(count, len(rows) - kwargs.get("header", True))
+        return rows
+
+    def test_core(self):
+        rows = self.read(self.joined_select,
+                         [{"name": "l_name", "op": "eq", "val": "Karlsruhe"}],
+                         order="u_id", fields="u_id,u_name,u_birthday",
+                         batch_size=1)
+        self.assertEqual(rows, [["u_id", "u_name", "u_birthday"],
+                                ["1", "Micha", "1980-01-01"],
+                                ["2", "Oli", "1990-06-15"]])
+
+    def test_datetimes_are_isoformat(self):
+        rows = self.read(self.user.select(), [], order="u_id",
+                         fields=["u_date"], header=False)
+        self.assertEqual(rows[0], [self.now.isoformat()])
+
+    def test_orm(self):
+        rows = self.read(User, [{"name": "u_id", "op": "gt", "val": "2"}],
+                         fields=["u_name"])
+        self.assertEqual(rows, [["u_id", "u_name"], ["3", "Tom"]])
+
+    def test_empty(self):
+        rows = self.read(self.user.select(),
+                         [{"name": "u_id", "op": "gt", "val": "3"}],
+                         fields="u_name")
+        self.assertEqual(rows, [["u_name"]])
+
+
+@unittest.skipIf(export.pyarrow is None, "pyarrow is not installed")
+class TestArrow(DBTestCase):
+    def test_record_batches(self):
+        batches = list(export.record_batches(self.db, self.joined_select, [],
+                                             order="u_id", batch_size=2))
+        self.assertEqual([batch.num_rows for batch in batches], [2, 1])
+        schema = batches[0].schema
+        self.assertEqual(str(schema.field("u_id").type), "int64")
+        self.assertEqual(str(schema.field("u_name").type), "string")
+        self.assertEqual(str(schema.field("u_birthday").type), "date32[day]")
+        self.assertEqual(str(schema.field("u_date").type), "timestamp[us]")
+        self.assertEqual(batches[1].column(
+            schema.get_field_index("u_name")).to_pylist(), ["Tom"])
+
+    def test_write_arrow(self):
+        sink = io.BytesIO()
+        count = export.write_arrow(sink, self.db, User, [], order="u_id")
+        self.assertEqual(count, 3)
+        table = export.pyarrow.ipc.open_stream(sink.getvalue()).read_all()
+        self.assertEqual(table.column("u_name").to_pylist(),
+                         ["Micha", "Oli", "Tom"])
+
+    def test_write_parquet(self):
+        sink = io.BytesIO()
+        count = export.write_parquet(
+            sink, self.db, self.user.select(),
+            [{"name": "u_id", "op": "lte", "val": "2"}], fields="u_id,u_name")
+        self.assertEqual(count, 2)
+        sink.seek(0)
+        table = export.pyarrow.parquet.read_table(sink)
+        self.assertEqual(table.column_names, ["u_id", "u_name"])
+        self.assertEqual(table.num_rows, 2)
+
+    def test_arrow_types(self):
+        import sqlalchemy
+        self.assertEqual(str(export.arrow_type(sqlalchemy.Numeric(10, 2))),
+                         "decimal128(10, 2)")
+        self.assertEqual(
+            str(export.arrow_type(sqlalchemy.DateTime(timezone=True))),
+            "timestamp[us, tz=UTC]")
+        self.assertRaises(TypeError, export.arrow_type, sqlalchemy.JSON())
@@ -0,0 +1,71 @@
+import logging
+
+from qsqla import instrumentation
+from qsqla.query import build_filters, query
+
+from tests.test_qsqla import DBTestCase, User
+
+
+class TestInstrumentation(DBTestCase):
+    def setUp(self):
+        super(TestInstrumentation, self).setUp()
+        instrumentation.install(self.engine)
+        self.events = []
+
+    def tearDown(self):
+        instrumentation.uninstall(self.engine)
+        super(TestInstrumentation, self).tearDown()
+
+    def run_query(self, args):
+        filters = build_filters(args)
+        return self.db.execute(query(self.joined_select, filters)).fetchall()
+
+    def test_phases(self):
+        with instrumentation.listening(self.events.append):
+            self.run_query({"u_name": "Oli"})
+        self.assertEqual([e.phase for e in self.events],
+                         ["build_filters", "construction", "compilation",
+                          "execution"])
+        self.assertTrue(all(e.duration >= 0 for e in self.events))
+        self.assertEqual(self.events[1].detail, "query")
+        self.assertIn("SELECT", self.events[3].detail)
+        self.assertEqual(self.events[2].fingerprint, self.events[3].fingerprint)
+
+    def test_fingerprint_ignores_values(self):
+        with instrumentation.listening(self.events.append):
+            self.run_query({"u_name": "Oli", "u_id__gt": "1"})
+            self.run_query({"u_id__gt": "2", "u_name": "Tom"})
+            self.run_query({"u_name__ne": "Tom"})
+        fingerprints = [e.fingerprint for e in self.events
+                        if e.phase == "construction"]
+        self.assertEqual(fingerprints[0], fingerprints[1])
+        self.assertNotEqual(fingerprints[0], fingerprints[2])
+
+    def test_orm(self):
+        with instrumentation.listening(self.events.append):
+            q = query(User, [{"name": "u_id", "op": "eq", "val": "1"}])
+            q.with_session(self.session).all()
+        self.assertEqual([e.phase for e in self.events],
+                         ["construction", "compilation", "execution"])
+
+    def test_no_listener(self):
+        self.run_query({"u_name": "Oli"})
+        self.assertEqual(instrumentation.listeners, [])
+        self.assertFalse(self.db.info.get("qsqla_started"))
+
+    def test_failing_listener_is_ignored(self):
+        def fail(e):
+            raise RuntimeError()
+        with instrumentation.listening(fail):
+            self.assertEqual(len(self.run_query({"u_name": "Oli"})), 1)
+
+
+class TestSlowQueryLog(DBTestCase):
+    def test_thresholds(self):
+        slow_log = instrumentation.SlowQueryLog(
+            threshold=0, thresholds={"build_filters": 60})
+        with self.assertLogs("qsqla.instrumentation", logging.WARNING) as cm:
+            with instrumentation.listening(slow_log):
+                query(self.joined_select, build_filters({"u_name": "Oli"}))
+        self.assertEqual(len(cm.output), 1)
+        self.assertIn("slow construction", cm.output[0])
@@ -0,0 +1,100 @@
+from qsqla.optimizer import optimize_filters
+from qsqla.query import QuerySchema, query
+
+from tests.test_qsqla import DBTestCase, User
+
+
+def f(name, op, val=None):
+    return {"name": name, "op": op, "val": val}
+
+
+class TestOptimizeFilters(DBTestCase):
+    def optimize(self, filters):
+        core = optimize_filters(self.joined_select, filters)
+        self.assertEqual(optimize_filters(User, filters), core)
+        self.assertEqual(
+            optimize_filters(QuerySchema(self.joined_select), filters), core)
+        return core
+
+    def execute(self, filters):
+        return sorted(row.u_name for row in
+                      self.db.execute(query(self.joined_select, filters)))
+
+    def assertEquivalent(self, filters):
+        optimized = self.optimize(filters)
+        self.assertEqual(self.execute(optimized), self.execute(filters))
+        return optimized
+
+    def assertEmpty(self, filters):
+        self.assertIsNone(self.optimize(filters))
+        self.assertEqual(self.execute(filters), [])
+
+    def test_duplicates_are_removed(self):
+        self.assertEqual(
+            self.assertEquivalent([f("u_name", "like", "O%"),
+                                   f("U_NAME", "like", "O%")]),
+            [f("u_name", "like", "O%")])
+
+    def test_ranges_are_merged(self):
+        self.assertEqual(
+            self.assertEquivalent([f("u_id", "gt", "1"), f("u_id", "gte", "2"),
+                                   f("u_id", "lt", "10"),
+                                   f("u_id", "lte", "9")]),
+            [f("u_id", "gte", "2"), f("u_id", "lte", "9")])
+
+    def test_values_are_compared_by_type(self):
+        self.assertEqual(
+            self.assertEquivalent([f("u_id", "gt", "9"),
+                                   f("u_id", "gt", "10")]),
+            [f("u_id", "gt", "10")])
+
+    def test_in_lists_are_intersected(self):
+        self.assertEqual(
+            self.assertEquivalent([f("u_id", "in", "1,2,3"),
+                                   f("u_id", "in", "2,3,4"),
+                                   f("u_id", "not_in", "3")]),
+            [f("u_id", "eq", "2")])
+        self.assertEqual(
+            self.assertEquivalent([f("u_id", "in", "1,2,3"),
+                                   f("u_id", "lte", "2")]),
+            [f("u_id", "in", ["1", "2"])])
+
+    def test_exclusions_outside_of_range_are_removed(self):
+        self.assertEqual(
+            self.assertEquivalent([f("u_id", "gt", "1"), f("u_id", "ne", "1"),
+                                   f("u_id", "not_in", "2,3")]),
+            [f("u_id", "gt", "1"), f("u_id", "not_in", ["2", "3"])])
+
+    def test_canonical_order(self):
+        filters = [f("u_name", "eq", "Oli"), f("l_id", "eq", "1"),
+                   f("u_id", "gte", "1")]
+        self.assertEqual(self.assertEquivalent(filters),
+                         self.optimize(list(reversed(filters))))
+
+    def test_contradictions_are_empty(self):
+        self.assertEmpty([f("u_id", "eq", "1"), f("u_id", "eq", "2")])
+        self.assertEmpty([f("u_id", "eq", "1"), f("u_id", "in", "2,3")])
+        self.assertEmpty([f("u_id", "in", "1,2"), f("u_id", "in", "3")])
+        self.assertEmpty([f("u_id", "gt", "2"), f("u_id", "lt", "2")])
+        self.assertEmpty([f("u_id", "gte", "2"), f("u_id", "lt", "2")])
+        self.assertEmpty([f("u_id", "eq", "2"), f("u_id", "ne", "2")])
+        self.assertEmpty([f("u_name", "is_null"), f("u_name", "like", "%")])
+
+    def test_datetime_ranges(self):
+        self.assertEmpty([f("u_date", "gt", "2016-01-02"),
+                          f("u_date", "lt", "2016-01-01T12:00:00")])
+
+    def test_unknown_fields_and_relationships_are_kept(self):
+        filters = [f("u_name", "eq", "Oli"), f("pets", "with", "p_id__eq__2")]
+        self.assertEqual(optimize_filters(User, filters),
+                         list(reversed(filters)))
+        self.assertEqual(optimize_filters(User, [f("unknown", "eq", "1")]),
+                         [f("unknown", "eq", "1")])
+
+    def test_invalid_operators_are_kept(self):
+        for filters in ([f("u_name", "gt", "b"), f("u_name", "lt", "a")],
+                        [f("u_date", "in", "2016-01-01")]):
+            self.assertEqual(self.optimize(filters),
+                             sorted(filters, key=lambda item: item["op"]))
+            with self.assertRaises(TypeError):
+                query(self.joined_select, self.optimize(filters))
@@ -0,0 +1,166 @@
+import sys
+import unittest
+
+from sqlalchemy import (Column, Index, Integer, MetaData, String, Table,
+                        create_engine, func, select)
+from sqlalchemy.dialects import postgresql
+
+import qsqla.query as qsqla
+from qsqla.policy import IndexPolicy, IndexPolicyError, next_prefix
+
+from tests.test_qsqla import User
+
+
+metadata = MetaData()
+
+delivery = Table('delivery', metadata,
+                 Column('id', Integer, primary_key=True),
+                 Column('delivery_id', Integer, index=True),
+                 Column('category', String(32)),
+                 Column('name', String(32)),
+                 Column('error_info', String(256)),
+                 Column('row_count', Integer))
+Index('ix_delivery_category_name', delivery.c.category, delivery.c.name)
+Index('ix_delivery_name_lower', func.lower(delivery.c.name))
+
+
+class TestIndexPolicy(unittest.TestCase):
+    def setUp(self):
+        self.policy = IndexPolicy(delivery.select())
+
+    def assertAllowed(self, name, op, val=None):
+        self.policy.check([{"name": name, "op": op, "val": val}])
+
+    def assertRejected(self, name, op, val=None):
+        with self.assertRaises(IndexPolicyError):
+            self.policy.check([{"name": name, "op": op, "val": val}])
+
+    def test_indexed_columns(self):
+        self.assertAllowed("id", "gt", "1")
+        self.assertAllowed("delivery_id", "in", "1,2")
+        self.assertAllowed("category", "eq", "Locations")
+
+    def test_unindexed_columns(self):
+        self.assertRejected("row_count", "eq", "1")
+        self.assertRejected("error_info", "is_null")
+
+    def test_second_column_of_index(self):
+        self.assertRejected("name", "eq", "x")
+
+    def test_operators(self):
+        self.assertRejected("delivery_id", "ne", "1")
+        self.assertAllowed("category", "like", "Loc%")
+        self.assertRejected("category", "like", "%Loc%")
+        self.assertRejected("category", "ilike", "Loc%")
+
+    def test_lower_index(self):
+        self.assertAllowed("name", "ieq", "x")
+        self.assertAllowed("name", "ilike", "x%")
+        self.assertRejected("name", "ilike", "%x")
+
+    def test_order(self):
+        self.policy.check([], order="delivery_id")
+        with self.assertRaises(IndexPolicyError):
+            self.policy.check([], order="row_count")
+
+    def test_allow_list(self):
+        self.policy = IndexPolicy(delivery.select(),
+                                  allow=["row_count", "error_info__is_null"])
+        self.assertAllowed("row_count", "ne", "1")
+        self.policy.check([], order="row_count")
+        self.assertAllowed("error_info", "is_null")
+        self.assertRejected("error_info", "like", "%x%")
+
+    def test_warn(self):
+        self.policy = IndexPolicy(delivery.select(), mode="warn")
+        with self.assertLogs("qsqla.policy", level="WARNING"):
+            self.assertAllowed("row_count", "eq", "1")
+
+    def test_group_by(self):
+        self.policy = IndexPolicy(
+            select([delivery.c.category,
+                    func.lower(delivery.c.category).label("lowered"),
+                    func.count().label("deliveries")]).group_by(
+                delivery.c.category), rewrite_prefix=True)
+        self.assertAllowed("category", "eq", "Locations")
+        self.assertRejected("deliveries", "gt", "1")
+        with self.assertRaises(IndexPolicyError):
+            self.policy.check([], order="deliveries")
+        self.assertIsNone(self.policy.rewrite(
+            self.policy.lookup("lowered"),
+            {"name": "lowered", "op": "like", "val": "loc%"}))
+
+    def test_orm(self):
+        self.policy = IndexPolicy(User)
+        self.assertAllowed("u_id", "eq", "1")
+        self.assertRejected("u_name", "eq", "Oli")
+        self.assertAllowed("pets", "with", "p_id__eq=1")
+        self.assertRejected("pets", "with", "p_name__eq=Hooch")
+
+    def test_query(self):
+        with self.assertRaises(IndexPolicyError):
+            qsqla.query(delivery.select(),
+                        [{"name": "row_count", "op": "eq", "val": "1"}],
+                        policy=self.policy)
+
+
+class TestPrefixRewrite(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        metadata.create_all(self.engine)
+        self.db = self.engine.connect()
+        self.db.execute(delivery.insert(), [
+            {"id": 1, "category": "abc", "name": "Abc"},
+            {"id": 2, "category": "abcd", "name": "abd"},
+            {"id": 3, "category": "abd", "name": "ABCDE"},
+            {"id": 4, "category": "ab", "name": "xyz"}])
+        self.policy = IndexPolicy(delivery.select(), mode='allow',
+                                  rewrite_prefix=True)
+
+    def tearDown(self):
+        self.db.close()
+
+    def query(self, name, op, val):
+        sel = qsqla.query(delivery.select(),
+                          [{"name": name, "op": op, "val": val}],
+                          order="id", policy=self.policy)
+        return sel, [row.id for row in self.db.execute(sel)]
+
+    def test_like(self):
+        sel, ids = self.query("category", "like", "abc%")
+        self.assertIn("LIKE", str(sel))
+        self.assertNotIn("LIKE", str(sel.compile(dialect=postgresql.dialect())))
+        self.assertIn("query.category >=",
+                      str(sel.compile(dialect=postgresql.dialect())))
+        self.assertEqual(ids, [1, 2])
+
+    def test_like_keeps_case_insensitive_results(self):
+        self.db.execute(delivery.insert(), [
+            {"id": 5, "category": "Locations", "name": "x"}])
+        self.assertEqual(self.query("category", "like", "loc%")[1], [5])
+
+    def test_ilike(self):
+        sel, ids = self.query("name", "ilike", "ABC%")
+        self.assertNotIn("LIKE", str(sel))
+        self.assertIn("lower(query.name) >=", str(sel))
+        self.assertEqual(ids, [1, 3])
+
+    def test_not_rewritten(self):
+        for name, op, val in [("category", "like", "a_c%"),
+                              ("category", "like", "%bc"),
+                              ("category", "like", "abc"),
+                              ("category", "ilike", "abc%"),
+                              ("name", "like", "abc%"),
+                              ("error_info", "like", "abc%")]:
+            sel, _ = self.query(name, op, val)
+            self.assertIn("LIKE", str(sel).upper())
+
+    def test_disabled(self):
+        self.policy.rewrite_prefix = False
+        sel, _ = self.query("category", "like", "abc%")
+        self.assertIn("LIKE", str(sel))
+
+    def test_next_prefix(self):
+        self.assertEqual(next_prefix("abc"), "abd")
+        self.assertEqual(next_prefix("a" + chr(sys.maxunicode)), "b")
+        self.assertIsNone(next_prefix(chr(sys.maxunicode)))
@@ -3,8 +3,8 @@ import os
 
 from datetime import date, datetime, timedelta
 from operator import itemgetter
-from sqlalchemy import (MetaData, Table, Column, DateTime, Integer, String,
-                        ForeignKey, create_engine, types, select)
+from sqlalchemy import (MetaData, Table, Column, Date, DateTime, Integer, String,
+                        ForeignKey, create_engine, event, func, types, select)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 
@@ -39,6 +39,7 @@ class User(Base):
     location = relationship(Location)
     pets = relationship("Pet", secondary=user_pet)
     u_date = Column(CustomDateTime)
+    u_birthday = Column(Date)
 
 
 class Pet(Base):
@@ -48,6 +49,38 @@ class Pet(Base):
     p_date = Column(CustomDateTime)
 
 
+class TestConvertType(unittest.TestCase):
+    def test_iso_datetime(self):
+        self.assertEqual(qsqla.convert_type(DateTime(), "2016-01-01T01:00:00"),
+                         datetime(2016, 1, 1, 1))
+
+    def test_fuzzy_datetime(self):
+        self.assertEqual(qsqla.convert_type(DateTime(), "Jan 1 2016 1:00"),
+                         datetime(2016, 1, 1, 1))
+
+    def test_typedecorated_datetime(self):
+        self.assertEqual(qsqla.convert_type(CustomDateTime(), "2016-01-01"),
+                         datetime(2016, 1, 1))
+
+    def test_date(self):
+        self.assertEqual(qsqla.convert_type(Date(), "2016-01-01"),
+                         date(2016, 1, 1))
+        self.assertEqual(qsqla.convert_type(Date(), "1 Jan 2016"),
+                         date(2016, 1, 1))
+
+    def test_invalid_date(self):
+        with self.assertRaises(ValueError):
+            qsqla.convert_type(Date(), "no date")
+
+    def test_relative_values_are_not_memoized(self):
+        qsqla.convert_type(DateTime(), "2016-01-01T01:00:00")
+        size = qsqla.parse_iso_datetime.cache_info().currsize
+        self.assertEqual(qsqla.convert_type(DateTime(), "10:00").date(),
+                         date.today())
+        self.assertEqual(qsqla.convert_type(Date(), "10:00"), date.today())
+        self.assertEqual(qsqla.parse_iso_datetime.cache_info().currsize, size)
+
+
 class TestSqlaSplitOperator(unittest.TestCase):
     def test_without_operator(self):
         param = "field"
@@ -114,8 +147,10 @@ class DBTestCase(unittest.TestCase):
         self.session.add(p1)
         self.session.add(p2)
         self.session.add(p3)
-        u1 = User(u_name='Micha', location=l1, u_date=self.now)
-        u2 = User(u_name='Oli', location=l1, u_date=self.now)
+        u1 = User(u_name='Micha', location=l1, u_date=self.now,
+                  u_birthday=date(1980, 1, 1))
+        u2 = User(u_name='Oli', location=l1, u_date=self.now,
+                  u_birthday=date(1990, 6, 15))
         u3 = User(u_name='Tom', location=l2, u_date=self.now)
         u1.pets.append(p1)
         u1.pets.append(p2)
@@ -226,16 +261,365 @@ class TestSqlaQueryORM(DBTestCase):
         self.assertEquals([row.u_id for row in rows], [3, 2, 1])
 
 
+class TestSqlaQueryFuture(DBTestCase):
+    def test_orm_select(self):
+        stm = qsqla.query(User, [{"name": "u_id", "op": "gt", "val": "1"}],
+                          order="u_id", future=True)
+        users = self.session.execute(stm).scalars().all()
+        self.assertEqual([user.u_name for user in users], ['Oli', 'Tom'])
+
+    def test_orm_select_schema(self):
+        stm = qsqla.orm_query(qsqla.QuerySchema(User),
+                              [{"name": "pets", "op": "with",
+                                "val": "p_name__eq=Sissy"}], future=True)
+        users = self.session.execute(stm).scalars().all()
+        self.assertEqual([user.u_name for user in users], ['Tom'])
+
+
+class TestRelationshipFilters(DBTestCase):
+    def names(self, filters, **kwargs):
+        q = qsqla.query(User, filters, order="u_id", **kwargs)
+        return [user.u_name for user in q.with_session(self.session)]
+
+    def test_filters_match_the_same_related_row(self):
+        filters = [{"name": "pets", "op": "with", "val": "p_name__eq=Beethoven"},
+                   {"name": "pets", "op": "with", "val": "p_id__gt=1"}]
+        self.assertEqual(str(qsqla.query(User, filters)).count("EXISTS"), 1)
+        self.assertEqual(self.names(filters), [])
+        self.assertEqual(self.names(filters, relationships="join"), [])
+        filters[1]["val"] = "p_id__lt=3"
+        self.assertEqual(self.names(filters), ['Micha'])
+
+    def test_join_selects_distinct_entities(self):
+        filters = [{"name": "pets", "op": "with", "val": "p_id__lte=2"}]
+        q = qsqla.query(User, filters, relationships="join")
+        self.assertIn("JOIN", str(q))
+        self.assertIn("DISTINCT", str(q))
+        self.assertEqual(self.names(filters, relationships="join"),
+                         ['Micha', 'Oli'])
+        stm = qsqla.orm_query(User, filters, future=True, relationships="join")
+        self.assertEqual(
+            sorted(u.u_name for u in self.session.execute(stm).scalars()),
+            ['Micha', 'Oli'])
+
+    def test_many_to_one(self):
+        filters = [{"name": "location", "op": "with", "val": "l_name__eq=Karlsruhe"},
+                   {"name": "location", "op": "with", "val": "l_id__eq=1"}]
+        self.assertEqual(self.names(filters), ['Micha', 'Oli'])
+        self.assertEqual(self.names(filters, relationships="join"),
+                         ['Micha', 'Oli'])
+
+    def test_unknown_strategy(self):
+        self.assertRaises(ValueError, qsqla.query, User, [],
+                          relationships="lateral")
+
+
+class TestExpand(DBTestCase):
+    def setUp(self):
+        super(TestExpand, self).setUp()
+        self.session.expunge_all()
+        self.statements = []
+        event.listen(self.engine, "before_cursor_execute", self.count)
+
+    def tearDown(self):
+        event.remove(self.engine, "before_cursor_execute", self.count)
+        super(TestExpand, self).tearDown()
+
+    def count(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def load(self, q):
+        users = q.with_session(self.session).all()
+        return [(user.u_name, user.location.l_name,
+                 sorted(pet.p_name for pet in user.pets)) for user in users]
+
+    def test_eager_loads(self):
+        q = qsqla.query(User, [], order="u_id", expand="location, pets")
+        self.assertEqual(self.load(q), [
+            ('Micha', 'Karlsruhe', ['Beethoven', 'Hooch']),
+            ('Oli', 'Karlsruhe', ['Hooch']),
+            ('Tom', 'Stuttgart', ['Sissy'])])
+        self.assertEqual(len(self.statements), 2)
+
+    def test_lazy_loads_by_default(self):
+        self.load(qsqla.query(User, [], order="u_id"))
+        self.assertGreater(len(self.statements), 2)
+
+    def test_schema_and_future(self):
+        stm = qsqla.orm_query(qsqla.QuerySchema(User), [], future=True,
+                              expand=["pets"])
+        users = self.session.execute(stm).scalars().all()
+        self.assertEqual(len(self.statements), 2)
+        self.assertEqual(sum(len(user.pets) for user in users), 4)
+        self.assertEqual(len(self.statements), 2)
+
+    def test_invalid_relationships(self):
+        self.assertRaises(TypeError, qsqla.query, User, [], expand="u_name")
+        self.assertRaises(AttributeError, qsqla.query, User, [],
+                          expand="unknown")
+        self.assertRaises(TypeError, qsqla.query, self.joined_select, [],
+                          expand="location")
+
+
+class TestQuerySchema(DBTestCase):
+    def test_case_insensitive_lookup(self):
+        schema = qsqla.QuerySchema(self.user.select())
+        self.assertIs(schema.get_column("U_NAME"), schema.get_column("u_name"))
+
+    def test_unknown_column(self):
+        schema = qsqla.QuerySchema(User)
+        with self.assertRaises(KeyError):
+            qsqla.query(schema, [{"name": "unknown", "op": "eq", "val": "1"}])
+
+    def test_operator_not_allowed(self):
+        schema = qsqla.QuerySchema(self.user.select())
+        self.assertNotIn("gt", schema.operators["u_name"])
+        with self.assertRaises(TypeError):
+            qsqla.query(schema, [{"name": "u_name", "op": "gt", "val": "a"}])
+
+    def test_order(self):
+        schema = qsqla.QuerySchema(self.user.select())
+        rows = self.db.execute(qsqla.query(schema, [], order="U_ID", asc=False))
+        self.assertEqual([row.u_id for row in rows], [3, 2, 1])
+
+    def test_orm_relationship(self):
+        schema = qsqla.QuerySchema(User)
+        self.assertEqual(schema.operators["pets"],
+                         frozenset(["is_null", "is_not_null", "with"]))
+        q = qsqla.query(schema, [{"name": "pets", "op": "with",
+                                  "val": "p_name__eq=Hooch"}], order="u_id")
+        q.session = self.session
+        self.assertEqual([row.u_name for row in q.all()], ['Micha', 'Oli'])
+
+
+class TestPushDown(DBTestCase):
+    def test_filters_inner_select(self):
+        sel = qsqla.query(self.joined_select,
+                          [{"name": "l_name", "op": "eq", "val": "Karlsruhe"}],
+                          order="u_id", asc=False, push_down=True)
+        self.assertNotIn('AS query', str(sel))
+        self.assertIn("location.l_name", str(sel.whereclause))
+        self.assertEqual([row.u_name for row in self.db.execute(sel)],
+                         ['Oli', 'Micha'])
+
+    def test_labeled_columns(self):
+        sel = select([self.user.c.u_id.label("id"), self.user.c.u_name])
+        result = qsqla.query(sel, [{"name": "id", "op": "gt", "val": "1"}],
+                             order="id", push_down=True)
+        self.assertNotIn('AS query', str(result))
+        self.assertEqual([row.u_name for row in self.db.execute(result)],
+                         ['Oli', 'Tom'])
+
+    def test_fallback_for_group_by(self):
+        sel = select([self.user.c.u_l_id, func.count().label("users")]) \
+            .group_by(self.user.c.u_l_id)
+        result = qsqla.query(sel, [{"name": "users", "op": "gt", "val": "1"}],
+                             push_down=True)
+        self.assertIn('AS query', str(result))
+        self.assertEqual([row.u_l_id for row in self.db.execute(result)], [1])
+
+    def test_schema(self):
+        schema = qsqla.QuerySchema(self.user.select(), push_down=True)
+        sel = qsqla.query(schema, [{"name": "u_name", "op": "ne", "val": "Oli"}],
+                          order="u_id", after="")
+        self.assertNotIn('AS query', str(sel))
+        self.assertEqual([row.u_name for row in self.db.execute(sel)],
+                         ['Micha', 'Tom'])
+
+
+class TestFields(DBTestCase):
+    filters = [{"name": "u_id", "op": "lte", "val": "2"}]
+
+    def test_core(self):
+        sel = qsqla.query(self.joined_select, self.filters, order="u_id",
+                          fields="u_name, L_NAME")
+        rows = self.db.execute(sel).fetchall()
+        self.assertEqual(list(rows[0]._mapping), ["u_name", "l_name"])
+        self.assertEqual([tuple(row) for row in rows],
+                         [("Micha", "Karlsruhe"), ("Oli", "Karlsruhe")])
+
+    def test_push_down_keeps_labels(self):
+        sel = select([self.user.c.u_id.label("id"), self.user.c.u_name,
+                      self.user.c.u_date])
+        result = qsqla.query(sel, [{"name": "id", "op": "gt", "val": "1"}],
+                             order="id", push_down=True, fields=["id"])
+        self.assertNotIn('AS query', str(result))
+        self.assertEqual([tuple(row) for row in self.db.execute(result)],
+                         [(2,), (3,)])
+
+    def test_schema(self):
+        schema = qsqla.QuerySchema(self.joined_select)
+        sel = qsqla.query(schema, self.filters, order="u_id", fields=["u_id"])
+        self.assertEqual([tuple(row) for row in self.db.execute(sel)],
+                         [(1,), (2,)])
+
+    def test_orm_loads_only_fields(self):
+        for future in (False, True):
+            q = qsqla.query(User, self.filters, order="u_id",
+                            fields=["u_name"], future=future)
+            sql = str(q)
+            self.assertIn("u_name", sql)
+            self.assertNotIn("u_date", sql)
+            if future:
+                users = self.session.execute(q).scalars().all()
+            else:
+                users = q.with_session(self.session).all()
+            self.assertEqual([user.u_name for user in users], ["Micha", "Oli"])
+
+    def test_unknown_field(self):
+        self.assertRaises(KeyError, qsqla.query, self.joined_select,
+                          self.filters, fields=["unknown"])
+        self.assertRaises(KeyError, qsqla.query, self.user.select(),
+                          self.filters, fields=["unknown"], push_down=True)
+
+
+class TestAggregates(DBTestCase):
+    def test_core(self):
+        sel = qsqla.query(self.joined_select,
+                          [{"name": "u_id", "op": "gte", "val": "1"}],
+                          group_by="l_name", agg="count,sum:u_id,max:u_name",
+                          order="l_name")
+        rows = self.db.execute(sel).fetchall()
+        self.assertEqual(list(rows[0]._mapping),
+                         ["l_name", "count", "sum_u_id", "max_u_name"])
+        self.assertEqual([tuple(row) for row in rows],
+                         [("Karlsruhe", 2, 3, "Oli"), ("Stuttgart", 1, 3, "Tom")])
+
+    def test_order_by_aggregate(self):
+        sel = qsqla.query(self.joined_select, [], group_by=["l_id"],
+                          agg=["count"], order="count", asc=False)
+        self.assertEqual([tuple(row) for row in self.db.execute(sel)],
+                         [(1, 2), (2, 1)])
+
+    def test_without_group_by(self):
+        sel = qsqla.core_query(self.joined_select,
+                               [{"name": "l_name", "op": "eq",
+                                 "val": "Karlsruhe"}], agg="count")
+        self.assertEqual(self.db.execute(sel).scalar(), 2)
+
+    def test_push_down_and_schema(self):
+        for s in (self.joined_select, qsqla.QuerySchema(self.joined_select)):
+            sel = qsqla.query(s, [], group_by="u_l_id", agg="min:u_id",
+                              order="u_l_id", push_down=True)
+            self.assertEqual([tuple(row) for row in self.db.execute(sel)],
+                             [(1, 1), (2, 3)])
+
+    def test_orm(self):
+        filters = [{"name": "u_name", "op": "ne", "val": "Tom"}]
+        q = qsqla.query(User, filters, group_by="u_l_id", agg="count")
+        self.assertEqual([tuple(row) for row in q.with_session(self.session)],
+                         [(1, 2)])
+        q = qsqla.orm_query(User, filters, future=True, agg="count")
+        self.assertEqual(self.session.execute(q).scalar(), 2)
+
+    def test_invalid_aggregates(self):
+        self.assertRaises(ValueError, qsqla.query, self.joined_select, [],
+                          agg="median:u_id")
+        self.assertRaises(ValueError, qsqla.query, self.joined_select, [],
+                          agg="sum")
+        self.assertRaises(TypeError, qsqla.query, self.joined_select, [],
+                          agg="sum:u_name")
+        self.assertRaises(ValueError, qsqla.query, self.joined_select, [],
+                          agg="count", after="")
+
+
+class TestSample(DBTestCase):
+    def setUp(self):
+        super(TestSample, self).setUp()
+        self.db.execute(self.user.insert(),
+                        [{"u_name": "user{}".format(i), "u_l_id": 2}
+                         for i in range(997)])
+
+    def names(self, selectable_or_model, filters=(), **kwargs):
+        sel = qsqla.query(selectable_or_model, list(filters), order="u_id",
+                          upper_bound_limit=None, **kwargs)
+        if qsqla.uses_core(selectable_or_model):
+            return [row.u_name for row in self.db.execute(sel)]
+        return [u.u_name for u in sel.with_session(self.session)]
+
+    def test_core(self):
+        names = self.names(self.user.select(), sample=10)
+        self.assertTrue(70 < len(names) < 130)
+        self.assertEqual(self.names(self.user.select(), sample=10), names)
+        self.assertEqual(len(self.names(self.user.select(), sample=100)), 1000)
+
+    def test_seed(self):
+        names = self.names(self.user.select(), sample=10, seed=1)
+        self.assertEqual(self.names(self.user.select(), sample=10, seed=1),
+                         names)
+        self.assertNotEqual(self.names(self.user.select(), sample=10, seed=2),
+                            names)
+
+    def test_filters_and_push_down(self):
+        filters = [{"name": "u_l_id", "op": "eq", "val": "1"}]
+        self.assertEqual(self.names(self.user.select(), filters, sample=100,
+                                    push_down=True), ["Micha", "Oli"])
+        self.assertNotEqual(self.names(self.user.select(), sample=20),
+                            self.names(self.user.select(), sample=10))
+        names = self.names(self.joined_select,
+                           [{"name": "l_name", "op": "eq",
+                             "val": "Stuttgart"}], sample=50,
+                           primary_key=["u_id"])
+        self.assertTrue(400 < len(names) < 600)
+
+    def test_orm(self):
+        names = self.names(User, sample=10, seed=1)
+        self.assertEqual(names, self.names(self.user.select(), sample=10,
+                                           seed=1))
+        self.assertEqual(self.names(User, [{"name": "u_name", "op": "eq",
+                                            "val": "Tom"}], sample=100),
+                         ["Tom"])
+        q = qsqla.query(User, [], sample=10, seed=1, agg="count",
+                        future=True)
+        self.assertEqual(self.session.execute(q).scalar(), len(names))
+
+    def test_tablesample(self):
+        from sqlalchemy.dialects import postgresql
+        sql = str(qsqla.query(self.user.select(), [], sample=5, seed=3,
+                              sample_method="bernoulli")
+                  .compile(dialect=postgresql.dialect()))
+        self.assertIn("FROM user_table AS user_table_sample TABLESAMPLE "
+                      "bernoulli(%(bernoulli_1)s) REPEATABLE", sql)
+        sql = str(qsqla.query(User, [], sample=5, future=True)
+                  .compile(dialect=postgresql.dialect()))
+        self.assertIn("TABLESAMPLE system(%(system_1)s)", sql)
+
+    def test_invalid_sample(self):
+        for sample in (0, 101, "x"):
+            self.assertRaises(ValueError, qsqla.query, self.user.select(), [],
+                              sample=sample)
+        self.assertRaises(ValueError, qsqla.query, self.user.select(), [],
+                          sample=1, seed="x")
+        self.assertRaises(ValueError, qsqla.query, self.user.select(), [],
+                          sample=1, sample_method="reservoir")
+
+
 class TestOperators(DBTestCase):
-    def perform_assertion(self, filter, expected_names):
+    def perform_assertion(self, filter, expected_names, **kwargs):
         # test core
-        selectable = qsqla.query(self.joined_select, [filter])
+        selectable = qsqla.query(self.joined_select, [filter], **kwargs)
+        rows = self.db.execute(selectable)
+        self.assertEqual([dict(r)['u_name'] for r in rows], expected_names)
+
+        # test core with schema
+        schema = qsqla.QuerySchema(self.joined_select)
+        rows = self.db.execute(qsqla.query(schema, [filter], **kwargs))
+        self.assertEqual([dict(r)['u_name'] for r in rows], expected_names)
+
+        # test core with push down
+        selectable = qsqla.query(self.joined_select, [filter], push_down=True,
+                                 **kwargs)
         rows = self.db.execute(selectable)
         self.assertEqual([dict(r)['u_name'] for r in rows], expected_names)
 
         if filter['name'].startswith('u_'):
             # test ORM
-            q = qsqla.query(User, [filter])
+            q = qsqla.query(User, [filter], **kwargs)
+            q.session = self.session
+            self.assertEqual([row.u_name for row in q.all()], expected_names)
+
+            # test ORM with schema
+            q = qsqla.query(qsqla.QuerySchema(User), [filter], **kwargs)
             q.session = self.session
             self.assertEqual([row.u_name for row in q.all()], expected_names)
 
@@ -339,6 +723,31 @@ class TestOperators(DBTestCase):
         self.perform_assertion({"name": "u_id", "op": "not_in", "val": "1,3"},
                           ['Oli'])
 
+    def test_in_duplicates(self):
+        self.perform_assertion({"name": "u_id", "op": "in", "val": "1,3,1,03"},
+                               ['Micha', 'Tom'])
+
+    def test_large_in(self):
+        self.perform_assertion({"name": "u_id", "op": "in", "val": "1,3"},
+                               ['Micha', 'Tom'], large_in_threshold=1)
+        self.perform_assertion({"name": "u_name", "op": "not_in",
+                                "val": "Micha,Tom"},
+                               ['Oli'], large_in_threshold=1)
+        schema = qsqla.QuerySchema(self.joined_select, large_in_threshold=1)
+        rows = self.db.execute(qsqla.query(schema, [
+            {"name": "u_id", "op": "in", "val": "1,3"}]))
+        self.assertEqual([row.u_name for row in rows], ['Micha', 'Tom'])
+
+    def test_large_in_dialects(self):
+        from sqlalchemy.dialects import mysql, postgresql
+        sel = qsqla.query(self.user.select(), [
+            {"name": "u_id", "op": "not_in", "val": "1,3"}],
+            large_in_threshold=1)
+        self.assertIn("query.u_id NOT IN (VALUES (1), (3))",
+                      str(sel.compile(dialect=postgresql.dialect())))
+        self.assertIn("(query.u_id NOT IN (__[POSTCOMPILE_param_1]))",
+                      str(sel.compile(dialect=mysql.dialect())))
+
     def test_operation_on_typedecorated_type(self):
         val = (datetime.now() - timedelta(hours=5)).isoformat()
         self.perform_assertion({"name": "u_date", "op": "ne", "val": val},
@@ -353,6 +762,21 @@ class TestOperators(DBTestCase):
             {"name": "l_date", "op": "gt", "val": datestring},
             [])
 
+    def test_equals_date(self):
+        self.perform_assertion({"name": "u_birthday", "op": "eq", "val": "1990-06-15"},
+                               ['Oli'])
+
+    def test_greater_than_date(self):
+        self.perform_assertion({"name": "u_birthday", "op": "gt", "val": "1985-01-01"},
+                               ['Oli'])
+        self.perform_assertion({"name": "u_birthday", "op": "lte", "val": "Jan 1 1980"},
+                               ['Micha'])
+
+    def test_fuzzy_datetime(self):
+        datestring = (self.now - timedelta(days=1)).strftime("%d %B %Y %H:%M")
+        self.perform_assertion({"name": "u_date", "op": "gt", "val": datestring},
+                               ['Micha', 'Oli', 'Tom'])
+
     def test_with_eq_many_relation(self):
         q = qsqla.query(User, [{"name": "pets", "op": "with", "val": "p_name__eq=Hooch"}], order="u_id", asc=True)
         q.session = self.session
@@ -482,3 +906,173 @@ class TestOperators(DBTestCase):
         q = qsqla.query(User, [{"name": "location", "op": "with", "val": "l_name__not_in=Stuttgart"}])
         q.session = self.session
         self.assertEqual([row.u_name for row in q.all()], ['Micha', 'Oli'])
+
+
+class TestKeysetPagination(DBTestCase):
+    def paginate(self, selectable_or_model, execute, **kwargs):
+        pages = []
+        after = ""
+        while True:
+            q = qsqla.query(selectable_or_model, [], limit=2, after=after,
+                            **kwargs)
+            rows = execute(q)
+            if not rows:
+                return pages
+            pages.append([row.u_name for row in rows])
+            after = qsqla.after_token(selectable_or_model, rows[-1],
+                                      order=kwargs.get("order"))
+
+    def execute_core(self, q):
+        return list(self.db.execute(q))
+
+    def execute_orm(self, q):
+        return q.with_session(self.session).all()
+
+    def test_core(self):
+        self.assertEqual(self.paginate(self.user.select(), self.execute_core),
+                         [['Micha', 'Oli'], ['Tom']])
+
+    def test_core_order_descending(self):
+        self.assertEqual(
+            self.paginate(self.joined_select, self.execute_core,
+                          order="l_name", asc=False),
+            [['Tom', 'Oli'], ['Micha']])
+
+    def test_orm_order(self):
+        self.assertEqual(
+            self.paginate(User, self.execute_orm, order="u_l_id"),
+            [['Micha', 'Oli'], ['Tom']])
+
+    def test_schema(self):
+        schema = qsqla.QuerySchema(User)
+        self.assertEqual(
+            self.paginate(schema, self.execute_orm, order="u_name", asc=False),
+            [['Tom', 'Oli'], ['Micha']])
+
+    def test_datetime_order(self):
+        self.assertEqual(
+            self.paginate(self.user.select(), self.execute_core, order="u_date"),
+            [['Micha', 'Oli'], ['Tom']])
+
+    def test_invalid_token(self):
+        with self.assertRaises(ValueError):
+            qsqla.query(self.user.select(), [], after="invalid")
+
+    def test_push_down_labels(self):
+        sel = select(self.user.c.u_id.label("id"), self.user.c.u_name,
+                     self.user.c.u_date.label("changed"))
+        for selectable_or_model in (qsqla.QuerySchema(sel, push_down=True),
+                                    sel):
+            self.assertEqual(
+                self.paginate(selectable_or_model, self.execute_core,
+                              order="changed", push_down=True),
+                [['Micha', 'Oli'], ['Tom']])
+
+    def test_fields(self):
+        for selectable_or_model, execute in ((self.user.select(),
+                                              self.execute_core),
+                                             (User, self.execute_orm)):
+            self.assertEqual(
+                self.paginate(selectable_or_model, execute, order="u_name",
+                              asc=False, fields="u_name"),
+                [['Tom', 'Oli'], ['Micha']])
+        rows = self.db.execute(qsqla.query(self.user.select(), [], after="",
+                                           order="u_date", fields="u_name"))
+        self.assertEqual(list(rows.keys()), ["u_name", "u_date", "u_id"])
+
+    def test_null_order_values(self):
+        self.db.execute(self.user.insert(), [
+            {"u_name": name, "u_birthday": None}
+            for name in ("Anna", "Bert", "Carl")])
+        for asc in (True, False):
+            names = [row.u_name for row in self.db.execute(qsqla.query(
+                self.user.select(), [], order="u_birthday", asc=asc,
+                after=""))]
+            self.assertEqual(len(names), 6)
+            pages = [names[i:i + 2] for i in range(0, len(names), 2)]
+            self.assertEqual(
+                self.paginate(self.user.select(), self.execute_core,
+                              order="u_birthday", asc=asc), pages)
+            self.assertEqual(
+                self.paginate(User, self.execute_orm, order="u_birthday",
+                              asc=asc), pages)
+
+    def test_float_boolean_and_numeric_order(self):
+        measurement = Table('measurement', MetaData(),
+                            Column('m_id', Integer, primary_key=True),
+                            Column('u_name', String(16)),
+                            Column('m_float', types.Float),
+                            Column('m_flag', types.Boolean),
+                            Column('m_amount', types.Numeric(10, 2)),
+                            Column('m_data', types.LargeBinary))
+        measurement.create(self.db)
+        try:
+            self.db.execute(measurement.insert(), [
+                {"u_name": name, "m_float": value / 3.0,
+                 "m_flag": value % 2 == 0,
+                 "m_amount": "{}.25".format(value)}
+                for name, value in (("a", 4), ("b", 2), ("c", 5), ("d", 1),
+                                    ("e", 3))])
+            sel = measurement.select()
+            self.assertEqual(self.paginate(sel, self.execute_core,
+                                           order="m_float"),
+                             [['d', 'b'], ['e', 'a'], ['c']])
+            self.assertEqual(self.paginate(sel, self.execute_core,
+                                           order="m_flag"),
+                             [['c', 'd'], ['e', 'a'], ['b']])
+            self.assertEqual(self.paginate(sel, self.execute_core,
+                                           order="m_amount", asc=False),
+                             [['c', 'a'], ['e', 'b'], ['d']])
+            with self.assertRaises(ValueError):
+                qsqla.query(sel, [], order="m_data", after="")
+        finally:
+            measurement.drop(self.db)
+
+
+class TestChangeFeed(DBTestCase):
+    def poll(self, selectable_or_model, since, **kwargs):
+        sel = qsqla.query(selectable_or_model, [], since=since, limit=2,
+                          **kwargs)
+        if qsqla.uses_core(selectable_or_model):
+            rows = list(self.db.execute(sel))
+        else:
+            rows = sel.with_session(self.session).all()
+        token = qsqla.watermark_token(selectable_or_model, rows, since,
+                                      kwargs.get("watermark"))
+        return [row.u_name for row in rows], token
+
+    def test_core(self):
+        names, token = self.poll(self.user.select(), "", watermark="u_date")
+        self.assertEqual(names, ["Micha", "Oli"])
+        names, token = self.poll(self.user.select(), token,
+                                 watermark="u_date")
+        self.assertEqual(names, ["Tom"])
+        self.assertEqual(self.poll(self.user.select(), token,
+                                   watermark="u_date"), ([], token))
+
+        later = self.now + timedelta(minutes=1)
+        self.db.execute(self.user.update().where(self.user.c.u_name == "Oli")
+                        .values(u_date=later))
+        self.db.execute(self.user.insert(), [{"u_name": "Jan",
+                                              "u_date": later},
+                                             {"u_name": "Undated",
+                                              "u_date": None}])
+        names, token = self.poll(self.user.select(), token,
+                                 watermark="u_date")
+        self.assertEqual(names, ["Oli", "Jan"])
+        self.assertEqual(self.poll(self.user.select(), token,
+                                   watermark="u_date")[0], [])
+
+    def test_schema(self):
+        schema = qsqla.QuerySchema(User, watermark="u_id")
+        names, token = self.poll(schema, "")
+        self.assertEqual(names, ["Micha", "Oli"])
+        self.assertEqual(self.poll(schema, token)[0], ["Tom"])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, qsqla.query, self.user.select(), [],
+                          since="")
+        self.assertRaises(ValueError, qsqla.query, self.user.select(), [],
+                          since="", watermark="u_date", order="u_name")
+        self.assertRaises(KeyError, qsqla.QuerySchema, User,
+                          watermark="missing")
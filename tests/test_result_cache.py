@@ -0,0 +1,139 @@
+import os
+import shutil
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+from qsqla.result_cache import (MemoryBackend, ResultCache, SQLiteBackend,
+                                fingerprint)
+
+from tests.test_qsqla import Base, DBTestCase, User
+
+
+class ResultCacheTests(object):
+    def test_hit(self):
+        f = [{"name": "u_name", "op": "eq", "val": "Oli"}]
+        self.assertEqual(self.names(f), ['Oli'])
+        self.db.execute(self.user.update().values(u_name='Olli'))
+        self.assertEqual(self.names(f), ['Oli'])
+
+    def test_invalidate_table(self):
+        f = [{"name": "u_name", "op": "eq", "val": "Oli"}]
+        self.assertEqual(self.names(f), ['Oli'])
+        self.db.execute(self.user.update().values(u_name='Oli'))
+        self.cache.invalidate(self.user)
+        self.assertEqual(self.names(f), ['Oli', 'Oli', 'Oli'])
+
+    def test_invalidate_other_table(self):
+        f = [{"name": "u_name", "op": "eq", "val": "Oli"}]
+        self.assertEqual(self.names(f), ['Oli'])
+        self.db.execute(self.user.update().values(u_name='Oli'))
+        self.cache.invalidate("pet")
+        self.assertEqual(self.names(f), ['Oli'])
+
+    def test_ttl(self):
+        f = [{"name": "u_id", "op": "gt", "val": "1"}]
+        self.assertEqual(self.names(f, ttl=0.01), ['Oli', 'Tom'])
+        self.db.execute(self.user.delete().where(self.user.c.u_id == 3))
+        time.sleep(0.02)
+        self.assertEqual(self.names(f), ['Oli'])
+
+    def test_hooks(self):
+        self.cache.install_hooks(self.engine)
+        f = [{"name": "u_id", "op": "gt", "val": "1"}]
+        self.assertEqual(self.names(f), ['Oli', 'Tom'])
+        self.db.execute(self.user.delete().where(self.user.c.u_id == 3))
+        self.assertEqual(self.names(f), ['Oli'])
+
+    def test_orm_with_relation(self):
+        f = [{"name": "pets", "op": "with", "val": "p_name__eq=Hooch"}]
+        rows = self.cache.execute(self.db, User, f, order="u_id")
+        self.assertEqual([row["u_name"] for row in rows], ['Micha', 'Oli'])
+        self.db.execute(self.user_pet.delete())
+        self.cache.invalidate("user_pet")
+        self.assertEqual(self.cache.execute(self.db, User, f, order="u_id"), [])
+
+    def test_selectables_differing_in_a_literal(self):
+        first = self.user.select().where(self.user.c.u_id == 1)
+        second = self.user.select().where(self.user.c.u_id == 2)
+        self.assertNotEqual(fingerprint(first, []), fingerprint(second, []))
+        rows = self.cache.execute(self.db, first, [])
+        self.assertEqual([row["u_name"] for row in rows], ['Micha'])
+        rows = self.cache.execute(self.db, second, [])
+        self.assertEqual([row["u_name"] for row in rows], ['Oli'])
+
+    def other_names(self, engine):
+        rows = self.cache.execute(engine, self.user.select(), [],
+                                  order="u_id")
+        return [row["u_name"] for row in rows]
+
+    def other_engine(self):
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        engine.execute(self.user.insert(), [{"u_name": "Other"}])
+        self.addCleanup(engine.dispose)
+        return engine
+
+    def test_databases_do_not_share_entries(self):
+        other = self.other_engine()
+        self.assertEqual(self.names([]), ['Micha', 'Oli', 'Tom'])
+        self.assertEqual(self.other_names(other), ['Other'])
+        self.assertNotEqual(fingerprint(self.user.select(), [], bind="a"),
+                            fingerprint(self.user.select(), [], bind="b"))
+
+    def test_invalidate_table_of_database(self):
+        other = self.other_engine()
+        self.assertEqual(self.names([]), ['Micha', 'Oli', 'Tom'])
+        self.assertEqual(self.other_names(other), ['Other'])
+        self.db.execute(self.user.delete().where(self.user.c.u_id > 1))
+        other.execute(self.user.update().values(u_name='Changed'))
+        self.cache.invalidate(self.user, bind=other)
+        self.assertEqual(self.names([]), ['Micha', 'Oli', 'Tom'])
+        self.assertEqual(self.other_names(other), ['Changed'])
+
+
+class TestMemoryResultCache(ResultCacheTests, DBTestCase):
+    def setUp(self):
+        super(TestMemoryResultCache, self).setUp()
+        self.cache = ResultCache(MemoryBackend(maxsize=10))
+        self.user_pet = User.pets.property.secondary
+
+    def names(self, filters, **kwargs):
+        rows = self.cache.execute(self.db, self.user.select(), filters,
+                                  order="u_id", **kwargs)
+        return [row["u_name"] for row in rows]
+
+    def test_fingerprint_is_normalized(self):
+        f1 = {"name": "u_id", "op": "gt", "val": "1"}
+        f2 = {"name": "U_NAME", "op": "ne", "val": "Oli"}
+        sel = self.user.select()
+        self.assertEqual(fingerprint(sel, [f1, f2], limit=1),
+                         fingerprint(sel, [f2, f1], limit=1))
+        self.assertNotEqual(fingerprint(sel, [f1, f2], limit=1),
+                            fingerprint(sel, [f1, f2], limit=2))
+
+
+class TestSQLiteResultCache(ResultCacheTests, DBTestCase):
+    def setUp(self):
+        super(TestSQLiteResultCache, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = ResultCache(
+            SQLiteBackend(os.path.join(self.tmpdir, "cache.sqlite"), maxsize=2))
+        self.user_pet = User.pets.property.secondary
+
+    def tearDown(self):
+        super(TestSQLiteResultCache, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def names(self, filters, **kwargs):
+        rows = self.cache.execute(self.db, self.user.select(), filters,
+                                  order="u_id", **kwargs)
+        return [row["u_name"] for row in rows]
+
+    def test_lru_eviction(self):
+        for val in ("1", "2", "3"):
+            self.names([{"name": "u_id", "op": "eq", "val": val}])
+        count = self.cache.backend.connection().execute(
+            "SELECT count(*) FROM entries").fetchone()[0]
+        self.assertEqual(count, 2)
@@ -0,0 +1,98 @@
+import unittest
+
+from sqlalchemy import (Column, Integer, MetaData, String, Table, create_engine,
+                        select)
+from sqlalchemy.dialects import postgresql
+
+import qsqla.query as qsqla
+from qsqla.cache import StatementCache
+from qsqla.policy import IndexPolicy
+
+
+metadata = MetaData()
+
+note = Table('note', metadata,
+             Column('id', Integer, primary_key=True),
+             Column('title', String(32)),
+             Column('body', String(256)))
+
+
+class TestSearch(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        metadata.create_all(self.engine)
+        self.db = self.engine.connect()
+        self.db.exec_driver_sql(
+            "CREATE VIRTUAL TABLE note_fts USING fts5(body, "
+            "content='note', content_rowid='id')")
+        self.db.execute(note.insert(), [
+            {"id": 1, "title": "a", "body": "connection timeout error"},
+            {"id": 2, "title": "b", "body": "timeout"},
+            {"id": 3, "title": "c", "body": "disk full error"}])
+        self.db.exec_driver_sql(
+            "INSERT INTO note_fts(note_fts) VALUES ('rebuild')")
+        self.search = {"body": {"fts_table": "note_fts"}}
+
+    def tearDown(self):
+        self.db.close()
+
+    def ids(self, selectable, value, **kwargs):
+        if not isinstance(selectable, qsqla.QuerySchema):
+            kwargs.setdefault("search", self.search)
+        sel = qsqla.query(selectable,
+                          [{"name": "body", "op": "search", "val": value}],
+                          order="id", **kwargs)
+        return [row.id for row in self.db.execute(sel)]
+
+    def test_sqlite(self):
+        self.assertEqual(self.ids(note.select(), "timeout"), [1, 2])
+        self.assertEqual(self.ids(note.select(), "error  timeout"), [1])
+        self.assertEqual(self.ids(note.select(), 'disk" OR timeout'), [])
+        self.assertEqual(self.ids(note.select(), ""), [])
+
+    def test_push_down_and_schema(self):
+        self.assertEqual(self.ids(note.select(), "error", push_down=True),
+                         [1, 3])
+        schema = qsqla.QuerySchema(note.select(), search=self.search)
+        self.assertEqual(self.ids(schema, "error"), [1, 3])
+
+    def test_statement_cache(self):
+        cache = StatementCache()
+        schema = qsqla.QuerySchema(note.select(), search=self.search)
+        for value, expected in [("error", [1, 3]), ("full", [3])]:
+            stm, params = cache.query(
+                schema, [{"name": "body", "op": "search", "val": value}],
+                order="id")
+            self.assertEqual([row.id for row in self.db.execute(stm, params)],
+                             expected)
+
+    def test_postgresql(self):
+        sel = qsqla.query(note.select(), [{"name": "body", "op": "search",
+                                           "val": "timeout error"}],
+                          search={"body": None})
+        sql = str(sel.compile(dialect=postgresql.dialect()))
+        self.assertIn("to_tsvector('english'::regconfig, query.body) @@ "
+                      "plainto_tsquery('english'::regconfig, ", sql)
+
+    def test_not_configured(self):
+        with self.assertRaises(TypeError):
+            qsqla.query(note.select(), [{"name": "title", "op": "search",
+                                         "val": "a"}], search=self.search)
+        with self.assertRaises(TypeError):
+            qsqla.query(note.select(), [{"name": "body", "op": "search",
+                                         "val": "a"}])
+        with self.assertRaises(TypeError):
+            qsqla.QuerySchema(note.select(), search={"id": None})
+
+    def test_configuration_is_per_query(self):
+        self.assertEqual(self.ids(note.select(), "error"), [1, 3])
+        with self.assertRaises(TypeError):
+            self.ids(note.select(), "error", search=None)
+
+    def test_key_not_selected(self):
+        with self.assertRaises(TypeError):
+            self.ids(select([note.c.body]), "error")
+
+    def test_policy(self):
+        policy = IndexPolicy(note.select())
+        policy.check([{"name": "body", "op": "search", "val": "error"}])